@@ -0,0 +1,1253 @@
+# Offline micro-benchmarks for jarvis.py, run with `python jarvis.py --benchmark [name ...]` (all when
+# no name is given). They never call the LLM or perform real desktop actions; the ones that swap a
+# jarvis global (the model, a scheduler, an action function, ...) put it back when they finish.
+import os
+import platform
+import subprocess
+import time
+import re
+import random
+import threading
+import asyncio
+import sys
+import shutil
+from types import SimpleNamespace
+
+import jarvis
+
+BENCHMARKS = {}
+
+def help_text_command_phrases():
+    # The quoted example phrases from the help reference, lowercased like route_command does
+    phrases = []
+    for line in jarvis.JARVIS_HELP_TEXT.splitlines():
+        line = line.strip()
+        if not line.startswith("'"): continue
+        examples = re.split(r"\s+-\s+", line, maxsplit=1)[0]
+        phrases.extend(p.lower().strip() for p in re.findall(r"'(.*?)'(?=\s*,|\s*/|\s*$)", examples))
+    return phrases
+
+# The command cascade process_command ran before the intent router, in its order and with its pattern
+# strings and keyword tests: (intent, pattern strings, re flags) or (intent, None, predicate on text).
+# Handler-side checks that could fall through to the next intent are left out, as on the router side.
+LEGACY_DISPATCH_CASCADE = [
+    ("gui", [r'\b(open gui|launch interface|show gui|graphical mode|start interface)\b'], 0),
+    ("set_timer", [r'\b(set|start|create|new)\s+(?:a\s+)?timer\s+(?:for\s+|of\s+)?([\w\s\d.,:"\'-]+?)(?:\s+(?:called|named|for|regarding)\s*["\']?(.+?)["\']?)?$',
+                   r'^(timer)\s+([\w\s\d.,:"\'-]+?)(?:\s+(?:called|named|for|regarding)\s*["\']?(.+?)["\']?)?$'], re.IGNORECASE),
+    ("cancel_timer", [r'\b(cancel|stop|delete|remove)\s+(?:the\s+)?timer(?:\s+(?:for|called|named|with id|id)\s*["\']?(.+?)["\']?)?$'], re.IGNORECASE),
+    ("cancel_all_timers", [r'\b(cancel all timers|stop all timers|clear all timers)\b'], re.IGNORECASE),
+    ("calculate", [r'\b(what is|calculate|compute|evaluate|maths?|calc)\s+(.+)'], re.IGNORECASE),
+    ("weather", [r'\b(?:what.s\s+the\s+weather|weather\s+(?:in|for|like\s+in)|how.s\s+the\s+weather\s+(?:in|for))\s+([\w\s,-]+)\b'], re.IGNORECASE),
+    ("roll_dice", [r'\b(roll a dice|roll dice|dice roll)\b'], 0),
+    ("flip_coin", [r'\b(flip a coin|coin flip|heads or tails)\b'], 0),
+    ("joke", [r'\b(tell me a joke|joke|make me laugh|say something funny|another joke)\b'], 0),
+    ("random_number", [r'\b(?:random number|generate number|pick a number)\s+(?:between\s+)?(-?\d+)\s+(?:and|to)\s+(-?\d+)\b'], re.IGNORECASE),
+    ("uptime", [r'\b(system uptime|how long (?:has )?(?:this pc|the system|it) (?:been )?running|pc uptime|server uptime|uptime)\b'], re.IGNORECASE),
+    ("empty_recycle_bin", [r'\b(empty recycle bin|empty (?:the )?trash|clear (?:the )?trash)\b'], re.IGNORECASE),
+    ("lock_screen", [r'\b(lock screen|lock (?:my|the) (?:computer|pc|system)|secure screen)\b'], re.IGNORECASE),
+    ("power", [r'\b(shutdown|restart|reboot|log off|logout|sign out)\b(?:\s+(?:my|the)?\s*(?:computer|pc|system|session|now))?'], re.IGNORECASE),
+    ("datetime", [r'\b(what time is it|current time|date and time|today.s date|tell me the date|tell me the time)\b'], 0),
+    ("system_stats", [r'\b(system status|pc status|system stats|cpu usage|ram usage|performance|system load)\b'], 0),
+    ("internet_check", [r'\b(check internet|internet connection|am i online|are we connected|internet status)\b'], 0),
+    ("list_directory", [r'\b(?:list files|show files|directory contents|ls|dir)\s*(?:in|of\s+)?(["\']?[\w\s\/\.:\-\\]+["\']?)?'], re.IGNORECASE),
+    ("create_directory", [r'\b(?:create directory|make directory|mkdir|new folder)\s+(["\']?[\w\s\/\.:\-\\]+["\']?)'], re.IGNORECASE),
+    ("open_file", [r'\b(?:open file|show file|edit file|view file|launch file)\s+(["\']?[\w\s\/\.:\-\\]+["\']?)'], re.IGNORECASE),
+    ("take_note", [r'\b(?:take a note|make a note|note down|remember this|add note|note that|remember that)\s*[:\s]\s*(.+)'], re.IGNORECASE),
+    ("view_notes", [r'\b(show notes|view notes|what are my notes|read my notes|list notes)\b'], re.IGNORECASE),
+    ("clear_notes", [r'\b(clear notes|delete all notes|forget notes|erase notes|remove all notes)\b'], re.IGNORECASE),
+    ("copy", [r'\b(?:copy to clipboard|copy this|copy)\s*[:\s]\s*(.+)', r"\bcopy\s+(['\"])(.+?)\1"], re.IGNORECASE),
+    ("read_clipboard", [r'\b(paste from clipboard|what.s on the clipboard|get clipboard|show clipboard|read clipboard)\b'], re.IGNORECASE),
+    ("type_text", [r'\b(?:type this|type out|enter text|type)\s*[:\s]\s*(.+)', r"\btype\s+(['\"])(.+?)\1"], re.IGNORECASE),
+    ("open_url", [r'\b(open|launch|go to|visit|show me)\s+((?:https?:\/\/)?[\w\d\-_]+(?:\.[\w\d\-_]+)+(?:[\/\?#][^\s]*)?)'], re.IGNORECASE),
+    ("web_search", [r'\b(search|find|google|look up|what is|who is|tell me about|search for)\s+(?:for\s+)?(.+)'], re.IGNORECASE),
+    ("open_app", [r'\b(open|launch|start)\s+(?:app(?:lication)?\s+)?([\w\s().-]+?)(?:\s+app(?:lication)?)?$', r'\b(open|launch|start)\s+([\w\s().-]+)'], re.IGNORECASE),
+    ("close_app", [r'\b(close|quit|exit|terminate|kill)\s+(?:app(?:lication)?\s+)?([\w\s().-]+?)(?:\s+app(?:lication)?)?$', r'\b(close|quit|exit|terminate|kill)\s+([\w\s().-]+)'], re.IGNORECASE),
+    ("media_playpause", None, lambda text: any(kw in text for kw in ["play", "pause", "resume"]) and any(kw in text for kw in ["music", "song", "track", "sound", "audio", "video", "media", "playback"])),
+    ("media_next", None, lambda text: any(kw in text for kw in ["next", "skip"]) and any(kw in text for kw in ["song", "track", "media"])),
+    ("media_previous", None, lambda text: any(kw in text for kw in ["previous", "last", "back"]) and any(kw in text for kw in ["song", "track", "media"])),
+    ("media_stop", None, lambda text: "stop" in text and any(kw in text for kw in ["music", "playback", "media", "song", "video", "sound", "audio"])),
+    ("volume_level", [r'(set\s+)?volume\s+(?:to\s+|level\s+)?(\d{1,3})(?:%|\spercent)?'], re.IGNORECASE),
+    ("volume_up", None, lambda text: any(kw in text for kw in ["volume up", "increase volume", "louder", "turn it up", "raise volume"])),
+    ("volume_down", None, lambda text: any(kw in text for kw in ["volume down", "decrease volume", "quieter", "softer", "turn it down", "lower volume"])),
+    ("mute", [r'\b(mute|unmute)\b'], re.IGNORECASE),
+    ("focus_window", [r'\b(focus on|switch to|bring to front|activate window|focus)\s+([\w\s\.:-]+)'], re.IGNORECASE),
+    ("close_tab", None, lambda text: any(kw in text for kw in ["close tab", "close current tab", "close this tab"])),
+    ("help", None, lambda text: text in ["help", "list commands", "show commands", "what can you do", "commands"]),
+]
+
+def benchmark_intent_router(repeats=2000):
+    # Per-utterance dispatch cost over the help-text phrases: the old cascade (re.search on each pattern
+    # string in turn; re's own cache means those were looked up, not recompiled, on every input) vs the
+    # router's trigger scan plus the candidate intents' patterns, and the keyword checks in the handlers
+    # of pattern-less intents (run for real, with the actions they would call stubbed out).
+    corpus = help_text_command_phrases()
+    history = [] # The old cascade read the last model reply for pending confirmations on every input
+    dialogue = jarvis.DialogueState()
+
+    def legacy_dispatch(text):
+        relevant_history = [item for item in history if item['role'] == 'model']
+        last_jarvis_response = relevant_history[-1]['text'].lower() if relevant_history else ""
+        if "emptying the recycle bin is a permanent action" in last_jarvis_response or \
+           "emptying the recycle bin is permanent" in last_jarvis_response: return "confirm_empty_recycle_bin"
+        if re.search(r'wish to (shutdown|restart|logout) the computer', last_jarvis_response): return "confirm_power"
+        for name, sources, test in LEGACY_DISPATCH_CASCADE:
+            if sources is None:
+                if test(text): return name
+            elif any(re.search(source, text, test) for source in sources): return name
+        return None
+
+    def router_dispatch(text):
+        for route, match in jarvis.iter_intent_matches(text):
+            if match is not None or route["handler"](None, text, dialogue) is not None: return route["name"]
+        return None
+
+    stubbed_actions = {"control_media": lambda *args: (True, ""), "change_volume": lambda *args: (True, ""),
+                       "close_current_tab": lambda: (True, ""), "print_help_to_console": lambda: None}
+    saved_actions = {name: getattr(jarvis, name) for name in stubbed_actions}
+    for name, stub in stubbed_actions.items(): setattr(jarvis, name, stub)
+    try:
+        # Both must pick the same intent wherever the router didn't pick one added since the old cascade
+        legacy_intents = {name for name, _, _ in LEGACY_DISPATCH_CASCADE}
+        shared = [(text, legacy_dispatch(text), router_dispatch(text)) for text in corpus]
+        shared = [item for item in shared if item[2] is None or item[2] in legacy_intents]
+        mismatches = [(text, old, new) for text, old, new in shared if old != new]
+        assert not mismatches, f"Old cascade and intent router disagree on: {mismatches}"
+        for label, dispatch in (("baseline re.search cascade", legacy_dispatch), ("intent router", router_dispatch)):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                for text in corpus: dispatch(text)
+            per_utterance_us = (time.perf_counter() - start) / (repeats * len(corpus)) * 1e6
+            print(f"BENCH: intent_router | {label:<26} | {len(corpus)} phrases | {per_utterance_us:8.2f} us/utterance")
+        print(f"BENCH: intent_router | same intent on all {len(shared)} phrases the old cascade also covers")
+    finally:
+        for name, action in saved_actions.items(): setattr(jarvis, name, action)
+BENCHMARKS["intent_router"] = benchmark_intent_router
+
+class BenchmarkStubModel:
+    # Stands in for genai.GenerativeModel: the reply arrives as `chunk_count` chunks, `chunk_delay`
+    # seconds apart (a non-streaming call waits for all of them, like the real API).
+    def __init__(self, chunk_count=20, chunk_delay=0.02):
+        self.chunk_count = chunk_count
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+
+    def make_response(self, text):
+        return SimpleNamespace(text=text, candidates=[SimpleNamespace(content=SimpleNamespace(parts=[text]))],
+                               prompt_feedback=SimpleNamespace(block_reason=None, block_reason_message=None))
+
+    def reply_chunks(self):
+        return [f"Certainly, part {i + 1} of the reply. " for i in range(self.chunk_count)]
+
+    async def stream_chunks(self):
+        for chunk_text in self.reply_chunks():
+            await asyncio.sleep(self.chunk_delay)
+            yield self.make_response(chunk_text)
+
+    def start_chat(self, history=None):
+        return BenchmarkStubChatSession(self, history or [])
+
+    async def generate_content_async(self, contents, stream=False):
+        self.calls += 1
+        self.last_contents = contents
+        if stream:
+            return BenchmarkStubStream(self.stream_chunks())
+        await asyncio.sleep(self.chunk_delay * self.chunk_count)
+        return self.make_response("".join(self.reply_chunks()))
+
+class BenchmarkStubStream:
+    # Async-iterable streamed response with the prompt_feedback attribute the real one exposes up front
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.prompt_feedback = SimpleNamespace(block_reason=None, block_reason_message=None)
+
+    def __aiter__(self):
+        return aiter(self.chunks)
+
+class BenchmarkStubChatSession:
+    # What start_chat() returns: send_message_async() goes to the stub with the full structured contents
+    def __init__(self, stub_model, history):
+        self.stub_model = stub_model
+        self.history = list(history)
+
+    async def send_message_async(self, content, stream=False):
+        return await self.stub_model.generate_content_async(self.history + [{"role": "user", "parts": content}], stream=stream)
+
+def swap_in_benchmark_model(stub_model):
+    # Returns the (model, chat model, api key) to restore afterwards
+    previous = (jarvis.model, jarvis.chat_model, jarvis.GEMINI_API_KEY)
+    jarvis.model, jarvis.chat_model, jarvis.GEMINI_API_KEY = stub_model, stub_model, "benchmark-stub-key"
+    jarvis.model_ready_event.set() # No warm-up: get_model() returns the stub straight away
+    return previous
+
+def restore_benchmark_model(previous):
+    jarvis.model, jarvis.chat_model, jarvis.GEMINI_API_KEY = previous
+
+def benchmark_streaming_reply(chunk_count=20, chunk_delay=0.02):
+    previous_model, previous_streaming = swap_in_benchmark_model(BenchmarkStubModel(chunk_count, chunk_delay)), jarvis.STREAM_LLM_RESPONSES
+    try:
+        for streaming in (False, True):
+            jarvis.STREAM_LLM_RESPONSES = streaming
+            first_visible_at = []
+            start = time.perf_counter()
+            reply = jarvis.generate_jarvis_reply("benchmark prompt", "fallback",
+                                          on_chunk=lambda chunk: first_visible_at or first_visible_at.append(time.perf_counter()))
+            total_ms = (time.perf_counter() - start) * 1000
+            first_ms = (first_visible_at[0] - start) * 1000
+            label = "streaming" if streaming else "non-streaming request"
+            print(f"BENCH: streaming_reply | {label:<26} | first visible char {first_ms:7.1f} ms | full reply {total_ms:7.1f} ms | {len(reply)} chars")
+    finally:
+        restore_benchmark_model(previous_model)
+        jarvis.STREAM_LLM_RESPONSES = previous_streaming
+BENCHMARKS["streaming_reply"] = benchmark_streaming_reply
+
+def benchmark_templated_reply(chunk_count=10, chunk_delay=0.03):
+    commands = ["roll a dice", "flip a coin", "what time is it", "calculate 12 * 7", "random number between 1 and 6"]
+    previous_model, previous_modes = swap_in_benchmark_model(BenchmarkStubModel(chunk_count, chunk_delay)), jarvis.ACTION_REPLY_MODES
+    try:
+        for label, modes in (("LLM rephrasing (stub model)", {}), ("templated fast path", previous_modes)):
+            jarvis.ACTION_REPLY_MODES = modes
+            llm_calls_before = jarvis.model.calls
+            start = time.perf_counter()
+            for command in commands:
+                intent_name, action_status = jarvis.route_command(command)
+                if not jarvis.render_templated_reply(intent_name, action_status):
+                    jarvis.generate_jarvis_reply(jarvis.build_llm_request(command, action_status), "fallback")
+            per_command_ms = (time.perf_counter() - start) / len(commands) * 1000
+            print(f"BENCH: templated_reply | {label:<28} | {per_command_ms:8.2f} ms/command | {jarvis.model.calls - llm_calls_before} LLM calls for {len(commands)} commands")
+    finally:
+        restore_benchmark_model(previous_model)
+        jarvis.ACTION_REPLY_MODES = previous_modes
+BENCHMARKS["templated_reply"] = benchmark_templated_reply
+
+def benchmark_prompt_builder(turns_to_measure=500):
+    window = jarvis.MAX_HISTORY_TURNS * 3 + 20
+    message = "Could you summarise the quarterly numbers for the board meeting tomorrow morning?"
+
+    def legacy_build(history, user_input_raw, action_status): # The old per-turn copy/slice/concat/format
+        items = list(history)
+        items.append({"role": "user", "text": user_input_raw})
+        if action_status: items.append({"role": "system", "text": action_status})
+        history_str = ""
+        for item in items[-window:]:
+            role_display = "Jarvis" if item['role'] == 'model' else "You" if item['role'] == 'user' else "System"
+            if item['role'] == 'system': history_str += f"{item['text']}\n"
+            else: history_str += f"{role_display}: {item['text']}\n"
+        return jarvis.JARVIS_PERSONA_BASE_PROMPT.format(history=history_str.strip(), user_input=user_input_raw)
+
+    for prior_turns in (10, 100, 1000, 10000):
+        history, builder = [], jarvis.PromptBuilder(jarvis.JARVIS_PERSONA_BASE_PROMPT, window)
+        for turn in range(prior_turns):
+            for role in ("user", "system", "model"):
+                history.append({"role": role, "text": f"{message} ({turn})"}); builder.append(role, f"{message} ({turn})")
+                if len(history) > window: history = history[-window:]
+        # Until lines get summarised away, the builder must reproduce the legacy prompt exactly
+        if builder.evicted_lines_total == 0 and legacy_build(history, message, jarvis.ACTION_STATUS_PREFIX + " ok") != builder.build(message, jarvis.ACTION_STATUS_PREFIX + " ok"):
+            print("WARN: PromptBuilder output differs from the legacy prompt.")
+        timings = {}
+        for label, build in (("legacy", lambda: legacy_build(history, message, jarvis.ACTION_STATUS_PREFIX + " ok")),
+                             ("builder", lambda: builder.build(message, jarvis.ACTION_STATUS_PREFIX + " ok"))):
+            start = time.perf_counter()
+            for _ in range(turns_to_measure): build()
+            timings[label] = (time.perf_counter() - start) / turns_to_measure * 1e6
+        print(f"BENCH: prompt_builder | after {prior_turns:>5} turns | legacy {timings['legacy']:7.2f} us/turn | PromptBuilder {timings['builder']:7.2f} us/turn")
+BENCHMARKS["prompt_builder"] = benchmark_prompt_builder
+
+def benchmark_context_budget(turns=60):
+    # A conversation with one 50 KB paste and a steady stream of ordinary turns
+    window = jarvis.MAX_HISTORY_TURNS * 3 + 20
+    builder = jarvis.PromptBuilder(jarvis.JARVIS_PERSONA_BASE_PROMPT, window)
+    history = []
+    legacy_tokens, budget_tokens, build_us = [], [], []
+    for turn in range(turns):
+        user_text = ("clipboard dump " * 3400) if turn == 5 else f"Question number {turn} about the project schedule and budget?"
+        for role, text in (("user", user_text), ("model", f"A considered answer to question {turn}, with a few details attached.")):
+            history.append({"role": role, "text": text}); builder.append(role, text)
+            if len(history) > window: history = history[-window:]
+        legacy_history = "\n".join(jarvis.PromptBuilder.render_line(item["role"], item["text"]) for item in history)
+        legacy_tokens.append(jarvis.estimate_tokens(jarvis.JARVIS_PERSONA_BASE_PROMPT.format(history=legacy_history, user_input="next")))
+        start = time.perf_counter()
+        prompt = builder.build("next")
+        build_us.append((time.perf_counter() - start) * 1e6)
+        budget_tokens.append(jarvis.estimate_tokens(prompt))
+    print(f"BENCH: context_budget | count-trimmed history | max prompt {max(legacy_tokens):6d} tokens | last prompt {legacy_tokens[-1]:6d} tokens")
+    print(f"BENCH: context_budget | token-budgeted        | max prompt {max(budget_tokens):6d} tokens | last prompt {budget_tokens[-1]:6d} tokens "
+          f"| {builder.evicted_lines_total} lines summarised | {sum(build_us) / len(build_us):.1f} us/build")
+BENCHMARKS["context_budget"] = benchmark_context_budget
+
+def benchmark_llm_backend(turns=20):
+    # Input size per request for the same conversation under both backends, against the stub model
+    saved = (jarvis.LLM_BACKEND, jarvis.prompt_builder, jarvis.chat_turn_buffer, jarvis.conversation_history)
+    previous_model = swap_in_benchmark_model(BenchmarkStubModel(1, 0))
+    try:
+        for backend in ("prompt", "chat"):
+            jarvis.LLM_BACKEND = backend
+            jarvis.prompt_builder, jarvis.chat_turn_buffer, jarvis.conversation_history = jarvis.PromptBuilder(jarvis.JARVIS_PERSONA_BASE_PROMPT, jarvis.MAX_HISTORY_TURNS * 3 + 20), jarvis.ChatTurnBuffer(), []
+            with_persona, without_persona, build_us = [], [], []
+            for turn in range(turns):
+                user_text = f"Remind me what we decided about item {turn} on the launch checklist."
+                start = time.perf_counter()
+                llm_request = jarvis.build_llm_request(user_text, None)
+                build_us.append((time.perf_counter() - start) * 1e6)
+                reply = jarvis.generate_jarvis_reply(llm_request, "fallback", context_label="benchmark")
+                request_tokens = jarvis.estimate_tokens(jarvis.llm_request_text(llm_request))
+                with_persona.append(request_tokens)
+                without_persona.append(request_tokens - (jarvis.estimate_tokens(jarvis.JARVIS_SYSTEM_INSTRUCTION) if backend == "chat" else 0))
+                jarvis.add_to_conversation_history("user", user_text)
+                jarvis.add_to_conversation_history("model", reply)
+            print(f"BENCH: llm_backend | {backend:<6} | avg input {sum(with_persona) / turns:7.0f} tokens/request "
+                  f"| {sum(without_persona) / turns:7.0f} excluding system instruction | {sum(build_us) / turns:6.1f} us/build")
+    finally:
+        restore_benchmark_model(previous_model)
+        jarvis.LLM_BACKEND, jarvis.prompt_builder, jarvis.chat_turn_buffer, jarvis.conversation_history = saved
+BENCHMARKS["llm_backend"] = benchmark_llm_backend
+
+def benchmark_response_cache(rounds=5):
+    # Latency of repeated requests with the cache off vs on, against a stub model with simulated latency.
+    # Replies to action statuses are cached; the open-ended questions (no status) always reach the model.
+    saved = (jarvis.RESPONSE_CACHE_ENABLED, jarvis.response_cache, jarvis.prompt_builder, jarvis.chat_turn_buffer, jarvis.conversation_history)
+    questions = [("open chrome", f"{jarvis.ACTION_STATUS_PREFIX} Application 'chrome' launch initiated."),
+                 ("Open Chrome!", f"{jarvis.ACTION_STATUS_PREFIX} Application 'chrome' launch initiated."),
+                 ("check internet", f"{jarvis.ACTION_STATUS_PREFIX} Internet connection appears to be active."),
+                 ("Tell me a joke about computers.", None), ("What is the capital of France?", None)]
+    previous_model = swap_in_benchmark_model(BenchmarkStubModel(4, 0.05))
+    try:
+        for enabled in (False, True):
+            jarvis.RESPONSE_CACHE_ENABLED = enabled
+            jarvis.response_cache = jarvis.ResponseCache(jarvis.RESPONSE_CACHE_MAX_ENTRIES, jarvis.RESPONSE_CACHE_TTL_SECONDS)
+            jarvis.prompt_builder, jarvis.chat_turn_buffer, jarvis.conversation_history = jarvis.PromptBuilder(jarvis.JARVIS_PERSONA_BASE_PROMPT, jarvis.MAX_HISTORY_TURNS * 3 + 20), jarvis.ChatTurnBuffer(), []
+            timings = []
+            for _ in range(rounds):
+                for question, action_status in questions:
+                    start = time.perf_counter()
+                    reply = jarvis.generate_cached_jarvis_reply(question, action_status, "fallback", on_chunk=lambda _text: None, context_label="benchmark")
+                    timings.append((time.perf_counter() - start) * 1000)
+                    jarvis.add_to_conversation_history("user", question)
+                    if action_status: jarvis.add_to_conversation_history("system", action_status)
+                    jarvis.add_to_conversation_history("model", reply)
+            print(f"BENCH: response_cache | {'on' if enabled else 'off':<3} | {len(timings)} questions | avg {sum(timings) / len(timings):7.2f} ms "
+                  f"| fastest {min(timings):7.3f} ms | {jarvis.response_cache.summary() if enabled else 'cache disabled'}")
+    finally:
+        restore_benchmark_model(previous_model)
+        jarvis.RESPONSE_CACHE_ENABLED, jarvis.response_cache, jarvis.prompt_builder, jarvis.chat_turn_buffer, jarvis.conversation_history = saved
+BENCHMARKS["response_cache"] = benchmark_response_cache
+
+def benchmark_timer_scheduler(timer_count=10000, fired_count=200):
+    # Set/cancel cost at timer_count timers vs the old sorted-list approach, then firing lateness
+    saved_scheduler = jarvis.timer_scheduler
+    try:
+        far_future = time.time() + 3600
+        deadlines = [far_future + random.random() * 3600 for _ in range(timer_count)]
+
+        old_timers = []
+        start = time.perf_counter()
+        for timer_id, end_time in enumerate(deadlines, 1):
+            old_timers.append((end_time, "1 hour", f"task {timer_id}", timer_id))
+            old_timers.sort()
+        old_set_us = (time.perf_counter() - start) * 1e6 / timer_count
+        start = time.perf_counter()
+        for timer_id in range(1, 1001):
+            old_timers = [t for t in old_timers if t[3] != timer_id]
+            old_timers.sort()
+        old_cancel_us = (time.perf_counter() - start) * 1e6 / 1000
+
+        jarvis.timer_scheduler = jarvis.TimerScheduler()
+        start = time.perf_counter()
+        for timer_id, end_time in enumerate(deadlines, 1):
+            jarvis.timer_scheduler.add(end_time, "1 hour", f"task {timer_id}")
+        new_set_us = (time.perf_counter() - start) * 1e6 / timer_count
+        start = time.perf_counter()
+        for timer_id in range(1, 1001):
+            jarvis.timer_scheduler.cancel_by_id(timer_id)
+        new_cancel_us = (time.perf_counter() - start) * 1e6 / 1000
+        print(f"BENCH: timer_scheduler | {timer_count} timers | set: list+sort {old_set_us:8.1f} us, heap {new_set_us:6.2f} us "
+              f"| cancel: list rebuild {old_cancel_us:8.1f} us, heap {new_cancel_us:6.2f} us")
+
+        # Firing accuracy: short timers on top of the 9k still pending, fired by the real checker task
+        fired_at = {}
+        stop_event = threading.Event()
+        def on_fire(notification):
+            fired_at[int(re.search(r"\(ID: (\d+)\)", notification).group(1))] = time.time()
+        checker = jarvis.async_core.submit(jarvis.run_timer_checker(stop_event, on_fire))
+        expected = {}
+        for index in range(fired_count):
+            end_time = time.time() + 0.05 + index * 0.005
+            expected[jarvis.timer_scheduler.add(end_time, "a moment", f"short {index}")] = end_time
+        while len(fired_at) < fired_count and time.time() < max(expected.values()) + 2: time.sleep(0.05)
+        stop_event.set(); jarvis.timer_scheduler.wake(); jarvis.async_core.wait(checker, 2)
+        lateness_ms = sorted((fired_at[timer_id] - end_time) * 1000 for timer_id, end_time in expected.items() if timer_id in fired_at)
+        print(f"BENCH: timer_scheduler | {len(lateness_ms)}/{fired_count} short timers fired | lateness median {lateness_ms[len(lateness_ms) // 2]:.2f} ms "
+              f"| max {lateness_ms[-1]:.2f} ms (old checker: up to 1000 ms)")
+    finally:
+        jarvis.timer_scheduler = saved_scheduler
+BENCHMARKS["timer_scheduler"] = benchmark_timer_scheduler
+
+def benchmark_persistent_store(note_count=100000, timer_count=50, history_count=20000):
+    # Startup restore time with note_count saved notes, and caller-side cost of queued vs per-write commits
+    import tempfile
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, "jarvis_bench.db")
+        seed = jarvis.JarvisStore(db_path)
+        with seed.lock:
+            seed.open_if_needed()
+            with seed.conn:
+                now = time.time()
+                seed.conn.executemany("INSERT INTO notes (content, created_at) VALUES (?, ?)",
+                                      ((f"Note {i}: remember to review item {i} of the quarterly plan", now) for i in range(note_count)))
+                seed.conn.executemany("INSERT INTO timers (id, end_time, duration, description) VALUES (?, ?, ?, ?)",
+                                      ((i, now + 60 * i, f"{i} minutes", f"task {i}") for i in range(1, timer_count + 1)))
+                seed.conn.executemany("INSERT INTO history (role, text, created_at) VALUES (?, ?, ?)",
+                                      (("user" if i % 2 else "model", f"History message {i}", now) for i in range(history_count)))
+        seed.close()
+
+        start = time.perf_counter()
+        store = jarvis.JarvisStore(db_path)
+        store.append_history("user", "one more message") # Its flush prunes the seeded history down to the cap
+        store.flush()
+        history_rows = store.query("SELECT COUNT(*) FROM history")[0][0]
+        prune_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        timers = store.load_timers()
+        history = store.load_recent_history(jarvis.RESTORED_HISTORY_MESSAGES)
+        restored_notes = store.count_notes()
+        restore_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        all_notes = store.list_notes()
+        load_all_ms = (time.perf_counter() - start) * 1000
+        print(f"BENCH: persistent_store | restore {len(timers)} timers + {len(history)} history msgs, {restored_notes} notes left on disk: {restore_ms:7.2f} ms "
+              f"| loading all {len(all_notes)} notes instead: {load_all_ms:7.2f} ms")
+        print(f"BENCH: persistent_store | history retention: {history_count + 1} saved messages pruned to {history_rows} "
+              f"(cap {jarvis.PERSISTED_HISTORY_MAX_MESSAGES}) in {prune_ms:.2f} ms")
+
+        writes = 2000
+        start = time.perf_counter()
+        for i in range(writes): store.add_note(f"queued note {i}")
+        queued_us = (time.perf_counter() - start) * 1e6 / writes
+        store.flush()
+        start = time.perf_counter()
+        for i in range(writes):
+            with store.conn: store.conn.execute("INSERT INTO notes (content, created_at) VALUES (?, ?)", (f"direct note {i}", time.time()))
+        direct_us = (time.perf_counter() - start) * 1e6 / writes
+        store.close()
+        print(f"BENCH: persistent_store | {writes} note writes on the caller thread: queued {queued_us:6.1f} us each, commit-per-write {direct_us:6.1f} us each")
+BENCHMARKS["persistent_store"] = benchmark_persistent_store
+
+def benchmark_notes_search(note_count=100000, repeats=20):
+    # Note query latency at note_count notes: FTS5 index vs the LIKE-scan fallback
+    import tempfile
+    rng = random.Random(7)
+    # Zipf-like word frequencies over a 5k-word vocabulary, roughly like real notes; the query words below are common ones
+    syllables = ["ka", "lo", "mi", "re", "tu", "sen", "dor", "pa", "vi", "qua", "ne", "ro", "shi", "ta", "gel", "bu"]
+    vocabulary = ["tax", "budget", "milk", "dentist", "garden", "review", "flight", "invoice"] + \
+                 ["".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(5000)]
+    word_weights = [1 / (rank + 8) for rank in range(len(vocabulary))]
+    tags = ["work", "home", "health", "finance", "travel", "ideas", "shopping", "family"]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store = jarvis.JarvisStore(os.path.join(temp_dir, "jarvis_bench.db"))
+        with store.lock:
+            store.open_if_needed()
+            with store.conn:
+                now = time.time()
+                rows = []
+                for i in range(note_count):
+                    note_tags = rng.sample(tags, rng.randint(0, 2))
+                    words = " ".join(rng.choices(vocabulary, word_weights, k=rng.randint(6, 14)))
+                    rows.append((f"{words} {' '.join('#' + t for t in note_tags)}", now, " ".join(note_tags)))
+                store.conn.executemany("INSERT INTO notes (content, created_at, tags) VALUES (?, ?, ?)", rows)
+        queries = [("one word", lambda: store.search_notes("dentist", None, jarvis.NOTES_PAGE_SIZE)),
+                   ("two words", lambda: store.search_notes("garden review", None, jarvis.NOTES_PAGE_SIZE)),
+                   ("prefix", lambda: store.search_notes("invo", None, jarvis.NOTES_PAGE_SIZE)),
+                   ("word + tag", lambda: store.search_notes("flight", "travel", jarvis.NOTES_PAGE_SIZE)),
+                   ("tag, page 50", lambda: store.search_notes("", "finance", jarvis.NOTES_PAGE_SIZE, 49 * jarvis.NOTES_PAGE_SIZE)),
+                   ("last 5", lambda: (5, store.recent_notes(5))),
+                   ("list, page 5000", lambda: (note_count, store.list_notes(jarvis.NOTES_PAGE_SIZE, 4999 * jarvis.NOTES_PAGE_SIZE)))]
+        for use_fts in (True, False):
+            store.notes_fts_available = use_fts
+            results = []
+            for label, run_query in queries:
+                start = time.perf_counter()
+                for _ in range(repeats): total, notes = run_query()
+                results.append(f"{label} {(time.perf_counter() - start) * 1000 / repeats:.2f} ms ({total} hits)")
+            print(f"BENCH: notes_search | {note_count} notes | {'fts5' if use_fts else 'like'} | " + " | ".join(results))
+        store.close()
+BENCHMARKS["notes_search"] = benchmark_notes_search
+
+def benchmark_startup(runs=3):
+    # Time from launching `python jarvis.py` to the CLI's first "You: " prompt, lazy vs eager imports,
+    # plus the heaviest imports on the path according to `python -X importtime`
+    import tempfile
+    with open(os.path.abspath(jarvis.__file__), "r", encoding="utf-8") as source_file:
+        source = source_file.read()
+    source = source.replace('GEMINI_API_KEY = "YOUR_GEMINI_API_KEY"', 'GEMINI_API_KEY = "benchmark-placeholder-key"', 1)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        child_env = dict(os.environ, HOME=temp_dir, USERPROFILE=temp_dir) # Keep the child's ~/.jarvis.db out of the real home
+        for label, preload in (("lazy", False), ("eager", True)):
+            script_path = os.path.join(temp_dir, f"jarvis_{label}.py")
+            with open(script_path, "w", encoding="utf-8") as script_file:
+                script_file.write(source.replace("PRELOAD_BACKENDS_AT_STARTUP = False", f"PRELOAD_BACKENDS_AT_STARTUP = {preload}", 1))
+            timings = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                child = subprocess.Popen([sys.executable, "-u", script_path], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, env=child_env, cwd=temp_dir)
+                watchdog = threading.Timer(60, child.kill); watchdog.start()
+                output = b""
+                while b"You: " not in output:
+                    chunk = child.stdout.read1(4096)
+                    if not chunk: break
+                    output += chunk
+                if b"You: " in output: timings.append((time.perf_counter() - start) * 1000)
+                try: child.communicate(b"exit\n", timeout=30)
+                except subprocess.TimeoutExpired: child.kill()
+                watchdog.cancel()
+            if not timings:
+                print(f"BENCH: startup | {label:<5} | the child never reached the prompt"); continue
+            print(f"BENCH: startup | {label:<5} | time to first prompt: median {sorted(timings)[len(timings) // 2]:7.0f} ms over {len(timings)} run(s)")
+
+        import_probe = subprocess.run([sys.executable, "-X", "importtime", "-c", "import sys; sys.argv = ['jarvis', '--benchmark']; import jarvis"],
+                                      capture_output=True, text=True, env=dict(child_env, PYTHONPATH=os.path.dirname(os.path.abspath(jarvis.__file__))), cwd=temp_dir)
+        # Children are logged before their parent, one level deeper: collect jarvis.py's direct imports
+        direct_imports, jarvis_micros = [], 0
+        for line in import_probe.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) != 3 or not fields[1].strip().isdigit(): continue
+            depth = (len(fields[2]) - len(fields[2].lstrip(" ")) - 1) // 2
+            if depth == 1: direct_imports.append((int(fields[1]), fields[2].strip()))
+            elif depth == 0 and fields[2].strip() == "jarvis": jarvis_micros = int(fields[1]); break
+            elif depth == 0: direct_imports = []
+        heaviest = ", ".join(f"{name} {micros / 1000:.1f} ms" for micros, name in sorted(direct_imports, reverse=True)[:5])
+        print(f"BENCH: startup | -X importtime: `import jarvis` {jarvis_micros / 1000:.0f} ms | heaviest imports: {heaviest}")
+BENCHMARKS["startup"] = benchmark_startup
+
+def benchmark_process_index(idle_count=1000, stubborn_count=3, lookups=5):
+    # close_application's lookup with idle_count extra processes running (old full psutil scan vs the
+    # index), then closing stubborn_count processes that ignore SIGTERM (serial waits vs one shared wait)
+    if platform.system() == "Windows" or not jarvis.backend_available("psutil"):
+        print("BENCH: process_index | skipped (needs psutil and a POSIX shell)"); return
+    import tempfile, shutil
+    def legacy_scan(app_name_lower, names_to_check):
+        matches = []
+        for proc in jarvis.psutil.process_iter(['pid', 'name', 'exe', 'cmdline']):
+            name = (proc.info.get('name') or "").lower()
+            exe_basename = os.path.basename(proc.info.get('exe') or "").lower()
+            if any(n in name or n in exe_basename for n in names_to_check) or \
+               any(app_name_lower in arg.lower() for arg in proc.info.get('cmdline') or []):
+                matches.append(proc)
+        return matches
+    def spawn(args, count):
+        return [subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                 start_new_session=True) for _ in range(count)]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        idle_binary = os.path.join(temp_dir, "jarvisbenchidle")
+        shutil.copy(shutil.which("sleep"), idle_binary)
+        idle = spawn([idle_binary, "120"], idle_count)
+        try:
+            time.sleep(0.5)
+            process_count = len(jarvis.psutil.pids())
+            start = time.perf_counter()
+            for _ in range(lookups): legacy_scan("nosuchapp", {"nosuchapp"})
+            legacy_ms = (time.perf_counter() - start) * 1000 / lookups
+            saved_index = jarvis.process_index
+            index = jarvis.ProcessIndex()
+            start = time.perf_counter(); index.find({"nosuchapp"}, "nosuchapp"); cold_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            for _ in range(lookups): index.find({"nosuchapp"}, "nosuchapp")
+            warm_ms = (time.perf_counter() - start) * 1000 / lookups
+            print(f"BENCH: process_index | {process_count} processes | lookup: full psutil scan {legacy_ms:7.1f} ms "
+                  f"| index first use {cold_ms:7.1f} ms, then {warm_ms:6.2f} ms (incremental refresh)")
+
+            stubborn_args = ["sh", "-c", "trap '' TERM; while :; do sleep 1; done # jarvisbenchstubborn"]
+            stubborn = spawn(stubborn_args, stubborn_count)
+            time.sleep(0.3)
+            start = time.perf_counter()
+            for proc in legacy_scan("jarvisbenchstubborn", {"jarvisbenchstubborn"}): # The old serial terminate/wait/kill
+                proc.terminate()
+                try: proc.wait(timeout=jarvis.PROCESS_TERMINATE_TIMEOUT_SECONDS)
+                except jarvis.psutil.TimeoutExpired: proc.kill(); proc.wait(timeout=1)
+            serial_s = time.perf_counter() - start
+            stubborn += spawn(stubborn_args, stubborn_count)
+            time.sleep(0.3)
+            jarvis.process_index = index
+            try:
+                start = time.perf_counter()
+                jarvis.close_application("jarvisbenchstubborn")
+                parallel_s = time.perf_counter() - start
+            finally:
+                jarvis.process_index = saved_index
+            print(f"BENCH: process_index | close {stubborn_count} processes ignoring SIGTERM: serial {serial_s:5.2f} s | parallel {parallel_s:5.2f} s")
+        finally:
+            for proc in idle + locals().get("stubborn", []):
+                try: proc.kill(); proc.wait(timeout=5)
+                except Exception: pass
+BENCHMARKS["process_index"] = benchmark_process_index
+
+def benchmark_window_inventory(window_count=500, focuses=50, enumerate_cost_us=20):
+    # focus_window against a fake backend of window_count windows whose enumeration costs enumerate_cost_us
+    # per window (roughly what EnumWindows plus title reads cost): the old double scan with its fixed
+    # 100 ms re-activate sleep vs the cached inventory, ranking and confirmed activation
+    class FakeWindow:
+        def __init__(self, backend, title, minimized=False):
+            self.backend, self.title, self.isMinimized, self.visible = backend, title, minimized, True
+        @property
+        def isActive(self): return self.backend.active is self
+        def activate(self):
+            self.backend.activations += 1
+            if not self.title.endswith("(stuck)"): self.backend.active = self
+        def restore(self): self.isMinimized = False
+    class FakeBackend:
+        def __init__(self):
+            apps = ["Google Chrome", "Visual Studio Code", "Slack", "Terminal", "Spotify", "Notepad", "Explorer", "Outlook"]
+            self.windows = [FakeWindow(self, f"Document {i} - {apps[i % len(apps)]}", minimized=i % 7 == 0) for i in range(window_count)]
+            self.active, self.enumerations, self.activations = None, 0, 0
+        def getAllWindows(self):
+            self.enumerations += 1
+            end = time.perf_counter() + enumerate_cost_us * len(self.windows) / 1e6
+            while time.perf_counter() < end: pass
+            return list(self.windows)
+        def getWindowsWithTitle(self, title): # Case-sensitive substring, like pygetwindow
+            return [w for w in self.getAllWindows() if title in w.title]
+    def legacy_focus(backend, keyword):
+        keyword_lower = keyword.lower(); windows = backend.getWindowsWithTitle(keyword_lower)
+        if not windows: windows = [w for w in backend.getAllWindows() if keyword_lower in w.title.lower() and w.visible and not w.isMinimized]
+        if not windows: windows = [w for w in backend.getAllWindows() if keyword_lower in w.title.lower()]
+        if not windows: return False
+        target = ([w for w in windows if w.isActive] or [w for w in windows if w.visible and not w.isMinimized] or windows)[0]
+        if target.isMinimized: target.restore()
+        target.activate(); time.sleep(0.1); target.activate()
+        return True
+    # keyword -> whether a matching window exists ("Document 7" is an Outlook window, so the Notepad one is a near miss)
+    expected = {"document 42": True, "slack": True, "spotfy": True, "document 7 - notepad": False, "vs code": True, "terminal": True}
+    keywords = list(expected)
+    queries = [keywords[i % len(keywords)] for i in range(focuses)]
+    backend = FakeBackend()
+    start = time.perf_counter()
+    legacy_found = sum(legacy_focus(backend, keyword) for keyword in queries)
+    legacy_ms = (time.perf_counter() - start) * 1000 / focuses
+    legacy_enumerations = backend.enumerations
+    backend = FakeBackend()
+    saved_inventory = jarvis.window_inventory
+    jarvis.window_inventory = jarvis.WindowInventory(backend)
+    try:
+        start = time.perf_counter()
+        results = [jarvis.focus_window(keyword) for keyword in queries]
+        new_ms = (time.perf_counter() - start) * 1000 / focuses
+    finally:
+        jarvis.window_inventory = saved_inventory
+    wrong = sum(ok != expected[keyword] for keyword, (ok, _) in zip(queries, results))
+    print(f"BENCH: window_inventory | {window_count} windows, {focuses} focus requests | old {legacy_ms:7.2f} ms/focus, "
+          f"{legacy_enumerations} enumerations, {legacy_found} found | inventory {new_ms:6.2f} ms/focus, "
+          f"{backend.enumerations} enumerations, {sum(ok for ok, _ in results)} found, {wrong} not as expected")
+    for keyword, (ok, message) in list(zip(queries, results))[:len(keywords)]: print(f"BENCH: window_inventory | '{keyword}' -> {message}")
+
+    backend = FakeBackend() # A window that never reports focus: one activate(), a failure, and no remembered match
+    backend.windows.append(FakeWindow(backend, "Installer (stuck)"))
+    inventory = jarvis.WindowInventory(backend)
+    jarvis.window_inventory = inventory
+    try:
+        start = time.perf_counter()
+        ok, message = jarvis.focus_window("installer")
+        stuck_ms = (time.perf_counter() - start) * 1000
+    finally:
+        jarvis.window_inventory = saved_inventory
+    print(f"BENCH: window_inventory | 'installer' (never takes focus) -> {message} | {stuck_ms:.0f} ms, "
+          f"{backend.activations} activate() call(s), remembered: {'installer' in inventory.last_match}")
+BENCHMARKS["window_inventory"] = benchmark_window_inventory
+
+def benchmark_system_stats(queries=200, legacy_queries=3):
+    # 'system status' latency: the old blocking cpu_percent(interval=0.5) snapshot vs reading the sampler,
+    # plus 'average cpu over the last hour' and 'top 5 processes' on a full ring buffer
+    if not jarvis.backend_available("psutil"):
+        print("BENCH: system_stats | skipped (needs psutil)"); return
+    start = time.perf_counter()
+    for _ in range(legacy_queries):
+        jarvis.psutil.cpu_percent(interval=0.5); jarvis.psutil.virtual_memory(); jarvis.psutil.disk_usage('/')
+    legacy_ms = (time.perf_counter() - start) * 1000 / legacy_queries
+    saved_sampler = jarvis.system_stats_sampler
+    sampler = jarvis.SystemStatsSampler(1800, 0.05, 0.5)
+    jarvis.system_stats_sampler = sampler
+    try:
+        start = time.perf_counter(); sampler.start(); first_ms = (time.perf_counter() - start) * 1000
+        time.sleep(1.0) # Let the sampler take some real samples and a process scan
+        sampler.stop(); sampler.thread.join()
+        real_samples = sampler.count
+        start = time.perf_counter()
+        for _ in range(queries): jarvis.get_system_stats_action()
+        status_ms = (time.perf_counter() - start) * 1000 / queries
+        with sampler.lock: # Fill the rest of the ring with synthetic samples
+            for i in range(sampler.capacity):
+                sampler.record(time.time() + i * sampler.interval, {"cpu": i % 100, "ram": 50.0, "disk": 40.0, "net_sent": 1e3, "net_recv": 1e4})
+        start = time.perf_counter()
+        for _ in range(queries): jarvis.get_stats_average_action("cpu", 3600)
+        average_ms = (time.perf_counter() - start) * 1000 / queries
+        start = time.perf_counter()
+        for _ in range(queries): ok, top_message = jarvis.get_top_processes_action("memory", 5)
+        top_ms = (time.perf_counter() - start) * 1000 / queries
+        print(f"BENCH: system_stats | 'system status': old {legacy_ms:7.1f} ms | sampler first use {first_ms:6.1f} ms, "
+              f"then {status_ms:6.3f} ms ({real_samples} real samples)")
+        print(f"BENCH: system_stats | {sampler.capacity}-sample ring: average over the last hour {average_ms:6.3f} ms "
+              f"| top 5 by memory {top_ms:6.3f} ms")
+        print(f"BENCH: system_stats | {jarvis.get_stats_average_action('cpu', 3600)[1]}")
+        print(f"BENCH: system_stats | {top_message}")
+    finally:
+        jarvis.system_stats_sampler = saved_sampler
+BENCHMARKS["system_stats"] = benchmark_system_stats
+
+def benchmark_directory_listing(entry_count=500000, nested_dirs=200, nested_files=50):
+    # Listing a generated flat directory of entry_count files: the old listdir + isfile/isdir per entry vs the
+    # scandir summary, a largest-first page, a glob-filtered page and 'next 20'; then a recursive listing of a
+    # nested tree of nested_dirs directories with nested_files files each
+    import tempfile
+    def legacy_list(actual_path):
+        items = os.listdir(actual_path)
+        files = [item for item in items if os.path.isfile(os.path.join(actual_path, item))]
+        dirs = [item for item in items if os.path.isdir(os.path.join(actual_path, item))]
+        return len(files), len(dirs)
+    def timed(function, *args, **kwargs):
+        start = time.perf_counter(); result = function(*args, **kwargs)
+        return (time.perf_counter() - start) * 1000, result
+    with tempfile.TemporaryDirectory() as temp_dir:
+        flat = os.path.join(temp_dir, "flat")
+        os.mkdir(flat)
+        start = time.perf_counter()
+        for i in range(entry_count):
+            with open(os.path.join(flat, f"file{i:07d}.{'pdf' if i % 100 == 0 else 'txt'}"), "wb") as f:
+                if i % 1000 == 0: f.write(b"x" * i)
+        print(f"BENCH: directory_listing | generated {entry_count} files in {time.perf_counter() - start:.1f} s")
+        legacy_ms, _ = timed(legacy_list, flat)
+        summary_ms, _ = timed(jarvis.list_directory_contents_action, flat)
+        largest_ms, (_, largest) = timed(jarvis.list_directory_contents_action, flat, sort_by="largest")
+        next_ms = [timed(jarvis.list_directory_next_page_action, 20)[0] for _ in range(3)] # The first one sorts, the others slice
+        glob_ms, _ = timed(jarvis.list_directory_contents_action, flat, pattern="*.pdf")
+        print(f"BENCH: directory_listing | {entry_count} entries | old listdir+isfile+isdir {legacy_ms:8.1f} ms | scandir summary "
+              f"{summary_ms:7.1f} ms | largest first {largest_ms:7.1f} ms | '*.pdf' {glob_ms:7.1f} ms")
+        print(f"BENCH: directory_listing | largest first, then 'next 20' x3: " + " / ".join(f"{ms:7.1f} ms" for ms in next_ms))
+        print("BENCH: directory_listing | " + " / ".join(largest.splitlines()[:3]))
+        nested = os.path.join(temp_dir, "nested")
+        for d in range(nested_dirs):
+            directory = os.path.join(nested, *[f"level{d % 5}"] * (d % 4), f"dir{d}")
+            os.makedirs(directory, exist_ok=True)
+            for i in range(nested_files): open(os.path.join(directory, f"note{i}.md"), "wb").close()
+        recursive_ms, (_, recursive) = timed(jarvis.list_directory_contents_action, nested, recursive=True, max_depth=10, pattern="note1*.md")
+        print(f"BENCH: directory_listing | recursive 'note1*.md' over {nested_dirs * nested_files} files: {recursive_ms:7.1f} ms "
+              f"| {recursive.splitlines()[0]}")
+BENCHMARKS["directory_listing"] = benchmark_directory_listing
+
+def benchmark_file_index(indexed_files=1000000, files_per_dir=50, real_files=20000, queries=20):
+    # A crawl of a generated real tree of real_files files (full, then incremental after one change) vs an
+    # os.walk name search over it, then searches over an index of indexed_files synthetic entries
+    import tempfile
+    words = ["report", "invoice", "quarterly", "budget", "draft", "notes", "photo", "scan", "contract", "summary", "meeting", "plan"]
+    extensions = ["pdf", "docx", "xlsx", "jpg", "png", "txt", "md"]
+    def synthetic_name(i):
+        return f"{words[i % 12]}_{words[(i // 12) % 12]}_{i}.{extensions[i % 7]}"
+    def timed(function, *args, **kwargs):
+        start = time.perf_counter(); result = function(*args, **kwargs)
+        return (time.perf_counter() - start) * 1000, result
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tree = os.path.join(temp_dir, "tree")
+        for i in range(real_files):
+            directory = os.path.join(tree, f"project{i // 1000}", f"folder{(i // files_per_dir) % 20}")
+            if i % files_per_dir == 0: os.makedirs(directory, exist_ok=True)
+            open(os.path.join(directory, synthetic_name(i)), "wb").close()
+        index = jarvis.FileIndex(os.path.join(temp_dir, "files.db"), [tree])
+        full_ms, _ = timed(index.scan, full=True)
+        os.remove(os.path.join(tree, "project3", "folder7", synthetic_name(3 * 1000 + 7 * files_per_dir)))
+        incremental_ms, incremental = timed(index.scan)
+        def walk_search(text):
+            return [os.path.join(d, f) for d, _, names in os.walk(tree) for f in names if all(w in f.lower() for w in text.split())]
+        walk_ms, walk_hits = timed(walk_search, "quarterly report")
+        indexed_ms, _ = timed(index.search, "quarterly report")
+        print(f"BENCH: file_index | {real_files} real files | full crawl {full_ms:7.0f} ms | incremental rescan {incremental_ms:6.1f} ms "
+              f"({incremental['dirs_read']} dirs re-read, {incremental['dirs_skipped']} unchanged)")
+        print(f"BENCH: file_index | 'quarterly report': os.walk search {walk_ms:6.1f} ms ({len(walk_hits)} hits) | index {indexed_ms:6.2f} ms")
+        index.close()
+
+        index = jarvis.FileIndex(os.path.join(temp_dir, "big.db"), [])
+        start = time.perf_counter()
+        for d in range(indexed_files // files_per_dir):
+            directory = os.path.join(temp_dir, "home", "Documents" if d % 2 else "Downloads", f"dir{d}")
+            first = d * files_per_dir
+            files = {synthetic_name(i): (extensions[i % 7], i * 37 % 100000, 1.7e9 + i) for i in range(first, first + files_per_dir)}
+            index.store_directory(directory, None, 0.0, files, [])
+        load_s = time.perf_counter() - start
+        size_mb = os.path.getsize(os.path.join(temp_dir, "big.db")) / 1024**2
+        downloads = os.path.join(temp_dir, "home", "Downloads")
+        cases = [("'quarterly report'", lambda: index.search("quarterly report")),
+                 ("'invoice 2024'", lambda: index.search("invoice 2024")),
+                 ("'contract' in Downloads", lambda: index.search("contract", under=downloads)),
+                 ("latest pdf in Downloads", lambda: index.search(extensions=("pdf",), under=downloads, newest=True, limit=1)),
+                 ("latest photo anywhere", lambda: index.search(extensions=jarvis.FILE_KIND_EXTENSIONS["photo"], newest=True, limit=1)),
+                 ("'qu' (too short for trigrams)", lambda: index.search("qu"))]
+        print(f"BENCH: file_index | {index.file_count()} indexed files loaded in {load_s:5.1f} s, {size_mb:5.0f} MB on disk "
+              f"(trigram search: {index.trigram_available})")
+        for label, run in cases:
+            start = time.perf_counter()
+            for _ in range(queries): hits = run()
+            print(f"BENCH: file_index | {label:32} {(time.perf_counter() - start) * 1000 / queries:7.2f} ms "
+                  f"| top: {os.path.basename(hits[0][0]) if hits else '-'}")
+        index.close()
+BENCHMARKS["file_index"] = benchmark_file_index
+
+def benchmark_calculator(repeats=2000, adversarial_budget_ms=50):
+    # Throughput over a mix of expressions with the compiled-expression cache cleared before every call
+    # (parse + validate + compile each time) vs warm, then worst-case inputs that must fail fast
+    expressions = ["2+2", "3 times 4", "2 to the power of 10", "sqrt(2)*pi", "15% of 200", "10!", "log(100, 10)",
+                   "(1+2)*(3+4)/5 - 6 % 4", "sin(pi/2) + cos(0)", "5 km in miles", "100 f to c", "12 squared minus 3"]
+    for warm in (False, True):
+        jarvis.compile_calculator_expression.cache_clear()
+        start = time.perf_counter()
+        for i in range(repeats):
+            if not warm: jarvis.compile_calculator_expression.cache_clear()
+            jarvis.calculate_action(expressions[i % len(expressions)])
+        per_call_us = (time.perf_counter() - start) * 1e6 / repeats
+        print(f"BENCH: calculator | {'warm cache' if warm else 'no cache  '} {per_call_us:7.1f} us/expression "
+              f"({1e6 / per_call_us:9.0f}/s) | {jarvis.compile_calculator_expression.cache_info()}")
+    adversarial = ["9**9**9", "2**10000000", "10**10**10", "(10**1000)*(10**1000)*(10**1000)*(10**1000)*(10**1000)",
+                   "factorial(100000)", "factorial(450)*factorial(450)", "1e308*1e308", "2**-10000000", "(-8)**(1/3)",
+                   "(" * 90 + "1" + ")" * 90, "1+" * 127 + "1", "9" * 300, "__import__('os').system('echo hi')",
+                   "(lambda: 1)()", "[1]*10**9", "'a'*10**9", "sqrt(-1)", "1/0", "log(0)"]
+    worst_ms, failures = 0.0, []
+    for expression in adversarial:
+        start = time.perf_counter(); success, message = jarvis.calculate_action(expression); elapsed_ms = (time.perf_counter() - start) * 1000
+        worst_ms = max(worst_ms, elapsed_ms)
+        if elapsed_ms > adversarial_budget_ms: failures.append(expression)
+        print(f"BENCH: calculator | {elapsed_ms:7.3f} ms | {expression[:40]:40} | {message[:90]}")
+    print(f"BENCH: calculator | adversarial inputs: worst {worst_ms:.2f} ms, "
+          + (f"OVER the {adversarial_budget_ms} ms budget: {failures}" if failures else f"all within the {adversarial_budget_ms} ms budget"))
+BENCHMARKS["calculator"] = benchmark_calculator
+
+def benchmark_request_scheduler(messages=40, conversations=3, work_ms=(5, 40)):
+    # Rapid-fire submissions whose processing takes a random work_ms: the old thread per message (peak
+    # concurrency, replies committed out of order) vs the scheduler (per-conversation order, back-pressure)
+    def make_work(committed, active, lock):
+        def work(key, index):
+            with lock: active[0] += 1; active[1] = max(active[1], active[0])
+            time.sleep(random.uniform(*work_ms) / 1000)
+            with lock: active[0] -= 1; committed.setdefault(key, []).append(index)
+        return work
+    def out_of_order(committed):
+        return sum(1 for order in committed.values() for a, b in zip(order, order[1:]) if b < a)
+    committed, active, lock = {}, [0, 0], threading.Lock()
+    work = make_work(committed, active, lock)
+    start = time.perf_counter()
+    threads = [threading.Thread(target=work, args=(i % conversations, i), daemon=True) for i in range(messages)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    legacy_s = time.perf_counter() - start
+    print(f"BENCH: request_scheduler | thread per message: {messages} messages in {legacy_s:5.2f} s | peak {active[1]} running at once "
+          f"| {out_of_order(committed)} replies committed out of order")
+
+    committed, active = {}, [0, 0]
+    work = make_work(committed, active, lock)
+    scheduler = jarvis.RequestScheduler(jarvis.GUI_WORKER_THREADS, jarvis.GUI_REQUEST_QUEUE_LIMIT)
+    start = time.perf_counter()
+    accepted = 0
+    for i in range(messages): # Back-pressure: a refused message is retried shortly, like a user sending it again
+        while scheduler.submit(i % conversations, f"message {i}", work, i % conversations, i) is None: time.sleep(0.005)
+        accepted += 1
+    while True:
+        metrics = scheduler.metrics()
+        if metrics["completed"] == messages: break
+        time.sleep(0.005)
+    scheduler_s = time.perf_counter() - start
+    print(f"BENCH: request_scheduler | scheduler ({jarvis.GUI_WORKER_THREADS} workers, queue {jarvis.GUI_REQUEST_QUEUE_LIMIT}): {accepted} messages in "
+          f"{scheduler_s:5.2f} s | peak {active[1]} running at once | {out_of_order(committed)} out of order | "
+          f"{metrics['rejected']} refused submissions | wait avg {metrics['avg_wait_ms']:.0f} ms, p95 {metrics['p95_wait_ms']:.0f} ms")
+    scheduler.submit("gui", "slow", time.sleep, 0.2)
+    time.sleep(0.02)
+    for text in ["volume up", "volume up", "what is 2+2"]: scheduler.submit("gui", text, lambda: None)
+    print(f"BENCH: request_scheduler | repeated command kept: {scheduler.depth('gui')[0]} of 3 waiting | "
+          f"cancelled on Esc: {scheduler.cancel_pending('gui')}")
+BENCHMARKS["request_scheduler"] = benchmark_request_scheduler
+
+def benchmark_async_core(request_count=500, chunk_count=4, chunk_delay=0.05):
+    # request_count LLM requests in flight at once against the stub model: one thread per request
+    # (the old shape, each blocked for the whole reply) vs coroutines on the async core
+    reply_seconds = chunk_count * chunk_delay
+    peak_threads = [threading.active_count()]
+    def blocking_request():
+        time.sleep(reply_seconds) # What a synchronous generate_content() call holds its thread for
+        peak_threads[0] = max(peak_threads[0], threading.active_count())
+    start = time.perf_counter()
+    threads = [threading.Thread(target=blocking_request, daemon=True) for _ in range(request_count)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    thread_ms = (time.perf_counter() - start) * 1000
+    print(f"BENCH: async_core | {request_count} requests, thread each | wall {thread_ms:7.1f} ms | peak threads {peak_threads[0]}")
+
+    previous_model = swap_in_benchmark_model(BenchmarkStubModel(chunk_count, chunk_delay))
+    try:
+        jarvis.async_core.ensure_started()
+        threads_before = threading.active_count()
+        start = time.perf_counter()
+        futures = [jarvis.async_core.submit(jarvis.generate_jarvis_reply_async(f"benchmark prompt {index}", "fallback", context_label="benchmark"))
+                   for index in range(request_count)]
+        peak_threads = threading.active_count()
+        replies = [future.result() for future in futures]
+        async_ms = (time.perf_counter() - start) * 1000
+        print(f"BENCH: async_core | {request_count} requests, async core | wall {async_ms:7.1f} ms | peak threads {peak_threads} "
+              f"(was {threads_before} before) | {sum(reply != 'fallback' for reply in replies)} replies")
+    finally:
+        restore_benchmark_model(previous_model)
+
+    # type_text-style delayed work: scheduling returns at once instead of sleeping in the caller
+    start = time.perf_counter()
+    delayed = [jarvis.async_core.submit(asyncio.sleep(reply_seconds)) for _ in range(request_count)]
+    schedule_ms = (time.perf_counter() - start) * 1000
+    for future in delayed: future.result()
+    print(f"BENCH: async_core | {request_count} delayed actions scheduled in {schedule_ms:.1f} ms "
+          f"(blocking sleeps: {request_count * reply_seconds * 1000:.0f} ms serially)")
+BENCHMARKS["async_core"] = benchmark_async_core
+
+def benchmark_gui_render(message_count=50000, burst=250, old_path_limit=5000):
+    # message_count chat messages arriving `burst` per frame. The old path (tag_configure + state
+    # toggle + insert + see per message) runs on the first old_path_limit messages only, since its
+    # widget grows without bound. Uses a withdrawn real Tk window when a display is available, and
+    # otherwise a recording stand-in for the Text widget, which counts widget calls rather than Tk time.
+    if not jarvis.backend_available("tkinter"):
+        print("BENCH: gui_render | skipped: tkinter is not installed"); return
+
+    class RecordingTextWidget: # Just enough of tk.Text: keeps the lines and counts calls
+        def __init__(self):
+            self.lines, self.calls = [""], 0
+        def tag_configure(self, *args, **kwargs): self.calls += 1
+        def config(self, **kwargs): self.calls += 1
+        def see(self, index): self.calls += 1
+        def insert(self, index, *text_and_tags):
+            self.calls += 1
+            for text in text_and_tags[::2]:
+                pieces = text.split("\n")
+                self.lines[-1] += pieces[0]
+                self.lines.extend(pieces[1:])
+        def delete(self, start, end):
+            self.calls += 1
+            self.lines = [""] if end == jarvis.tk.END else self.lines[int(end.split(".")[0]) - 1:]
+
+    root = None
+    try:
+        root = jarvis.tk.Tk(); root.withdraw()
+        make_widget = lambda: jarvis.scrolledtext.ScrolledText(root, wrap=jarvis.tk.WORD, state='disabled')
+        pump = root.update
+        label = "Tk"
+    except jarvis.tk.TclError:
+        make_widget, pump, label = RecordingTextWidget, lambda: None, "recording widget (no display)"
+    roles = ["user", "model", "system_gui", "model"]
+    messages = [(f"{'You' if index % 4 == 0 else 'Jarvis'}: message {index} " + "lorem ipsum " * (index % 7), roles[index % 4])
+                for index in range(message_count)]
+    try:
+        widget = make_widget()
+        start = time.perf_counter()
+        for index, (text, role) in enumerate(messages[:old_path_limit], 1):
+            widget.tag_configure(role, **jarvis.CHAT_DISPLAY_TAG_STYLES.get(role, {}))
+            widget.config(state='normal')
+            widget.insert(jarvis.tk.END, text + "\n\n", (role,))
+            widget.config(state='disabled')
+            widget.see(jarvis.tk.END)
+            if index % burst == 0: pump()
+        old_ms = (time.perf_counter() - start) * 1000
+        old_calls = getattr(widget, "calls", None)
+        old_calls_str = f" | {old_calls / old_path_limit:.1f} widget calls/message" if old_calls is not None else ""
+        print(f"BENCH: gui_render | {label} | per-message inserts, first {old_path_limit} messages | {old_ms:8.1f} ms "
+              f"({old_ms / old_path_limit * 1000:.0f} us/message, unbounded scrollback){old_calls_str}")
+
+        saved_queue = jarvis.chat_render_queue
+        jarvis.chat_render_queue = jarvis.ChatRenderQueue(jarvis.GUI_SCROLLBACK_MAX_LINES, jarvis.GUI_SCROLLBACK_TRIM_LINES, jarvis.GUI_RENDER_INTERVAL_MS)
+        try:
+            widget = make_widget()
+            frame_callbacks = []
+            jarvis.chat_render_queue.attach(widget, lambda delay_ms, callback: frame_callbacks.append(callback))
+            start = time.perf_counter()
+            for index in range(0, message_count, burst): # One frame per burst
+                for text, role in messages[index:index + burst]:
+                    jarvis.chat_render_queue.enqueue(text + "\n\n", role)
+                while frame_callbacks: frame_callbacks.pop()()
+                pump()
+            new_ms = (time.perf_counter() - start) * 1000
+            stats = jarvis.chat_render_queue.stats
+            new_calls = getattr(widget, "calls", None)
+            new_calls_str = f" | {new_calls / message_count:.2f} widget calls/message" if new_calls is not None else ""
+            print(f"BENCH: gui_render | {label} | render queue, {message_count} messages | {new_ms:8.1f} ms "
+                  f"({new_ms / message_count * 1000:.0f} us/message) | {stats['frames']} frames, slowest {stats['slowest_frame_ms']:.1f} ms "
+                  f"| {jarvis.chat_render_queue.line_count} lines kept, {stats['trimmed_lines']} trimmed{new_calls_str}")
+        finally:
+            jarvis.chat_render_queue = saved_queue
+    finally:
+        if root is not None: root.destroy()
+BENCHMARKS["gui_render"] = benchmark_gui_render
+
+def benchmark_app_catalog(desktop_count=5000, binary_count=2000, lookups=2000):
+    # A generated tree of desktop_count .desktop files plus a PATH directory of binary_count executables:
+    # cold build, warm start from the JSON cache, and lookups of spoken names against the old
+    # "spawn the name as a command" approach
+    import tempfile
+    known_apps = [("code.desktop", "Visual Studio Code", "Text Editor", "vscode;development;", "/usr/share/code/code %F"),
+                  ("org.gnome.Nautilus.desktop", "Files", "File Manager", "folder;explorer;", "nautilus --new-window %U"),
+                  ("firefox.desktop", "Firefox Web Browser", "Web Browser", "internet;www;", "firefox %u"),
+                  ("libreoffice-writer.desktop", "LibreOffice Writer", "Word Processor", "docx;document;", "libreoffice --writer %U")]
+    spoken = {"visual studio code": "Visual Studio Code", "vs code": "Visual Studio Code", "files": "Files", "firefox": "Firefox Web Browser",
+              "writer": "LibreOffice Writer", "word processor": "LibreOffice Writer", "visual studo code": "Visual Studio Code",
+              "generated app 4321": "Generated App 4321", "tool0042": "tool0042"}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        applications_dir = os.path.join(temp_dir, "share", "applications")
+        bin_dir = os.path.join(temp_dir, "bin")
+        os.makedirs(applications_dir); os.makedirs(bin_dir)
+        generated = [(f"org.example.App{index}.desktop", f"Generated App {index}", f"Utility {index % 50}", f"tag{index % 97};", f"app{index} %f")
+                     for index in range(desktop_count - len(known_apps))]
+        for file_name, name, generic, keywords, exec_line in known_apps + generated:
+            with open(os.path.join(applications_dir, file_name), "w", encoding="utf-8") as desktop_file:
+                desktop_file.write(f"[Desktop Entry]\nType=Application\nName={name}\nGenericName={generic}\nKeywords={keywords}\nExec={exec_line}\n")
+        for index in range(binary_count):
+            binary_path = os.path.join(bin_dir, f"tool{index:04d}")
+            with open(binary_path, "w") as binary_file: binary_file.write("#!/bin/sh\n")
+            os.chmod(binary_path, 0o755)
+        cache_path = os.path.join(temp_dir, "apps.json")
+
+        catalog = jarvis.AppCatalog(cache_path, [applications_dir], [bin_dir], [])
+        start = time.perf_counter(); catalog.refresh(); cold_ms = (time.perf_counter() - start) * 1000
+        warm = jarvis.AppCatalog(cache_path, [applications_dir], [bin_dir], [])
+        start = time.perf_counter(); warm.load(); load_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter(); unchanged = warm.refresh(); unchanged_ms = (time.perf_counter() - start) * 1000
+        for file_name, *_ in generated[:10]: os.utime(os.path.join(applications_dir, file_name), (time.time() + 5, time.time() + 5))
+        start = time.perf_counter(); touched = warm.refresh(); touched_ms = (time.perf_counter() - start) * 1000
+        print(f"BENCH: app_catalog | {warm.entry_count()} entries | cold build {cold_ms:7.1f} ms | cache load {load_ms:6.1f} ms "
+              f"+ unchanged recheck {unchanged_ms:6.1f} ms ({unchanged['reparsed']} reparsed) | 10 edited files {touched_ms:6.1f} ms ({touched['reparsed']} reparsed)")
+
+        warm.close(); warm.ready_event.set() # Lookups without the background refresh thread
+        resolved = sum(1 for name, expected in spoken.items() if (warm.lookup(name) or {}).get("name") == expected)
+        names = list(spoken) * (lookups // len(spoken))
+        start = time.perf_counter()
+        for name in names: warm.lookup(name)
+        lookup_us = (time.perf_counter() - start) * 1e6 / len(names)
+        start = time.perf_counter()
+        for _ in range(200): warm.lookup("visual studo code") # Typo: the difflib fallback
+        fuzzy_us = (time.perf_counter() - start) * 1e6 / 200
+
+        old_resolved = sum(1 for name in spoken if os.path.isfile(os.path.join(bin_dir, name))) # Only exact executable names
+        spawn_attempts = 20
+        start = time.perf_counter()
+        for attempt in range(spawn_attempts):
+            try: subprocess.Popen([f"jarvis-benchmark-missing-app-{attempt}"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except FileNotFoundError: pass
+        failed_spawn_ms = (time.perf_counter() - start) * 1000 / spawn_attempts
+        print(f"BENCH: app_catalog | spoken names resolved: spawn-the-name {old_resolved}/{len(spoken)} "
+              f"(a failed spawn costs {failed_spawn_ms:.2f} ms) | catalog {resolved}/{len(spoken)}, "
+              f"{lookup_us:.1f} us/lookup on average, typo fallback {fuzzy_us:.0f} us")
+BENCHMARKS["app_catalog"] = benchmark_app_catalog
+
+def benchmark_capabilities(lock_calls=3):
+    # Stub platform tools in a private PATH (each probe answers after 50 ms; "amixer -D pulse" and the
+    # qdbus locker fail): serial vs parallel probing, a warm start from the cache, and how many
+    # spawns lock_screen_action needs per call against trying every locker in turn
+    import tempfile
+    if platform.system() == "Windows": print("BENCH: capabilities | skipped (needs a POSIX shell)"); return
+    sleep_binary = shutil.which("sleep")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        bin_dir, spawn_log = os.path.join(temp_dir, "bin"), os.path.join(temp_dir, "spawns.log")
+        os.makedirs(bin_dir)
+        stubs = {"amixer": f'{sleep_binary} 0.05; case "$*" in *pulse*) exit 1;; esac; exit 0',
+                 "pactl": f"{sleep_binary} 0.05; exit 0", "qdbus": "exit 1", "i3lock": f"exec {sleep_binary} 1", "xdg-open": "exit 0"}
+        for name, body in stubs.items():
+            with open(os.path.join(bin_dir, name), "w") as stub: stub.write(f"#!/bin/sh\necho {name} >> {spawn_log}\n{body}\n")
+            os.chmod(os.path.join(bin_dir, name), 0o755)
+        saved = (os.environ.get("PATH", ""), jarvis.capability_registry, jarvis.LOCK_SCREEN_SETTLE_SECONDS)
+        os.environ["PATH"], jarvis.LOCK_SCREEN_SETTLE_SECONDS = bin_dir, 0.1
+        try:
+            cache_path = os.path.join(temp_dir, "capabilities.json")
+            registry = jarvis.CapabilityRegistry(cache_path)
+            start = time.perf_counter()
+            for capability, candidates in registry.candidates.items():
+                for candidate in candidates: jarvis.async_core.run(registry.probe_candidate(candidate, ""))
+            serial_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter(); registry.probe(); registry.save(); parallel_ms = (time.perf_counter() - start) * 1000
+            warm = jarvis.CapabilityRegistry(cache_path)
+            start = time.perf_counter(); warm.load_or_probe(); cached_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            for _ in range(1000): warm.backends("volume")
+            resolve_us = (time.perf_counter() - start) * 1000
+            print(f"BENCH: capabilities | probe all backends: serial {serial_ms:6.1f} ms | parallel {parallel_ms:6.1f} ms "
+                  f"| warm start from cache {cached_ms:5.2f} ms ({warm.last_probe['source']}) | resolve {resolve_us:.2f} us/call | {warm.summary()}")
+
+            if os.path.exists(spawn_log): os.remove(spawn_log)
+            for candidate in jarvis.CAPABILITY_CANDIDATES["screen_lock"]: # The old way: every locker in turn, every time
+                try:
+                    if jarvis.async_core.run(jarvis.launch_and_settle_async(jarvis.capability_command(candidate), jarvis.LOCK_SCREEN_SETTLE_SECONDS)) in (None, 0): break
+                except OSError: pass
+            with open(spawn_log) as log: old_spawns = len(log.readlines())
+            jarvis.capability_registry = warm
+            per_call = []
+            for _ in range(lock_calls):
+                if os.path.exists(spawn_log): os.remove(spawn_log)
+                jarvis.lock_screen_action()
+                with open(spawn_log) as log: per_call.append(len(log.readlines()))
+            print(f"BENCH: capabilities | lock_screen spawns: try-every-locker {old_spawns} (+{len(jarvis.CAPABILITY_CANDIDATES['screen_lock']) - old_spawns} "
+                  f"missing-binary attempts) | registry, per call: {per_call}")
+        finally:
+            os.environ["PATH"], jarvis.capability_registry, jarvis.LOCK_SCREEN_SETTLE_SECONDS = saved
+BENCHMARKS["capabilities"] = benchmark_capabilities
+
+def benchmark_audio_controller(bursts=10, fork_seconds=0.005, debounce_seconds=0.05):
+    # Volume commands against fake mixers where starting a process costs fork_seconds: the old
+    # process-per-command path vs AudioController over a per-change command backend and over a
+    # persistent handle. Each burst is "volume up" three times, then a set to 40% and two mute toggles.
+    class FakeMixer:
+        def __init__(self, persistent):
+            self.persistent, self.level, self.muted, self.forks, self.opened = persistent, 50, False, 0, False
+        def fork(self):
+            self.forks += 1; time.sleep(fork_seconds)
+        def write(self): # A command to the mixer: a pipe write on a persistent handle, a process otherwise
+            if not self.persistent: self.fork()
+            elif not self.opened: self.opened = True; self.fork()
+        def read_level(self): self.fork(); return self.level
+        def set_level(self, level, unmute):
+            self.write(); self.level = level
+            if unmute and self.muted: self.write(); self.muted = False
+        def toggle_mute(self): self.write(); self.muted = not self.muted
+        def confirm(self, level): return self.read_level() if self.persistent else level # Like PacmdMixer's re-read
+        def close(self): pass
+
+    burst = [("up", None), ("up", None), ("up", None)]
+    mixed = [("level", 40), ("mute", None), ("mute", None)]
+    old_mixer = FakeMixer(persistent=False)
+    start = time.perf_counter()
+    for _ in range(bursts):
+        for operation, level in burst + mixed: # Old path: every command is its own process (up/down are relative, no read)
+            old_mixer.write()
+    old_ms = (time.perf_counter() - start) * 1000 / (bursts * 6)
+    print(f"BENCH: audio_controller | process per command | {old_ms:6.2f} ms/command latency | {old_mixer.forks / (bursts * 6):.2f} forks/command")
+
+    for label, persistent in (("command backend", False), ("persistent handle", True)):
+        mixer = FakeMixer(persistent)
+        controller = jarvis.AudioController(lambda: mixer, debounce_seconds)
+        latencies = []
+        for _ in range(bursts):
+            for operation, level in burst + mixed:
+                start = time.perf_counter()
+                controller.submit(operation, level)
+                latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(debounce_seconds * 2) # Let the burst apply
+        commands = controller.stats["commands"]
+        print(f"BENCH: audio_controller | {label:<17} | {sum(latencies) / len(latencies):6.3f} ms/command latency (max {max(latencies):.2f}) "
+              f"| {mixer.forks / commands:.2f} forks/command | {controller.stats['applies']} applies for {commands} commands "
+              f"| final level {mixer.level}%, muted {mixer.muted}")
+
+    class RejectingMixer(FakeMixer): # A persistent handle whose commands the sound server ignores
+        def set_level(self, level, unmute): self.write()
+        def confirm(self, level):
+            if self.read_level() != level: raise RuntimeError(f"pacmd did not apply it (sink is at {self.level}%)")
+            return level
+    controller = jarvis.AudioController(lambda: RejectingMixer(True), debounce_seconds)
+    controller.submit("level", 80)
+    time.sleep(debounce_seconds * 2)
+    print(f"BENCH: audio_controller | rejected change | {controller.stats['errors']} error(s) reported, cached level dropped: {controller.level is None}")
+BENCHMARKS["audio_controller"] = benchmark_audio_controller
+
+def benchmark_text_injection(text_chars=2000, key_seconds=0.001, switch_seconds=0.3):
+    # 'type ...' with a text_chars snippet against a fake keyboard that takes key_seconds per character
+    # and a fake window list where focus moves to the target switch_seconds after the command.
+    # The old path slept TYPE_TEXT_DELAY_SECONDS and then typed every character in one call.
+    class FakeKeyboard:
+        def __init__(self): self.typed, self.pastes = 0, 0
+        def type(self, text):
+            time.sleep(len(text) * key_seconds); self.typed += len(text)
+        def pressed(self, key): return self # Holds the modifier for the with-block, like pynput's
+        def __enter__(self): return self
+        def __exit__(self, *exc_info): return False
+        def tap(self, key): self.pastes += 1
+    class FakeClipboard:
+        def __init__(self): self.content = "user clipboard"
+        def copy(self, text): self.content = text
+        def paste(self): return self.content
+    class FakeWindows:
+        def __init__(self):
+            self.chat, self.target, self.switch_at = SimpleNamespace(title="Jarvis"), SimpleNamespace(title="Editor"), None
+        def getActiveWindow(self):
+            return self.target if self.switch_at is not None and time.monotonic() >= self.switch_at else self.chat
+
+    text = ("The quick brown fox jumps over the lazy dog. " * (text_chars // 45 + 1))[:text_chars]
+    old_keyboard = FakeKeyboard()
+    start = time.perf_counter()
+    old_keyboard.type(text)
+    old_type_ms = (time.perf_counter() - start) * 1000
+    print(f"BENCH: text_injection | {text_chars} chars, old path | {jarvis.TYPE_TEXT_DELAY_SECONDS * 1000:.0f} ms fixed delay "
+          f"+ {old_type_ms:.0f} ms typing = {jarvis.TYPE_TEXT_DELAY_SECONDS * 1000 + old_type_ms:.0f} ms, not cancellable")
+
+    previous_key = jarvis.Key
+    if jarvis.Key is None: jarvis.Key = SimpleNamespace(ctrl="ctrl", cmd="cmd") # pynput missing here
+    try:
+        for mode in ("paste", "type"):
+            fake_keyboard, fake_clipboard, fake_windows = FakeKeyboard(), FakeClipboard(), FakeWindows()
+            injector = jarvis.TextInjector(fake_keyboard, fake_clipboard, fake_windows)
+            start = time.perf_counter()
+            fake_windows.switch_at = time.monotonic() + switch_seconds
+            injector.start(text, mode)
+            injected = injector.task.result()
+            total_ms = (time.perf_counter() - start) * 1000
+            print(f"BENCH: text_injection | {text_chars} chars, {mode} | {total_ms:.0f} ms total, focus moved after "
+                  f"{switch_seconds * 1000:.0f} ms | {injected} chars | clipboard restored: {fake_clipboard.content == 'user clipboard'}")
+
+        fake_keyboard, fake_windows = FakeKeyboard(), FakeWindows()
+        injector = jarvis.TextInjector(fake_keyboard, FakeClipboard(), fake_windows)
+        fake_windows.switch_at = time.monotonic() + 0.02
+        injector.start(text, "type")
+        time.sleep(0.2)
+        start = time.perf_counter()
+        injector.cancel()
+        time.sleep(0.1)
+        typed_after_cancel = fake_keyboard.typed
+        time.sleep(text_chars * key_seconds)
+        print(f"BENCH: text_injection | cancel after 200 ms | {typed_after_cancel}/{text_chars} chars typed when it stopped, "
+              f"{fake_keyboard.typed - typed_after_cancel} typed afterwards")
+    finally:
+        jarvis.Key = previous_key
+BENCHMARKS["text_injection"] = benchmark_text_injection
+
+def benchmark_dialogue_state(message_chars=600, rounds=2000):
+    # Context checks for "play" / "next" / "yes" with a full history window of message_chars-long
+    # messages: the old per-input work (copy the history, scan it for the last reply, substring-search
+    # that for confirmations, str() the last MAX_HISTORY_TURNS*2 messages for "music"/"song") vs
+    # DialogueState's counters. Then how many LLM calls a recycle bin confirmation round trip takes.
+    window = jarvis.MAX_HISTORY_TURNS * 3 + 20
+    history = [{"role": ("user", "system", "model")[index % 3], "text": (f"message {index} about the weekly report " * 20)[:message_chars]}
+               for index in range(window - 1)] + [{"role": "model", "text": "Shall I put on some music while you work?"}]
+    dialogue = jarvis.DialogueState()
+    for item in history: dialogue.observe(item["role"], item["text"])
+
+    def legacy_context(history, text):
+        items = list(history) + [{"role": "user", "text": text}]
+        replies = [item for item in items if item['role'] == 'model']
+        last_reply = replies[-1]['text'].lower() if replies else ""
+        confirmation = "emptying the recycle bin is permanent" in last_reply or re.search(r'wish to (shutdown|restart|logout) the computer', last_reply)
+        if text == "play": return confirmation, "music" in str(items[-jarvis.MAX_HISTORY_TURNS*2:]).lower()
+        return confirmation, "music" in str(items[-jarvis.MAX_HISTORY_TURNS*2:]).lower() or "song" in str(items[-jarvis.MAX_HISTORY_TURNS*2:]).lower()
+
+    def state_context(dialogue, text):
+        return dialogue.pending is not None and time.monotonic() < dialogue.pending["expires_at"], dialogue.recently("media")
+
+    for label, check, source in (("old history rescans", legacy_context, history), ("dialogue state", state_context, dialogue)):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for text in ("play", "next", "yes"): result = check(source, text)
+        per_input_us = (time.perf_counter() - start) / (rounds * 3) * 1_000_000
+        print(f"BENCH: dialogue_state | {label:<20} | {per_input_us:8.2f} us/input | media context {result[1]} | {window} messages of {message_chars} chars")
+
+    previous_action = jarvis.empty_recycle_bin_action
+    jarvis.empty_recycle_bin_action = lambda confirmation_expected=False: ("CONFIRMATION_NEEDED", "Emptying the recycle bin is permanent. Are you sure?") if not confirmation_expected else (True, "Recycle bin emptied.")
+    try:
+        start = time.perf_counter()
+        replies = []
+        for text in ("empty the trash", "yes"):
+            intent_name, action_status = jarvis.route_command(text, dialogue)
+            replies.append(jarvis.render_templated_reply(intent_name, action_status))
+            dialogue.observe("user", text); dialogue.observe("system", action_status); dialogue.observe("model", replies[-1] or "")
+        llm_calls = sum(reply is None for reply in replies)
+        print(f"BENCH: dialogue_state | recycle bin confirmation | {(time.perf_counter() - start) * 1000:.2f} ms for request + 'yes' "
+              f"| {llm_calls} LLM calls (was 1 per turn, and the 'yes' depended on the reply's wording) | {replies[-1]}")
+    finally:
+        jarvis.empty_recycle_bin_action = previous_action
+BENCHMARKS["dialogue_state"] = benchmark_dialogue_state
+
+def run_benchmarks(names):
+    for name in names or list(BENCHMARKS):
+        if name not in BENCHMARKS:
+            print(f"ERROR: Unknown benchmark '{name}'. Available: {', '.join(BENCHMARKS)}")
+            continue
+        BENCHMARKS[name]()
@@ -1,4 +1,3 @@
-import google.generativeai as genai
 import os
 import platform
 import subprocess
@@ -9,96 +8,249 @@ import re
 import datetime
 import random # For dice, coin, random numbers
 import threading # For non-blocking timers, GUI operations
+import asyncio # Event loop for LLM calls, timers and subprocess launches
 import ast # For safe evaluation of math expressions
+import math
+import operator
+import functools
 import socket # For internet check
-
-# --- GUI Library (Tkinter) ---
-import tkinter as tk
-from tkinter import scrolledtext, simpledialog, messagebox
-from tkinter.font import Font as tkFont
-
-
-# --- Optional Library Imports ---
-try:
+import sys
+import collections
+import itertools
+import heapq
+import bisect # Prefix lookups in the application catalog
+import array # Fixed-size sample buffers for the system stats sampler
+import difflib
+import hashlib
+import fnmatch # Glob filters for directory listings
+import shlex # Exec lines of .desktop application entries
+import shutil
+import sqlite3 # Persistent notes/timers/history
+import atexit
+from types import SimpleNamespace
+
+# --- Optional Library Imports (lazy) ---
+# tkinter, google.generativeai and the optional desktop-control libraries are imported the first
+# time something needs them (see backend_available() and get_model()), so the CLI prompt appears
+# without paying for all of them up front. Until loaded, their module-level names below are None.
+genai = None
+tk = scrolledtext = simpledialog = messagebox = tkFont = None
+Key = KeyboardController = keyboard = None
+psutil = pygetwindow = NSAppleScript = None
+CLSCTX_ALL = AudioUtilities = ISimpleAudioVolume = winshell = pyperclip = None
+
+def load_tkinter_backend():
+    global tk, scrolledtext, simpledialog, messagebox, tkFont
+    import tkinter as tk
+    from tkinter import scrolledtext, simpledialog, messagebox
+    from tkinter.font import Font as tkFont
+
+def load_pynput_backend():
+    global Key, KeyboardController, keyboard
     from pynput.keyboard import Key, Controller as KeyboardController
-    pynput_available = True
     keyboard = KeyboardController()
-except ImportError:
-    pynput_available = False
-    print("Warning: pynput library not found. Media key, tab controls, and typing text might not work.")
-try:
+
+def load_psutil_backend():
+    global psutil
     import psutil
-    psutil_available = True
-except ImportError:
-    psutil_available = False
-    print("Warning: psutil library not found. Closing applications, system stats, uptime might not work.")
-try:
+
+def load_pygetwindow_backend():
+    global pygetwindow
     import pygetwindow
-    pygetwindow_available = True
-except ImportError:
-    pygetwindow_available = False
-    print("Warning: pygetwindow library not found. Switching/focusing windows may be limited.")
 
-if platform.system() == "Darwin":
-    try:
-        from AppKit import NSAppleScript # Still useful for some Mac-specific things
-        applescript_available = True
-    except ImportError:
-        applescript_available = False
-        print("Warning: pyobjc (AppKit) not found for macOS. Some macOS specific controls might not work.")
-else:
-    applescript_available = False
-
-if platform.system() == "Windows":
-    try:
-        from comtypes import CLSCTX_ALL # For pycaw
-        from pycaw.pycaw import AudioUtilities, ISimpleAudioVolume
-        pycaw_available = True
-    except ImportError:
-        pycaw_available = False
-        print("Warning: pycaw library not found for Windows volume control.")
-    try:
-        import winshell # For Windows recycle bin
-        winshell_available = True
-    except ImportError:
-        winshell_available = False
-        print("Warning: winshell library not found. Emptying recycle bin on Windows will not work.")
-else:
-    pycaw_available = False # Ensure it's false if not Windows
-    winshell_available = False
-
-try:
+def load_applescript_backend():
+    global NSAppleScript
+    from AppKit import NSAppleScript # Still useful for some Mac-specific things
+
+def load_pycaw_backend():
+    global CLSCTX_ALL, AudioUtilities, ISimpleAudioVolume
+    from comtypes import CLSCTX_ALL # For pycaw
+    from pycaw.pycaw import AudioUtilities, ISimpleAudioVolume
+
+def load_winshell_backend():
+    global winshell
+    import winshell # For Windows recycle bin
+
+def load_pyperclip_backend():
+    global pyperclip
     import pyperclip
-    pyperclip_available = True
-except ImportError:
-    pyperclip_available = False
-    print("Warning: pyperclip library not found. Clipboard functions (copy/paste) will not work.")
+
+# name -> (loader, platform it applies to or None for all, warning if missing)
+OPTIONAL_BACKENDS = {
+    "tkinter": (load_tkinter_backend, None, "Warning: tkinter not found. The graphical interface is unavailable."),
+    "pynput": (load_pynput_backend, None, "Warning: pynput library not found. Media key, tab controls, and typing text might not work."),
+    "psutil": (load_psutil_backend, None, "Warning: psutil library not found. Closing applications, system stats, uptime might not work."),
+    "pygetwindow": (load_pygetwindow_backend, None, "Warning: pygetwindow library not found. Switching/focusing windows may be limited."),
+    "applescript": (load_applescript_backend, "Darwin", "Warning: pyobjc (AppKit) not found for macOS. Some macOS specific controls might not work."),
+    "pycaw": (load_pycaw_backend, "Windows", "Warning: pycaw library not found for Windows volume control."),
+    "winshell": (load_winshell_backend, "Windows", "Warning: winshell library not found. Emptying recycle bin on Windows will not work."),
+    "pyperclip": (load_pyperclip_backend, None, "Warning: pyperclip library not found. Clipboard functions (copy/paste) will not work."),
+}
+optional_backend_state = {} # name -> True/False once its import has been attempted
+optional_backend_lock = threading.Lock()
+
+def backend_available(name):
+    # Imports the backend on first use (once, even with several threads asking) and reports whether it loaded
+    with optional_backend_lock:
+        if name not in optional_backend_state:
+            loader, required_platform, missing_warning = OPTIONAL_BACKENDS[name]
+            if required_platform and platform.system() != required_platform:
+                optional_backend_state[name] = False
+            else:
+                try:
+                    loader()
+                    optional_backend_state[name] = True
+                except Exception as e_import: # ImportError, or e.g. pynput finding no display
+                    optional_backend_state[name] = False
+                    print(missing_warning if isinstance(e_import, ImportError) else f"{missing_warning} ({e_import})")
+        return optional_backend_state[name]
+
+def preload_optional_backends():
+    # The old eager behaviour (PRELOAD_BACKENDS_AT_STARTUP): import everything before the first prompt
+    for name in OPTIONAL_BACKENDS: backend_available(name)
 # --- END Optional Library Imports ---
 
 # --- CONFIGURATION ---
 GEMINI_API_KEY = "YOUR_GEMINI_API_KEY"  # !!! REPLACE WITH YOUR ACTUAL GEMINI API KEY !!!
+BENCHMARK_MODE = "--benchmark" in sys.argv # `python jarvis.py --benchmark [name ...]` runs offline benchmarks, no API key needed
 if GEMINI_API_KEY == "YOUR_GEMINI_API_KEY" or not GEMINI_API_KEY:
     print("CRITICAL ERROR: Please replace 'YOUR_GEMINI_API_KEY' in the script with your actual Gemini API key.")
     # For GUI mode, we might want to show this in a dialog
     # For now, CLI exit is fine.
-    if not ('gui_window' in globals() and gui_window and gui_window.winfo_exists()):
+    if not BENCHMARK_MODE and not ('gui_window' in globals() and gui_window and gui_window.winfo_exists()):
          exit()
 
-genai.configure(api_key=GEMINI_API_KEY)
 model_name = 'gemma-3n-e4b-it' # Using flash for potentially better understanding of complex instructions
 # model_name = 'gemma-3n-e4b-it' # User's original model, uncomment to use
-try:
-    model = genai.GenerativeModel(model_name)
-    print(f"INFO: Using LLM model: {model_name}")
-except Exception as e_model_init:
-    print(f"CRITICAL ERROR: Could not initialize Gemini model '{model_name}'. API key issue or model name incorrect? Error: {e_model_init}")
-    if not ('gui_window' in globals() and gui_window and gui_window.winfo_exists()):
-         exit()
+PRELOAD_BACKENDS_AT_STARTUP = False # True: import every optional library and build the model before the first prompt
+
+# The model client is built by warm_up_model() on a background thread started at launch, so
+# importing google.generativeai overlaps with the user typing. get_model() waits for it.
+model = None
+model_ready_event = threading.Event()
+model_warm_up_lock = threading.Lock()
+model_warm_up_thread = None
+
+def warm_up_model():
+    global genai, model
+    try:
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        model = genai.GenerativeModel(model_name)
+        from google.generativeai import client as genai_client
+        genai_client.get_default_generative_client() # Build the API client now rather than on the first request
+        print(f"INFO: Using LLM model: {model_name}")
+    except Exception as e_model_init:
+        print(f"CRITICAL ERROR: Could not initialize Gemini model '{model_name}'. API key issue or model name incorrect? Error: {e_model_init}")
+    finally:
+        model_ready_event.set()
+
+def start_model_warm_up():
+    global model_warm_up_thread
+    with model_warm_up_lock:
+        if model_warm_up_thread is None and not model_ready_event.is_set():
+            model_warm_up_thread = threading.Thread(target=warm_up_model, daemon=True)
+            model_warm_up_thread.start()
+
+def get_model():
+    # The GenerativeModel, waiting for the warm-up if it is still running (None if initialization failed)
+    if not model_ready_event.is_set():
+        start_model_warm_up()
+        model_ready_event.wait()
+    return model
 
 
 MAX_HISTORY_TURNS = 12 # Slightly increased for more context
+HISTORY_TOKEN_BUDGET = 2000 # Max tokens of history (incl. the summary of older turns) sent with each prompt
+HISTORY_SUMMARY_TOKEN_BUDGET = 250 # Turns pushed out of the window are folded into a summary line this size
+MAX_MESSAGE_TOKENS = 400 # Longer messages (e.g. big clipboard pastes) are clipped in the prompt
+USE_MODEL_TOKEN_COUNTER = False # Count with model.count_tokens (an API call per message) instead of the local estimate
+LLM_BACKEND = "prompt" # "prompt": persona + flattened history in one generate_content string each turn;
+                       # "chat": persona set once as the model's system_instruction, history sent as structured turns
+RESPONSE_CACHE_ENABLED = True # Reuse LLM replies that phrase a repeated action result (open-ended chat is never cached)
+RESPONSE_CACHE_MAX_ENTRIES = 256 # LRU bound
+RESPONSE_CACHE_TTL_SECONDS = 6 * 3600
+RESPONSE_CACHE_HISTORY_ITEMS = 1 # How many recent history messages form part of the cache key (0 = input and status only)
+RESPONSE_CACHE_PERSIST = False # Keep the cache across sessions in RESPONSE_CACHE_FILE
+RESPONSE_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".jarvis_response_cache.json")
+RESPONSE_CACHE_SAVE_DELAY_SECONDS = 5 # A persisted cache is rewritten at most this often, by a background thread
+TURN_STATS_HISTORY = 100 # Per-turn prompt size/latency records kept for 'context stats'
+TIMER_MAX_WAIT_SECONDS = 60 # Longest the timer thread sleeps without re-checking the wall clock
+PERSISTENCE_ENABLED = True # Keep notes, timers and conversation history in JARVIS_DB_PATH across sessions
+JARVIS_DB_PATH = os.path.join(os.path.expanduser("~"), ".jarvis.db")
+PERSIST_FLUSH_INTERVAL_SECONDS = 0.25 # Writes are queued and committed by a background thread in batches
+PERSISTED_HISTORY_MAX_MESSAGES = 5000 # Saved history beyond this many messages is pruned (oldest first) when writes are flushed
+PERSISTED_HISTORY_MAX_DAYS = 90 # ...as is saved history older than this
+RESTORED_HISTORY_MESSAGES = MAX_HISTORY_TURNS * 3 # Most recent history messages reloaded on startup
+PROCESS_INDEX_FULL_REFRESH_SECONDS = 300 # close_application's process index is diffed on each use and fully rebuilt this often
+PROCESS_TERMINATE_TIMEOUT_SECONDS = 2 # Shared grace period for all matched processes before they are killed
+APP_CATALOG_ENABLED = True # Resolve 'open <app>' through a catalog of .desktop entries / .app bundles and PATH executables
+APP_CATALOG_PATH = os.path.join(os.path.expanduser("~"), ".jarvis_apps.json")
+APP_CATALOG_REFRESH_SECONDS = 300 # Background recheck of source mtimes; only changed files and directories are re-read
+APP_CATALOG_MISS_REFRESH_SECONDS = 30 # An unknown app name triggers an early recheck at most this often
+APP_CATALOG_FIRST_BUILD_WAIT_SECONDS = 3 # A launch right after startup waits this long for the catalog
+APP_CATALOG_FUZZY_CUTOFF = 0.8 # difflib ratio a misspelt app name needs to match
+CAPABILITY_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".jarvis_capabilities.json")
+CAPABILITY_PROBE_TIMEOUT_SECONDS = 2 # A probe command that takes longer counts as failed
+CAPABILITY_FIRST_PROBE_WAIT_SECONDS = 3 # An action right after startup waits this long for the background probe
+AUDIO_DEBOUNCE_SECONDS = 0.15 # Linux volume commands within this window of the first are applied as one absolute set
+AUDIO_LEVEL_CACHE_SECONDS = 30 # The cached volume level is re-read after this long (other apps may have changed it)
+AUDIO_STEP_PERCENT = 5 # 'volume up' / 'volume down' step on Linux
+AUDIO_SESSION_CACHE_SECONDS = 10 # Windows audio sessions are re-enumerated at most this often
+WINDOW_INVENTORY_TTL_SECONDS = 2.0 # How long focus_window trusts its cached window list
+WINDOW_MATCH_MIN_SCORE = 0.5 # Title score a window needs to be focused (keyword inside the title scores 2+; every distinguishing keyword word must match)
+WINDOW_ACTIVATE_TIMEOUT_SECONDS = 0.5 # How long focus_window waits after activate() for the window to report focus
+STATS_SAMPLE_INTERVAL_SECONDS = 2.0 # Background system stats sampling period
+STATS_HISTORY_SECONDS = 3600 # Rolling history kept for 'average cpu over the last N minutes'
+STATS_PROCESS_SAMPLE_SECONDS = 10 # How often the top-process lists are recomputed (a full process scan)
+STATS_TOP_PROCESSES = 10 # Longest 'top N processes' list kept
+DIRECTORY_PAGE_SIZE = 20 # Entries per page for sorted, filtered or recursive listings and 'next' pages
+DIRECTORY_RECURSIVE_DEPTH = 3 # Depth limit for 'list files in X recursively' without an explicit depth
+DIRECTORY_SCAN_LIMIT = 2000000 # A listing stops scanning after this many entries
+FILE_INDEX_ENABLED = True # Crawl FILE_INDEX_ROOTS in the background for 'find file ...' and name-only 'open file ...'
+FILE_INDEX_ROOTS = [os.path.join(os.path.expanduser("~"), folder) for folder in ("Desktop", "Documents", "Downloads", "Pictures", "Music", "Videos")]
+FILE_INDEX_DB_PATH = os.path.join(os.path.expanduser("~"), ".jarvis_files.db")
+FILE_INDEX_RESCAN_SECONDS = 600 # Incremental rescans re-read only directories whose mtime changed
+FILE_INDEX_FULL_RESCAN_SECONDS = 24 * 3600 # Full re-read, which also catches files modified in place
+FILE_INDEX_SKIP_DIRS = {"node_modules", "__pycache__", "site-packages", "venv", "$RECYCLE.BIN", "System Volume Information"} # Plus hidden ones
+FILE_INDEX_MMAP_BYTES = 256 * 1024 * 1024 # SQLite reads the index file through mmap up to this size
+FILE_INDEX_CANDIDATES = 500 # Name matches fetched per search before ranking
+FILE_INDEX_FIRST_SCAN_WAIT_SECONDS = 2 # A search right after startup waits this long for the first crawl
+CALCULATOR_CACHE_SIZE = 512 # Compiled calculator expressions kept (LRU)
+CALCULATOR_MAX_EXPRESSION_CHARS = 256
+CALCULATOR_MAX_INT_BITS = 4096 # Integer results (powers, products) larger than this are refused before computing
+CALCULATOR_MAX_FACTORIAL = 450 # 450! is just under CALCULATOR_MAX_INT_BITS
+TYPE_TEXT_MODE = "auto" # 'type ...' injection: "paste" (via the clipboard), "type" (keystrokes) or "auto" (paste long texts)
+TYPE_TEXT_PASTE_MIN_CHARS = 200 # "auto" pastes texts at least this long
+TYPE_TEXT_PASTE_SETTLE_SECONDS = 0.3 # Time the target gets to read the clipboard before the old contents are put back
+TYPE_TEXT_CHARS_PER_SECOND = 0 # Keystroke typing rate limit (0 = as fast as the keyboard backend goes)
+TYPE_TEXT_CHUNK_CHARS = 32 # Keystroke typing is done (and can be cancelled) in chunks of this many characters
+TYPE_TEXT_FOCUS_TIMEOUT_SECONDS = 10 # 'type ...' gives up if focus hasn't moved to another window within this time
+TYPE_TEXT_FOCUS_POLL_SECONDS = 0.05
+TYPE_TEXT_DELAY_SECONDS = 2.5 # Fixed wait before typing when the focused window can't be read
+LOCK_SCREEN_SETTLE_SECONDS = 0.5 # A Linux screen locker that exits with an error within this time is skipped for the next one
+DIALOGUE_CONFIRMATION_TIMEOUT_SECONDS = 60 # A 'yes' to a recycle bin / power confirmation request must come within this time
+DIALOGUE_CONTEXT_MESSAGES = MAX_HISTORY_TURNS * 2 # A domain (media, timers, files) stays active this many messages after its last mention
+NOTES_PAGE_SIZE = 10 # Notes listed (and put into the prompt) per 'show notes' / 'find notes' reply
 ACTION_STATUS_PREFIX = "[SYSTEM_ACTION_STATUS]:"
 JARVIS_INTERNAL_TIMER_PREFIX = "[JARVIS_TIMER_NOTIFICATION]:"
+STREAM_LLM_RESPONSES = True # Show Jarvis's reply chunk by chunk as the model produces it
+GUI_RENDER_INTERVAL_MS = 33 # Chat-display text (messages and streamed chunks) is batched into at most one render per interval
+GUI_SCROLLBACK_MAX_LINES = 5000 # The chat display drops its oldest lines beyond this
+GUI_SCROLLBACK_TRIM_LINES = 500 # Extra lines dropped per trim, so trimming doesn't run on every render
+GUI_WORKER_THREADS = 2 # Worker threads for GUI requests (one conversation still runs one request at a time)
+GUI_REQUEST_QUEUE_LIMIT = 5 # Waiting GUI requests beyond this are refused until the queue drains
+REQUEST_METRICS_HISTORY = 200 # Recent queue wait times kept for 'context stats'
+# Per-intent reply mode for deterministic actions: "template" answers instantly from TEMPLATED_REPLIES
+# without an LLM call, "template+llm" does the same and then adds a deferred LLM remark in the background.
+# Intents not listed here (or set to "llm") have the LLM phrase the reply, as before.
+ACTION_REPLY_MODES = {
+    "datetime": "template", "calculate": "template", "convert_units": "template", "flip_coin": "template", "roll_dice": "template",
+    "random_number": "template", "set_timer": "template", "cancel_timer": "template", "cancel_all_timers": "template",
+    "context_stats": "template",
+    # Confirmation requests and the answers to them; DialogueState tracks the pending one, so no LLM is needed
+    "empty_recycle_bin": "template", "power": "template", "confirm_empty_recycle_bin": "template", "confirm_power": "template",
+}
 
 JARVIS_PERSONA_BASE_PROMPT = """
 You are Jarvis, the user's indispensable, highly intelligent, and incredibly capable personal assistant. You embody cool competence and sophisticated wit. You are deeply integrated into their system and can manage a vast array of tasks with precision and a touch of dry humor when appropriate.
@@ -141,10 +293,15 @@ User's current request: "{user_input}"
 Jarvis's composed, intelligent, and helpful response:
 """
 
+# Replies involving these are never served from (or stored in) the response cache
+RESPONSE_CACHE_BYPASS_MARKERS = (JARVIS_INTERNAL_TIMER_PREFIX, "CONFIRMATION_REQUIRED", "GUI_LAUNCH_REQUESTED")
+
+# The persona on its own (everything before the history section), for the "chat" backend's system_instruction
+JARVIS_SYSTEM_INSTRUCTION = JARVIS_PERSONA_BASE_PROMPT.split("Conversation History (most recent first")[0].strip()
+
 # --- Global In-Memory Storage & Timers ---
-jarvis_notes = []
-active_timers = [] # List of tuples: (end_time, original_duration_str, description, id)
-timer_id_counter = 0
+# Notes live in jarvis_store (see "Persistent Store"), not in memory
+# Active timers live in timer_scheduler (see "Timer Management Thread"); entries are (end_time, original_duration_str, description, id)
 timer_thread_stop_event = threading.Event()
 conversation_history = []
 chat_history_lock = threading.Lock()
@@ -153,15 +310,88 @@ chat_history_lock = threading.Lock()
 gui_window = None
 chat_display_area_gui = None
 user_input_field_gui = None
+gui_status_label_gui = None # Shows queued/working state under the input field
 gui_active_flag = False # Flag to indicate if GUI is running
 gui_thread_stop_event = threading.Event() # To signal GUI thread to stop if needed
 
+# --- Async Core ---
+class AsyncCore:
+    # One asyncio event loop on a daemon thread. LLM requests, deferred remarks, the timer checker
+    # and short subprocess launches run on it as coroutines, so many can be in flight without a
+    # thread each. The blocking front ends (the CLI input() loop, Tk callbacks, GUI workers) hand
+    # work over with run_coroutine_threadsafe and wait on the returned concurrent future.
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def ensure_started(self):
+        with self.lock:
+            if self.loop is None:
+                loop_ready = threading.Event()
+                self.thread = threading.Thread(target=self.run_loop, args=(loop_ready,), daemon=True)
+                self.thread.start()
+                loop_ready.wait()
+            return self.loop
+
+    def run_loop(self, loop_ready):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        loop_ready.set()
+        self.loop.run_forever()
+
+    def in_loop_thread(self):
+        return self.thread is threading.current_thread()
+
+    def submit(self, coroutine): # Fire-and-forget or poll later; returns a concurrent.futures.Future
+        return asyncio.run_coroutine_threadsafe(coroutine, self.ensure_started())
+
+    def run(self, coroutine, timeout=None):
+        # Blocking bridge for synchronous callers. Never called from a coroutine: it would wait on itself.
+        if self.in_loop_thread():
+            coroutine.close()
+            raise RuntimeError("AsyncCore.run() called from the event loop thread")
+        return self.submit(coroutine).result(timeout)
+
+    def call_soon(self, callback, *args): # Thread-safe; callback runs on the loop thread
+        self.ensure_started().call_soon_threadsafe(callback, *args)
+
+    @staticmethod
+    def wait(future, timeout):
+        # Like Thread.join(timeout): wait for a submitted task to finish, ignoring its outcome
+        try: future.result(timeout)
+        except Exception: pass
+
+async_core = AsyncCore()
+
+async def run_process_async(args, shell=False, **popen_kwargs):
+    # Runs a short command to completion on the loop; no thread is parked on it while it works
+    if shell:
+        process = await asyncio.create_subprocess_shell(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **popen_kwargs)
+    else:
+        process = await asyncio.create_subprocess_exec(*args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **popen_kwargs)
+    stdout, stderr = await process.communicate()
+    return subprocess.CompletedProcess(args, process.returncode, stdout.decode(errors="replace"), stderr.decode(errors="replace"))
+
+def run_process(args, check=False, shell=False, **popen_kwargs):
+    # subprocess.run(args, capture_output=True, text=True, check=check) with the wait done by the async core
+    completed = async_core.run(run_process_async(args, shell, **popen_kwargs))
+    if check: completed.check_returncode()
+    return completed
+
+async def launch_and_settle_async(args, settle_seconds):
+    # Starts a command that may keep running (e.g. a screen locker) and gives it settle_seconds to
+    # fail. Returns its exit code, or None if it is still running by then.
+    process = await asyncio.create_subprocess_exec(*args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try: return await asyncio.wait_for(process.wait(), settle_seconds)
+    except asyncio.TimeoutError: return None
+
 # --- SYSTEM CONTROL FUNCTIONS ---
 
 def run_applescript(script_content):
-    if platform.system() == "Darwin" and applescript_available:
+    if platform.system() == "Darwin" and backend_available("applescript"):
         try:
-            process = subprocess.run(['osascript', '-e', script_content], capture_output=True, text=True, check=False)
+            process = run_process(['osascript', '-e', script_content])
             if process.returncode == 0:
                 return True, process.stdout.strip()
             else:
@@ -188,8 +418,16 @@ def open_application(app_name):
                 "finder": "Finder"
             }
             mapped_name = app_mappings_macos.get(app_name.lower(), app_name)
+            entry = app_catalog.lookup(mapped_name) if APP_CATALOG_ENABLED else None
+            if entry and entry["kind"] == "bundle": # Known bundle path: no 'open -a' search or path probing
+                try:
+                    run_process(['open', entry["target"]], check=True)
+                    print(f"INFO: Application '{app_name_original}' opened on macOS from the catalog ({entry['target']}).")
+                    return True
+                except subprocess.CalledProcessError as e_catalog:
+                    print(f"WARN: Catalog entry '{entry['target']}' failed to open: {e_catalog.stderr or e_catalog.stdout}")
             try:
-                subprocess.run(['open', '-a', mapped_name], check=True, capture_output=True, text=True)
+                run_process(['open', '-a', mapped_name], check=True)
                 print(f"INFO: Application '{app_name_original}' opened successfully on macOS using 'open -a {mapped_name}'.")
                 return True
             except subprocess.CalledProcessError as e_open_a:
@@ -205,7 +443,7 @@ def open_application(app_name):
                 for path_try in common_paths_try:
                     if os.path.exists(path_try):
                         try:
-                            subprocess.run(['open', path_try], check=True)
+                            run_process(['open', path_try], check=True)
                             print(f"INFO: Application '{app_name_original}' (found at {path_try}) opened on macOS.")
                             return True
                         except subprocess.CalledProcessError as e_path:
@@ -225,7 +463,7 @@ def open_application(app_name):
             try:
                  # Using DETACHED_PROCESS flag if available, else it might block Jarvis
                  # For `start`, it usually detaches by default.
-                 subprocess.run(f'start "" "{executable_name}"', shell=True, check=True, creationflags=subprocess.DETACHED_PROCESS if platform.system() == "Windows" else 0)
+                 run_process(f'start "" "{executable_name}"', check=True, shell=True, creationflags=subprocess.DETACHED_PROCESS if platform.system() == "Windows" else 0)
                  print(f"INFO: Application '{app_name}' launched using 'start' on Windows.")
                  return True
             except subprocess.CalledProcessError:
@@ -240,9 +478,13 @@ def open_application(app_name):
                      print(f"ERROR: Popen failed for '{executable_name}': {e_popen}")
                      return False
         elif platform.system() == "Linux":
+            # The catalog maps spoken names ("visual studio code", "files") to a .desktop Exec line or a PATH executable
+            entry = app_catalog.lookup(app_name) if APP_CATALOG_ENABLED else None
+            command = [app_name]
+            if entry: command = (desktop_exec_argv(entry["target"]) if entry["kind"] == "desktop" else [entry["target"]]) or command
             try: # Try to detach the process
-                subprocess.Popen([app_name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
-                print(f"INFO: Application '{app_name}' launched on Linux.")
+                subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+                print(f"INFO: Application '{app_name}' launched on Linux" + (f" as '{entry['name']}'." if entry else "."))
                 return True
             except FileNotFoundError:
                 print(f"ERROR: Command '{app_name}' not found on Linux."); return False
@@ -254,11 +496,486 @@ def open_application(app_name):
         print(f"ERROR: Exception opening '{app_name}': {e}"); return False
     return False
 
+class AppCatalog:
+    # Launchable applications: XDG .desktop entries (Linux), .app bundles (macOS) and executables on
+    # PATH, built by a background thread and kept in a JSON file between sessions. A refresh re-parses
+    # only .desktop files whose mtime changed and re-lists only directories whose mtime changed.
+    # Lookups go through an in-memory index of names, aliases (generic name, desktop id, executable)
+    # and keywords: exact key first, then every spoken word as a word prefix, then a difflib typo match.
+    KIND_RANK = {"desktop": 0, "bundle": 0, "binary": 1} # Menu entries win over bare executables
+    SEPARATORS = re.compile(r"[^a-z0-9]+")
+
+    def __init__(self, cache_path, desktop_dirs=None, path_dirs=None, bundle_dirs=None):
+        self.cache_path = cache_path
+        self.desktop_dirs = self.default_desktop_dirs() if desktop_dirs is None else list(desktop_dirs)
+        self.path_dirs = self.default_path_dirs() if path_dirs is None else list(path_dirs)
+        self.bundle_dirs = self.default_bundle_dirs() if bundle_dirs is None else list(bundle_dirs)
+        self.lock = threading.Lock()
+        self.sources = {"desktop": {}, "dirs": {}} # .desktop path -> [mtime, parsed or None]; directory -> [mtime, [names]]
+        self.entries = [] # {"name", "kind", "target", "aliases", "keywords", "name_words"}
+        self.by_key = {} # normalised name or alias -> entry index
+        self.words = [] # Sorted (word, entry index) pairs for prefix lookups
+        self.keys_by_initial = {} # First letter -> keys, the candidates for typo matching
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.ready_event = threading.Event()
+        self.last_refresh = 0.0
+        self.last_build = {} # Summary of the most recent refresh: seconds, reparsed, relisted, entries
+
+    @staticmethod
+    def default_desktop_dirs():
+        if platform.system() != "Linux": return []
+        home = os.path.expanduser("~")
+        data_home = os.environ.get("XDG_DATA_HOME") or os.path.join(home, ".local", "share")
+        data_dirs = (os.environ.get("XDG_DATA_DIRS") or "/usr/local/share:/usr/share").split(os.pathsep)
+        data_dirs += [os.path.join(data_home, "flatpak", "exports", "share"), "/var/lib/flatpak/exports/share", "/var/lib/snapd/desktop"]
+        return list(dict.fromkeys(os.path.join(data_dir, "applications") for data_dir in [data_home] + data_dirs if data_dir))
+
+    @staticmethod
+    def default_path_dirs():
+        return list(dict.fromkeys(directory for directory in os.environ.get("PATH", "").split(os.pathsep) if directory))
+
+    @staticmethod
+    def default_bundle_dirs():
+        if platform.system() != "Darwin": return []
+        return ["/Applications", "/Applications/Utilities", "/System/Applications", "/System/Applications/Utilities",
+                os.path.join(os.path.expanduser("~"), "Applications")]
+
+    @staticmethod
+    def normalise(text):
+        return " ".join(AppCatalog.SEPARATORS.sub(" ", (text or "").lower()).split())
+
+    @staticmethod
+    def parse_desktop_file(path):
+        # The [Desktop Entry] group of a .desktop file as {"name", "generic", "binary", "keywords", "exec"},
+        # or None for anything that isn't a visible application
+        fields, in_entry = {}, False
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as desktop_file:
+                for line in desktop_file:
+                    line = line.strip()
+                    if line.startswith("["):
+                        if in_entry: break
+                        in_entry = line == "[Desktop Entry]"
+                    elif in_entry and "=" in line and not line.startswith("#"):
+                        key, value = line.split("=", 1)
+                        fields.setdefault(key.strip(), value.strip()) # Localised keys (Name[de]) are simply other keys
+        except OSError:
+            return None
+        if fields.get("Type") != "Application" or not fields.get("Exec") or not fields.get("Name"): return None
+        if fields.get("Hidden") == "true" or fields.get("NoDisplay") == "true": return None
+        argv = desktop_exec_argv(fields["Exec"])
+        return {"name": fields["Name"], "generic": fields.get("GenericName", ""), "binary": os.path.basename(argv[0]) if argv else "",
+                "keywords": [keyword for keyword in fields.get("Keywords", "").split(";") if keyword], "exec": fields["Exec"]}
+
+    # Building
+    def start(self):
+        with self.lock:
+            if self.thread is None and not self.stop_event.is_set():
+                self.thread = threading.Thread(target=self.refresh_loop, daemon=True)
+                self.thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        self.wake_event.set()
+
+    def refresh_loop(self):
+        self.load()
+        while not self.stop_event.is_set():
+            try: self.refresh()
+            except Exception as e: print(f"WARN: Application catalog refresh failed: {e}")
+            self.ready_event.set()
+            self.wake_event.wait(APP_CATALOG_REFRESH_SECONDS)
+            self.wake_event.clear()
+
+    def load(self):
+        if not (self.cache_path and os.path.isfile(self.cache_path)): return
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as cache_file:
+                stored = json.load(cache_file)
+            self.install(stored["desktop"], stored["dirs"])
+            self.ready_event.set() # Usable straight away; the refresh that follows only applies changes
+        except (OSError, ValueError, KeyError, TypeError) as e_load:
+            print(f"WARN: Could not load the application catalog from '{self.cache_path}': {e_load}")
+
+    def save(self):
+        try:
+            temp_path = self.cache_path + ".tmp"
+            with self.lock: stored = {"desktop": self.sources["desktop"], "dirs": self.sources["dirs"]}
+            with open(temp_path, "w", encoding="utf-8") as cache_file:
+                json.dump(stored, cache_file)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e_save:
+            print(f"WARN: Could not save the application catalog to '{self.cache_path}': {e_save}")
+
+    def refresh(self):
+        started = time.perf_counter()
+        with self.lock: known_desktop, known_dirs = self.sources["desktop"], self.sources["dirs"]
+        desktop, dirs = {}, {}
+        reparsed = relisted = 0
+        for applications_dir in self.desktop_dirs:
+            for directory, _, file_names in os.walk(applications_dir):
+                for file_name in file_names:
+                    if not file_name.endswith(".desktop"): continue
+                    path = os.path.join(directory, file_name)
+                    try: mtime = os.stat(path).st_mtime
+                    except OSError: continue
+                    known = known_desktop.get(path)
+                    if known and known[0] == mtime: desktop[path] = known
+                    else: desktop[path] = [mtime, self.parse_desktop_file(path)]; reparsed += 1
+        for directory, is_bundle_dir in [(d, False) for d in self.path_dirs] + [(d, True) for d in self.bundle_dirs]:
+            try: mtime = os.stat(directory).st_mtime
+            except OSError: continue
+            known = known_dirs.get(directory)
+            if known and known[0] == mtime: dirs[directory] = known; continue
+            try:
+                with os.scandir(directory) as scanner:
+                    if is_bundle_dir: names = [entry.name for entry in scanner if entry.name.endswith(".app")]
+                    else: names = [entry.name for entry in scanner
+                                   if not entry.name.startswith(".") and entry.is_file() and os.access(entry.path, os.X_OK)]
+            except OSError: continue
+            dirs[directory] = [mtime, names]; relisted += 1
+        changed = reparsed or relisted or desktop.keys() != known_desktop.keys() or dirs.keys() != known_dirs.keys()
+        if changed: self.install(desktop, dirs)
+        self.last_refresh = time.time()
+        self.last_build = {"seconds": time.perf_counter() - started, "reparsed": reparsed, "relisted": relisted, "entries": len(self.entries)}
+        if changed and self.cache_path: self.save()
+        return self.last_build
+
+    def install(self, desktop, dirs):
+        # Rebuild the entries and the lookup index from parsed sources, then swap them in
+        entries, seen_ids = [], set()
+        for applications_dir in self.desktop_dirs: # Earlier data directories take precedence for the same desktop id
+            prefix = applications_dir.rstrip(os.sep) + os.sep
+            for path in sorted(path for path in desktop if path.startswith(prefix)):
+                desktop_id = path[len(prefix):].replace(os.sep, "-")[:-len(".desktop")]
+                parsed = desktop[path][1]
+                if desktop_id in seen_ids: continue
+                seen_ids.add(desktop_id)
+                if not parsed: continue
+                entries.append({"name": parsed["name"], "kind": "desktop", "target": parsed["exec"],
+                                "aliases": [parsed["generic"], desktop_id, desktop_id.rsplit(".", 1)[-1], parsed["binary"]], "keywords": parsed["keywords"]})
+        for directory in self.bundle_dirs:
+            for name in dirs.get(directory, (None, []))[1]:
+                entries.append({"name": name[:-len(".app")], "kind": "bundle", "target": os.path.join(directory, name), "aliases": [], "keywords": []})
+        for directory in self.path_dirs:
+            for name in dirs.get(directory, (None, []))[1]:
+                entries.append({"name": name, "kind": "binary", "target": os.path.join(directory, name), "aliases": [], "keywords": []})
+
+        by_key, words = {}, []
+        for field in ("name", "aliases"): # Every name is claimed before any alias
+            for index, entry in enumerate(entries):
+                for text in ([entry["name"]] if field == "name" else entry["aliases"]):
+                    key = self.normalise(text)
+                    if key:
+                        by_key.setdefault(key, index)
+                        by_key.setdefault(key.replace(" ", ""), index) # "vs code" finds "vscode", "visualstudiocode" finds "visual studio code"
+        for index, entry in enumerate(entries): # Name, generic name and keywords are searchable word by word
+            name_words = self.normalise(entry["name"]).split()
+            entry["name_words"] = len(name_words)
+            other_words = self.normalise(" ".join(entry["aliases"][:1] + entry["keywords"])).split()
+            words.extend((word, index) for word in set(name_words + other_words))
+        words.sort()
+        keys_by_initial = {}
+        for key in by_key: keys_by_initial.setdefault(key[:1], []).append(key)
+        with self.lock:
+            self.sources = {"desktop": desktop, "dirs": dirs}
+            self.entries, self.by_key, self.words, self.keys_by_initial = entries, by_key, words, keys_by_initial
+
+    # Lookup
+    def word_match(self, query_words): # Called with self.lock held
+        # Entries having a word starting with each spoken word; the best is the shortest name, menu entries first
+        candidates = None
+        for query_word in query_words:
+            position = bisect.bisect_left(self.words, (query_word, -1))
+            matches = set()
+            while position < len(self.words) and self.words[position][0].startswith(query_word):
+                matches.add(self.words[position][1]); position += 1
+            candidates = matches if candidates is None else candidates & matches
+            if not candidates: return None
+        return min(candidates, key=lambda index: (self.KIND_RANK[self.entries[index]["kind"]], self.entries[index]["name_words"], index))
+
+    def lookup(self, spoken_name):
+        # The catalog entry for an app name as spoken ("visual studio code", "files", "fire fox"), or None
+        self.start()
+        self.ready_event.wait(APP_CATALOG_FIRST_BUILD_WAIT_SECONDS)
+        key = self.normalise(spoken_name)
+        if not key: return None
+        with self.lock:
+            index = self.by_key.get(key, self.by_key.get(key.replace(" ", "")))
+            if index is None: index = self.word_match(key.split())
+            if index is None:
+                close = difflib.get_close_matches(key, self.keys_by_initial.get(key[:1], ()), n=1, cutoff=APP_CATALOG_FUZZY_CUTOFF)
+                if close: index = self.by_key[close[0]]
+            entry = self.entries[index] if index is not None else None
+        if entry is None and time.time() - self.last_refresh > APP_CATALOG_MISS_REFRESH_SECONDS:
+            self.wake_event.set() # Maybe installed since the last refresh; the next attempt will know
+        return entry
+
+    def entry_count(self):
+        with self.lock: return len(self.entries)
+
+app_catalog = AppCatalog(APP_CATALOG_PATH if not BENCHMARK_MODE else None)
+atexit.register(app_catalog.close)
+
+def desktop_exec_argv(exec_line):
+    # A .desktop Exec= value as an argv list, with the %f/%u/... field codes dropped (Jarvis opens apps without files)
+    try: arguments = shlex.split(exec_line)
+    except ValueError: return []
+    arguments = [re.sub(r"%[fFuUdDnNickvm]", "", argument).replace("%%", "%") for argument in arguments]
+    return [argument for argument in arguments if argument]
+
+# Platform command backends, best first. A backend is usable when its executable is on PATH, the
+# desktop matches (if it names any) and its probe command (if any) exits with 0. "command" is an argv
+# template, or one per operation; {level} and {path} are filled in by capability_command().
+CAPABILITY_CANDIDATES = {
+    "volume": [
+        {"name": "amixer-pulse", "probe": ["amixer", "-D", "pulse", "get", "Master"],
+         "command": {"level": ["amixer", "-q", "-D", "pulse", "sset", "Master", "{level}%"], "up": ["amixer", "-q", "-D", "pulse", "sset", "Master", "5%+", "unmute"],
+                     "down": ["amixer", "-q", "-D", "pulse", "sset", "Master", "5%-"], "mute": ["amixer", "-q", "-D", "pulse", "sset", "Master", "toggle"],
+                     "unmute": ["amixer", "-q", "-D", "pulse", "sset", "Master", "unmute"]}},
+        {"name": "pactl", "probe": ["pactl", "get-sink-volume", "@DEFAULT_SINK@"],
+         "command": {"level": ["pactl", "set-sink-volume", "@DEFAULT_SINK@", "{level}%"], "up": ["pactl", "set-sink-volume", "@DEFAULT_SINK@", "+5%"],
+                     "down": ["pactl", "set-sink-volume", "@DEFAULT_SINK@", "-5%"], "mute": ["pactl", "set-sink-mute", "@DEFAULT_SINK@", "toggle"],
+                     "unmute": ["pactl", "set-sink-mute", "@DEFAULT_SINK@", "0"]}},
+        {"name": "wpctl", "probe": ["wpctl", "get-volume", "@DEFAULT_AUDIO_SINK@"],
+         "command": {"level": ["wpctl", "set-volume", "@DEFAULT_AUDIO_SINK@", "{level}%"], "up": ["wpctl", "set-volume", "@DEFAULT_AUDIO_SINK@", "5%+"],
+                     "down": ["wpctl", "set-volume", "@DEFAULT_AUDIO_SINK@", "5%-"], "mute": ["wpctl", "set-mute", "@DEFAULT_AUDIO_SINK@", "toggle"],
+                     "unmute": ["wpctl", "set-mute", "@DEFAULT_AUDIO_SINK@", "0"]}},
+        {"name": "amixer", "probe": ["amixer", "get", "Master"],
+         "command": {"level": ["amixer", "-q", "sset", "Master", "{level}%"], "up": ["amixer", "-q", "sset", "Master", "5%+", "unmute"],
+                     "down": ["amixer", "-q", "sset", "Master", "5%-"], "mute": ["amixer", "-q", "sset", "Master", "toggle"],
+                     "unmute": ["amixer", "-q", "sset", "Master", "unmute"]}},
+    ],
+    "volume_session": [ # A long-lived mixer handle for AudioController (PulseAudio; PipeWire has no pacmd)
+        {"name": "pacmd", "probe": ["pacmd", "stat"], "command": ["pacmd"]},
+    ],
+    "screen_lock": [ # Whether a locker works only shows when it runs, so these are checked on PATH only
+        {"name": "xdg-screensaver", "command": ["xdg-screensaver", "lock"]},
+        {"name": "gnome-screensaver-command", "command": ["gnome-screensaver-command", "-l"]}, # GNOME
+        {"name": "mate-screensaver-command", "command": ["mate-screensaver-command", "-l"]}, # MATE
+        {"name": "cinnamon-screensaver-command", "command": ["cinnamon-screensaver-command", "-l"]}, # Cinnamon
+        {"name": "qdbus-screensaver", "command": ["qdbus", "org.freedesktop.ScreenSaver", "/ScreenSaver", "Lock"]}, # KDE Plasma via D-Bus
+        {"name": "i3lock", "command": ["i3lock"]}, # Common for i3 and other WMs
+        {"name": "dm-tool", "command": ["dm-tool", "lock"]}, # LightDM based systems
+        {"name": "loginctl", "command": ["loginctl", "lock-session"]}, # systemd-logind
+    ],
+    "logout": [ # Logout is very desktop-environment specific on Linux
+        {"name": "gnome-session-quit", "desktops": ("gnome",), "command": ["gnome-session-quit", "--logout", "--no-prompt"]},
+        {"name": "qdbus-ksmserver", "desktops": ("kde", "plasma"), "command": ["qdbus", "org.kde.ksmserver", "/KSMServer", "logout", "0", "0", "0"]},
+        {"name": "mate-session-save", "desktops": ("mate",), "command": ["mate-session-save", "--logout-dialog"]}, # Might show dialog
+        {"name": "xfce4-session-logout", "desktops": ("xfce",), "command": ["xfce4-session-logout", "--logout"]},
+        {"name": "cinnamon-session-quit", "desktops": ("cinnamon",), "command": ["cinnamon-session-quit", "--logout", "--no-prompt"]},
+    ],
+    "open_file": [
+        {"name": "xdg-open", "command": ["xdg-open", "{path}"]},
+        {"name": "gio", "command": ["gio", "open", "{path}"]},
+        {"name": "kde-open5", "command": ["kde-open5", "{path}"]},
+        {"name": "exo-open", "command": ["exo-open", "{path}"]},
+    ],
+}
+
+class CapabilityRegistry:
+    # Which CAPABILITY_CANDIDATES backends work here, probed once in parallel on the async core by a
+    # background thread at startup and cached on disk under a fingerprint of the environment (OS,
+    # desktop, session type, PATH), so later sessions skip probing. Actions take the first usable
+    # backend; one that fails when used is reported and dropped, and the next one takes over.
+    def __init__(self, cache_path, candidates=CAPABILITY_CANDIDATES):
+        self.cache_path = cache_path
+        self.candidates = candidates
+        self.lock = threading.Lock()
+        self.available = {} # capability -> names of usable backends, best first
+        self.thread = None
+        self.ready_event = threading.Event()
+        self.last_probe = {} # Summary of the most recent probe: seconds, source ("cache"/"probe")
+
+    @staticmethod
+    def environment_fingerprint():
+        parts = [platform.system()] + [os.environ.get(name, "") for name in ("XDG_CURRENT_DESKTOP", "XDG_SESSION_TYPE", "DESKTOP_SESSION", "PATH")]
+        return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.load_or_probe, daemon=True)
+                self.thread.start()
+
+    def load_or_probe(self):
+        started = time.perf_counter()
+        try:
+            if self.load(): source = "cache"
+            else:
+                self.probe()
+                self.save()
+                source = "probe"
+            self.last_probe = {"seconds": time.perf_counter() - started, "source": source}
+        except Exception as e: print(f"WARN: Capability probe failed: {e}")
+        finally: self.ready_event.set()
+
+    def load(self):
+        if not (self.cache_path and os.path.isfile(self.cache_path)): return False
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as cache_file:
+                stored = json.load(cache_file).get(self.environment_fingerprint())
+        except (OSError, ValueError, AttributeError) as e_load:
+            print(f"WARN: Could not load capability cache from '{self.cache_path}': {e_load}"); return False
+        if not isinstance(stored, dict) or set(stored) != set(self.candidates): return False
+        with self.lock: self.available = stored
+        return True
+
+    def save(self):
+        if not self.cache_path: return
+        try:
+            stored = {}
+            if os.path.isfile(self.cache_path):
+                with open(self.cache_path, "r", encoding="utf-8") as cache_file: stored = json.load(cache_file)
+            with self.lock: stored[self.environment_fingerprint()] = dict(self.available)
+            temp_path = self.cache_path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as cache_file: json.dump(stored, cache_file)
+            os.replace(temp_path, self.cache_path)
+        except (OSError, ValueError) as e_save:
+            print(f"WARN: Could not save capability cache to '{self.cache_path}': {e_save}")
+
+    @staticmethod
+    async def probe_candidate(candidate, desktop_env):
+        if candidate.get("desktops") and not any(desktop in desktop_env for desktop in candidate["desktops"]): return False
+        command = candidate["command"] if isinstance(candidate["command"], list) else next(iter(candidate["command"].values()))
+        if shutil.which(command[0]) is None: return False
+        if not candidate.get("probe"): return True
+        try:
+            completed = await asyncio.wait_for(run_process_async(candidate["probe"]), CAPABILITY_PROBE_TIMEOUT_SECONDS)
+            return completed.returncode == 0
+        except (OSError, asyncio.TimeoutError):
+            return False
+
+    async def probe_async(self, capabilities):
+        desktop_env = os.environ.get("XDG_CURRENT_DESKTOP", "").lower()
+        probes = [(capability, candidate) for capability in capabilities for candidate in self.candidates[capability]]
+        results = await asyncio.gather(*(self.probe_candidate(candidate, desktop_env) for _, candidate in probes))
+        available = {capability: [] for capability in capabilities}
+        for (capability, candidate), usable in zip(probes, results):
+            if usable: available[capability].append(candidate["name"])
+        return available
+
+    def probe(self, capabilities=None):
+        available = async_core.run(self.probe_async(list(capabilities or self.candidates)))
+        with self.lock: self.available.update(available)
+        return available
+
+    def backends(self, capability):
+        # Usable backends for a capability, best first
+        self.start()
+        self.ready_event.wait(CAPABILITY_FIRST_PROBE_WAIT_SECONDS)
+        with self.lock: names = self.available.get(capability)
+        if names is None: names = self.probe([capability])[capability] # Startup probe still running or failed
+        return [candidate for candidate in self.candidates[capability] if candidate["name"] in names]
+
+    def report_failure(self, capability, name):
+        with self.lock:
+            if name not in self.available.get(capability, ()): return
+            self.available[capability] = [other for other in self.available[capability] if other != name]
+            if not self.available[capability]: del self.available[capability] # None left: probe again next time
+        print(f"WARN: '{name}' failed for {capability.replace('_', ' ')}; not using it again in this environment.")
+        self.save()
+
+    def summary(self):
+        with self.lock: return {capability: (names[0] if names else None) for capability, names in self.available.items()}
+
+capability_registry = CapabilityRegistry(CAPABILITY_CACHE_PATH if not BENCHMARK_MODE else None)
+
+def capability_command(candidate, operation=None, **values):
+    # The argv for a backend (and operation), with {level}/{path} filled in
+    template = candidate["command"][operation] if operation else candidate["command"]
+    return [argument.format(**values) for argument in template]
+
+class ProcessIndex:
+    # Running processes by lowercased name, executable basename and macOS .app bundle name, so
+    # close_application() tests each distinct name once instead of every process. refresh() diffs
+    # psutil.pids() against the cached set and only reads name/exe/cmdline for new pids; a full
+    # rebuild every PROCESS_INDEX_FULL_REFRESH_SECONDS catches pids reused in between.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {} # pid -> {"proc", "name", "exe", "cmdline"} (lowercased)
+        self.by_name = {} # name -> set of pids
+        self.by_exe_basename = {}
+        self.by_app_bundle = {} # "google chrome" for .../Google Chrome.app/... -> set of pids
+        self.last_full_refresh = 0.0
+
+    @staticmethod
+    def add_key(index, key, pid):
+        if key: index.setdefault(key, set()).add(pid)
+
+    @staticmethod
+    def discard_key(index, key, pid):
+        pids = index.get(key)
+        if pids is None: return
+        pids.discard(pid)
+        if not pids: del index[key]
+
+    def add_pid(self, pid): # Called with self.lock held
+        try:
+            proc = psutil.Process(pid)
+            info = proc.as_dict(['name', 'exe', 'cmdline'], ad_value=None)
+        except (psutil.NoSuchProcess, psutil.ZombieProcess):
+            return
+        exe = (info['exe'] or "").lower()
+        entry = {"proc": proc, "name": (info['name'] or "").lower(), "exe": exe,
+                 "exe_basename": os.path.basename(exe), "cmdline": tuple(arg.lower() for arg in info['cmdline'] or ())}
+        self.entries[pid] = entry
+        self.add_key(self.by_name, entry["name"], pid)
+        self.add_key(self.by_exe_basename, entry["exe_basename"], pid)
+        for bundle in re.findall(r'/([^/]+)\.app/', exe): self.add_key(self.by_app_bundle, bundle, pid)
+
+    def remove_pid(self, pid): # Called with self.lock held
+        entry = self.entries.pop(pid, None)
+        if entry is None: return
+        self.discard_key(self.by_name, entry["name"], pid)
+        self.discard_key(self.by_exe_basename, entry["exe_basename"], pid)
+        for bundle in re.findall(r'/([^/]+)\.app/', entry["exe"]): self.discard_key(self.by_app_bundle, bundle, pid)
+
+    def refresh(self):
+        with self.lock:
+            if time.time() - self.last_full_refresh > PROCESS_INDEX_FULL_REFRESH_SECONDS:
+                for pid in list(self.entries): self.remove_pid(pid)
+                self.last_full_refresh = time.time()
+            current_pids = set(psutil.pids())
+            known_pids = set(self.entries)
+            for pid in known_pids - current_pids: self.remove_pid(pid)
+            for pid in current_pids - known_pids: self.add_pid(pid)
+
+    def find(self, names_to_check, app_name_lower):
+        # Same rules as the old per-process scan: any name variation inside the process name or exe
+        # basename, "/<variation>.app/" in the exe path on macOS, or the app name inside a cmdline arg.
+        self.refresh()
+        with self.lock:
+            pids = set()
+            for index in (self.by_name, self.by_exe_basename):
+                for key, key_pids in index.items():
+                    if any(name_variation in key for name_variation in names_to_check): pids |= key_pids
+            if platform.system() == "Darwin":
+                for name_variation in names_to_check: pids |= self.by_app_bundle.get(name_variation, set())
+            for pid, entry in self.entries.items():
+                if pid not in pids and any(app_name_lower in arg for arg in entry["cmdline"]): pids.add(pid)
+            matches = []
+            for pid in sorted(pids):
+                entry = self.entries[pid]
+                if entry["proc"].is_running(): # False if the pid now belongs to another process
+                    matches.append((entry["proc"], entry["name"], entry["exe"]))
+                else:
+                    self.remove_pid(pid)
+            return matches
+
+    def forget(self, pids):
+        with self.lock:
+            for pid in pids: self.remove_pid(pid)
+
+process_index = ProcessIndex()
+
 def close_application(app_name_input):
     print(f"INFO: Attempting to close application: {app_name_input}")
-    if not psutil_available:
+    if not backend_available("psutil"):
         return False, "Cannot close applications; 'psutil' library is missing."
-    closed_something = False
     app_name_lower = app_name_input.lower()
     # Expanded mappings
     process_name_mappings = {
@@ -281,64 +998,49 @@ def close_application(app_name_input):
     if platform.system() == "Windows": names_to_check.add(app_name_lower + ".exe")
     elif platform.system() == "Darwin": names_to_check.add(app_name_input) # Original case might matter for .app bundles
 
-    pids_terminated = set()
-    for proc in psutil.process_iter(['pid', 'name', 'exe', 'cmdline']):
+    targets = {} # pid -> psutil.Process
+    for proc, proc_name, proc_exe in process_index.find(names_to_check, app_name_lower):
+        print(f"INFO: Found process matching '{app_name_input}': PID {proc.pid}, Name: {proc_name}")
+        target_process = proc
+        # On macOS, closing the .app bundle often involves closing the main executable process
+        if platform.system() == "Darwin" and ".app/contents/macos/" in proc_exe:
+            # Try to find the parent .app process if this is a child
+            try:
+                if proc.parent() and ".app" in (proc.parent().exe() or ""):
+                    target_process = proc.parent()
+                    print(f"INFO: Targeting parent .app process PID {target_process.pid} for {proc_name}")
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass # Stick with current proc
+        targets[target_process.pid] = target_process
+
+    # Ask every match to exit at once, then share one grace period instead of waiting per process
+    terminated = []
+    for target_process in targets.values():
         try:
-            if proc.pid in pids_terminated: continue # Already handled
-            proc_info_name = proc.info['name'] if proc.info.get('name') else ""
-            proc_info_exe = proc.info['exe'] if proc.info.get('exe') else ""
-            proc_info_cmdline = proc.info['cmdline'] if proc.info.get('cmdline') else []
-
-            match = False
-            for name_variation in names_to_check:
-                if name_variation in proc_info_name.lower(): match = True; break
-                if proc_info_exe and name_variation in os.path.basename(proc_info_exe).lower(): match = True; break
-                if platform.system() == "Darwin" and proc_info_exe and f"/{name_variation}.app/" in proc_info_exe.lower(): match = True; break
-                # Check if the app_name_input itself is a substring of the process name or executable path
-                if app_name_lower in proc_info_name.lower(): match = True; break
-                if proc_info_exe and app_name_lower in os.path.basename(proc_info_exe).lower(): match = True; break
-                if proc_info_cmdline and any(app_name_lower in arg.lower() for arg in proc_info_cmdline): match = True; break
-
-
-            if match:
-                print(f"INFO: Found process matching '{app_name_input}': PID {proc.pid}, Name: {proc_info_name}")
-                parent_process = proc
-                # On macOS, closing the .app bundle often involves closing the main executable process
-                if platform.system() == "Darwin" and ".app/Contents/MacOS/" in (proc_info_exe or ""):
-                    # Try to find the parent .app process if this is a child
-                    try:
-                        if proc.parent() and ".app" in (proc.parent().exe() or ""):
-                            parent_process = proc.parent()
-                            print(f"INFO: Targeting parent .app process PID {parent_process.pid} for {proc_info_name}")
-                    except (psutil.NoSuchProcess, psutil.AccessDenied):
-                        pass # Stick with current proc
-
-                parent_process.terminate()
-                pids_terminated.add(parent_process.pid)
-                try:
-                    parent_process.wait(timeout=2)
-                    print(f"INFO: Process {parent_process.pid} ({parent_process.name()}) terminated gracefully.")
-                except psutil.TimeoutExpired:
-                    print(f"WARN: Process {parent_process.pid} ({parent_process.name()}) timed out on terminate, killing.")
-                    parent_process.kill()
-                    parent_process.wait(timeout=1) # Wait for kill
-                    print(f"INFO: Process {parent_process.pid} ({parent_process.name()}) killed.")
-                except psutil.NoSuchProcess:
-                    print(f"INFO: Process {parent_process.pid} ({parent_process.name() if hasattr(parent_process, 'name') else 'unknown'}) already exited.")
-                closed_something = True
+            target_process.terminate()
+            terminated.append(target_process)
         except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
             continue # Process might have died or access is denied
-        except Exception as e_proc:
-            print(f"WARN: Error with process {proc.pid if proc else 'unknown'}: {e_proc}")
-
-    if closed_something:
+    gone, alive = psutil.wait_procs(terminated, timeout=PROCESS_TERMINATE_TIMEOUT_SECONDS)
+    for target_process in gone: print(f"INFO: Process {target_process.pid} terminated gracefully.")
+    if alive:
+        for target_process in alive:
+            print(f"WARN: Process {target_process.pid} timed out on terminate, killing.")
+            try: target_process.kill()
+            except (psutil.NoSuchProcess, psutil.AccessDenied): pass
+        gone_after_kill, still_alive = psutil.wait_procs(alive, timeout=1) # Wait for kill
+        for target_process in gone_after_kill: print(f"INFO: Process {target_process.pid} killed.")
+        for target_process in still_alive: print(f"WARN: Process {target_process.pid} is still running after kill.")
+    process_index.forget(targets)
+
+    if terminated:
         return True, f"Attempted to close '{app_name_input}'."
     else:
         return False, f"No running process found clearly matching '{app_name_input}' to close."
 
 def control_media(action):
     print(f"INFO: Sending media control: {action}")
-    if not pynput_available: return False, "Media control unavailable; 'pynput' library missing."
+    if not backend_available("pynput"): return False, "Media control unavailable; 'pynput' library missing."
     try:
         if action == 'playpause': keyboard.tap(Key.media_play_pause)
         elif action == 'next': keyboard.tap(Key.media_next)
@@ -348,6 +1050,195 @@ def control_media(action):
         return True, f"Media '{action}' command sent."
     except Exception as e: return False, f"Error controlling media: {e}"
 
+class PacmdMixer:
+    # One long-lived `pacmd` shell (PulseAudio's command interface) fed commands on stdin, so a
+    # volume change costs a pipe write instead of a process. The level is read with `pacmd dump`,
+    # which is also how an applied change is confirmed: nothing comes back on the pipe.
+    def __init__(self):
+        self.process = None
+        self.sink = "@DEFAULT_SINK@"
+        self.muted = None
+        self.forks = 0
+
+    def send(self, line):
+        if self.process is None or self.process.poll() is not None:
+            self.process = subprocess.Popen(["pacmd"], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, text=True)
+            self.forks += 1
+        self.process.stdin.write(line + "\n")
+        self.process.stdin.flush()
+
+    def read_level(self):
+        dump = run_process(["pacmd", "dump"], check=True).stdout
+        self.forks += 1
+        default_sink = re.search(r"^set-default-sink (\S+)", dump, re.M)
+        if default_sink: self.sink = default_sink.group(1)
+        volume = re.search(rf"^set-sink-volume {re.escape(self.sink)} (0x[0-9a-f]+)", dump, re.M)
+        mute = re.search(rf"^set-sink-mute {re.escape(self.sink)} (yes|no)", dump, re.M)
+        if mute: self.muted = mute.group(1) == "yes"
+        if not volume: raise RuntimeError(f"pacmd reported no volume for sink '{self.sink}'")
+        return round(int(volume.group(1), 16) * 100 / 0x10000)
+
+    def set_level(self, level, unmute):
+        self.send(f"set-sink-volume {self.sink} {round(level * 0x10000 / 100)}")
+        if unmute and self.muted is not False: self.send(f"set-sink-mute {self.sink} 0"); self.muted = False
+
+    def toggle_mute(self):
+        if self.muted is None: self.read_level()
+        self.muted = not self.muted
+        self.send(f"set-sink-mute {self.sink} {1 if self.muted else 0}")
+
+    def confirm(self, level):
+        # Re-reads the sink and raises unless it has the level (None: any) and mute state just sent, so a
+        # command pacmd rejected (e.g. an unknown sink) fails the apply. Returns the level read.
+        expected_muted = self.muted
+        for attempt in range(2):
+            actual = self.read_level()
+            if (level is None or actual == level) and (expected_muted is None or self.muted == expected_muted): return actual
+            if attempt == 0: time.sleep(0.1) # The dump may have reached the server before the piped command
+        raise RuntimeError(f"pacmd did not apply it (sink '{self.sink}' is at {actual}%{', muted' if self.muted else ''})")
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            try: self.process.stdin.close(); self.process.wait(timeout=1)
+            except (OSError, subprocess.TimeoutExpired): self.process.kill()
+        self.process = None
+
+class CommandMixer:
+    # One process per applied change, through a "volume" capability backend (amixer, pactl, wpctl).
+    # Its probe command doubles as the level read.
+    def __init__(self, candidate):
+        self.candidate = candidate
+        self.muted = None
+        self.forks = 0
+
+    def run(self, argv):
+        self.forks += 1
+        return run_process(argv, check=True)
+
+    def read_level(self):
+        output = self.run(self.candidate["probe"]).stdout
+        if "[off]" in output or "[MUTED]" in output: self.muted = True
+        elif "[on]" in output or "Volume:" in output: self.muted = False
+        percent = re.search(r"(\d+)%", output)
+        if percent: return int(percent.group(1))
+        fraction = re.search(r"Volume:\s*([\d.]+)", output) # wpctl: "Volume: 0.40"
+        if fraction: return round(float(fraction.group(1)) * 100)
+        raise RuntimeError(f"Could not read the volume from {self.candidate['name']}")
+
+    def set_level(self, level, unmute):
+        self.run(capability_command(self.candidate, "level", level=level))
+        if unmute and self.muted: self.run(capability_command(self.candidate, "unmute")); self.muted = False
+
+    def toggle_mute(self):
+        self.run(capability_command(self.candidate, "mute"))
+        if self.muted is not None: self.muted = not self.muted
+
+    def confirm(self, level):
+        return level # run() already raised if the command failed
+
+    def close(self):
+        pass
+
+def make_linux_mixer():
+    # The persistent pacmd handle where PulseAudio offers it, else the registry's volume command backend
+    if capability_registry.backends("volume_session"): return PacmdMixer()
+    backends = capability_registry.backends("volume")
+    return CommandMixer(backends[0]) if backends else None
+
+class AudioController:
+    # Linux volume through one mixer handle with the current level cached. Commands only update the
+    # pending target and return; the first one of a burst schedules an apply on the async core
+    # AUDIO_DEBOUNCE_SECONDS later, which sets the final level once (and toggles mute once if the
+    # burst toggled it an odd number of times), then has the mixer confirm it.
+    def __init__(self, mixer_factory, debounce_seconds=AUDIO_DEBOUNCE_SECONDS):
+        self.mixer_factory = mixer_factory
+        self.debounce_seconds = debounce_seconds
+        self.mixer = None
+        self.lock = threading.Lock()
+        self.mixer_lock = threading.Lock() # Serialises mixer I/O between callers (level reads) and the apply
+        self.level = None
+        self.level_read_at = 0.0
+        self.target = None
+        self.mute_toggles = 0
+        self.unmute = False
+        self.apply_scheduled = False
+        self.stats = {"commands": 0, "applies": 0, "errors": 0}
+
+    def get_mixer(self): # Called with self.mixer_lock held
+        if self.mixer is None:
+            self.mixer = self.mixer_factory()
+            if self.mixer is None: raise RuntimeError("No working volume control (pacmd, amixer, pactl or wpctl) was found on this system.")
+        return self.mixer
+
+    def current_level(self): # Called with self.lock held
+        if self.target is not None: return self.target
+        if self.level is None or time.monotonic() - self.level_read_at > AUDIO_LEVEL_CACHE_SECONDS:
+            with self.mixer_lock: self.level = self.get_mixer().read_level()
+            self.level_read_at = time.monotonic()
+        return self.level
+
+    def submit(self, operation, level=None):
+        # operation: "level" (with level), "up", "down" or "mute". Returns the level the burst is heading for,
+        # None for a lone mute toggle. Only relative steps need the current level (read when the cache is stale).
+        with self.lock:
+            if operation == "level": self.target = max(0, min(100, int(level)))
+            elif operation == "up": self.target, self.unmute = min(100, self.current_level() + AUDIO_STEP_PERCENT), True
+            elif operation == "down": self.target = max(0, self.current_level() - AUDIO_STEP_PERCENT)
+            elif operation == "mute": self.mute_toggles += 1
+            else: raise ValueError(f"Unknown volume operation '{operation}'")
+            self.stats["commands"] += 1
+            if self.target is not None: self.level, self.level_read_at = self.target, time.monotonic()
+            schedule = not self.apply_scheduled
+            self.apply_scheduled = True
+            heading_for = self.target
+        if schedule: async_core.submit(self.apply_later())
+        return heading_for
+
+    async def apply_later(self):
+        await asyncio.sleep(self.debounce_seconds)
+        await asyncio.to_thread(self.apply_pending) # Mixer I/O may block; keep it off the loop
+
+    def apply_pending(self):
+        with self.lock:
+            target, toggles, unmute = self.target, self.mute_toggles, self.unmute
+            self.target, self.mute_toggles, self.unmute, self.apply_scheduled = None, 0, False, False
+        try:
+            with self.mixer_lock:
+                mixer = self.get_mixer()
+                if target is not None: mixer.set_level(target, unmute)
+                if toggles % 2: mixer.toggle_mute()
+                confirmed = mixer.confirm(target)
+            with self.lock:
+                self.stats["applies"] += 1
+                if confirmed is not None and self.target is None: self.level, self.level_read_at = confirmed, time.monotonic()
+        except Exception as e:
+            with self.lock: self.stats["errors"] += 1
+            self.reset(failed=True)
+            display_message_in_ui_or_console(f"Jarvis: The volume change didn't go through: {e}", role="system")
+
+    def reset(self, failed=False):
+        # Drop the handle and the cached level; the next command starts afresh. A command backend
+        # that failed is reported, so the registry's next volume backend takes over.
+        with self.mixer_lock:
+            if self.mixer is not None: self.mixer.close()
+            if failed and isinstance(self.mixer, CommandMixer): capability_registry.report_failure("volume", self.mixer.candidate["name"])
+            self.mixer = None
+        with self.lock: self.level = None
+
+audio_controller = AudioController(make_linux_mixer)
+atexit.register(audio_controller.reset)
+
+windows_audio_cache = threading.local() # COM interfaces stay on the thread that created them
+
+def windows_session_volumes():
+    # (any sessions at all, ISimpleAudioVolume of each audible session), re-enumerated at most every AUDIO_SESSION_CACHE_SECONDS
+    cached = getattr(windows_audio_cache, "entry", None)
+    if cached and time.monotonic() - cached[0] < AUDIO_SESSION_CACHE_SECONDS: return cached[1]
+    sessions = AudioUtilities.GetAllSessions()
+    result = (bool(sessions), [session._ctl.QueryInterface(ISimpleAudioVolume) for session in sessions if session.Process])
+    windows_audio_cache.entry = (time.monotonic(), result)
+    return result
+
 def change_volume(direction_or_level):
     print(f"INFO: Attempting to change volume: {direction_or_level}")
     current_os = platform.system()
@@ -362,15 +1253,15 @@ def change_volume(direction_or_level):
             if success: return True, f"macOS volume adjusted for '{direction_or_level}'."
             else: return False, f"macOS volume adjustment failed: {res}"
         elif current_os == "Windows":
-            if not pycaw_available:
-                if pynput_available:
+            if not backend_available("pycaw"):
+                if backend_available("pynput"):
                     if direction_or_level == "up": keyboard.tap(Key.media_volume_up); return True, "Used media key for volume up."
                     elif direction_or_level == "down": keyboard.tap(Key.media_volume_down); return True, "Used media key for volume down."
                     elif direction_or_level == "mute": keyboard.tap(Key.media_volume_mute); return True, "Used media key for mute/unmute."
                 return False, "Volume control unavailable; 'pycaw' library missing."
             
-            sessions = AudioUtilities.GetAllSessions()
-            if not sessions: # Fallback to master volume if no sessions (less common for this not to work if pycaw is fine)
+            any_sessions, session_volumes = windows_session_volumes()
+            if not any_sessions: # Fallback to master volume if no sessions (less common for this not to work if pycaw is fine)
                 speakers = AudioUtilities.GetSpeakers()
                 if not speakers: return False, "Could not get speaker interface via pycaw."
                 volume_control_iface = speakers.Activate(ISimpleAudioVolume._iid_, CLSCTX_ALL, None)
@@ -390,10 +1281,9 @@ def change_volume(direction_or_level):
                 else: return False, "Invalid volume command for Windows."
                 return True, f"Windows master volume adjusted for '{direction_or_level}'."
 
-            # If sessions exist, adjust all (or primary ones)
-            for session in sessions:
-                volume = session._ctl.QueryInterface(ISimpleAudioVolume)
-                if session.Process: # Only affect audible sessions
+            # If sessions exist, adjust all audible ones
+            try:
+                for volume in session_volumes:
                     if isinstance(direction_or_level, int):
                         target_level = max(0.0, min(1.0, float(direction_or_level) / 100.0))
                         volume.SetMasterVolume(target_level, None)
@@ -406,16 +1296,20 @@ def change_volume(direction_or_level):
                         volume.SetMasterVolume(max(0.0, current_vol - 0.1), None)
                     elif direction_or_level == "mute":
                         volume.SetMute(not volume.GetMute(), None)
+            except Exception:
+                windows_audio_cache.entry = None # A session went away; enumerate afresh next time
+                raise
             return True, f"Windows volume adjusted for '{direction_or_level}' across active sessions."
         elif current_os == "Linux":
-            cmd_base = ['amixer', '-q', '-D', 'pulse', 'sset', 'Master']
-            if isinstance(direction_or_level, int): cmd = cmd_base + [f'{direction_or_level}%']
-            elif direction_or_level == "up": cmd = cmd_base + ['5%+', 'unmute']
-            elif direction_or_level == "down": cmd = cmd_base + ['5%-']
-            elif direction_or_level == "mute": cmd = cmd_base + ['toggle']
-            else: return False, "Invalid volume command for Linux."
-            subprocess.run(cmd, check=True)
-            return True, f"Linux volume adjusted for '{direction_or_level}'."
+            operation = "level" if isinstance(direction_or_level, int) else direction_or_level
+            if operation not in ("level", "up", "down", "mute"): return False, "Invalid volume command for Linux."
+            try:
+                heading_for = audio_controller.submit(operation, direction_or_level if operation == "level" else None)
+            except Exception:
+                audio_controller.reset(failed=True)
+                raise
+            if heading_for is None: return True, "Toggling Linux mute."
+            return True, f"Setting Linux volume to {heading_for}% for '{direction_or_level}'."
         else: return False, f"Volume control not implemented for OS: {current_os}"
     except Exception as e: return False, f"Error changing volume '{direction_or_level}': {e}"
 
@@ -430,38 +1324,132 @@ def perform_web_search(query):
     try: search_url = f"https://www.google.com/search?q={query.replace(' ', '+')}"; return open_url_in_browser(search_url)
     except Exception as e: return False, f"Error performing web search for '{query}': {e}"
 
+class WindowInventory:
+    # Cached window list with a title-token index, refreshed at most every WINDOW_INVENTORY_TTL_SECONDS,
+    # plus the window each keyword last resolved to. `backend` is anything with getAllWindows()
+    # (pygetwindow by default; the benchmark passes a fake).
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.entries = [] # {"window", "title" (lowercased), "tokens"}
+        self.token_index = {} # title token -> list of entry indexes
+        self.refreshed_at = 0.0
+        self.last_match = {} # keyword -> window it was focused with
+
+    def refresh_if_stale(self): # Called with self.lock held
+        if time.monotonic() - self.refreshed_at < WINDOW_INVENTORY_TTL_SECONDS: return
+        self.entries, self.token_index = [], {}
+        for window in (self.backend or pygetwindow).getAllWindows():
+            title = (window.title or "").lower()
+            if not title: continue
+            tokens = frozenset(re.findall(r'\w+', title))
+            for token in tokens: self.token_index.setdefault(token, []).append(len(self.entries))
+            self.entries.append({"window": window, "title": title, "tokens": tokens})
+        self.refreshed_at = time.monotonic()
+
+    def invalidate(self):
+        with self.lock: self.refreshed_at = 0.0
+
+    def required_tokens(self, keyword_tokens): # Called with self.lock held
+        # Keyword words a title must contain (or have a word starting with): all of them, except alphabetic
+        # words no window title has at all, which can't tell windows apart ("vs" in "vs code")
+        return [token for token in keyword_tokens
+                if not token.isalpha() or token in self.token_index or any(word.startswith(token) for word in self.token_index)]
+
+    @staticmethod
+    def text_score(keyword, keyword_tokens, entry, required=()):
+        # Whole keyword in the title counts most, then the share of keyword words found as title words
+        # (quarter credit for a title word that merely starts with an alphabetic one; numbers must match
+        # whole). 0 when a required word is missing, so "document 7 - notepad" doesn't settle for "Document 5 - Notepad".
+        title, title_tokens = entry["title"], entry["tokens"]
+        def prefix_of_title_word(token): return token.isalpha() and any(t.startswith(token) for t in title_tokens)
+        score = 3.0 if title == keyword else 2.0 if keyword in title else 0.0
+        if not score and any(token not in title_tokens and not prefix_of_title_word(token) for token in required):
+            return 0.0
+        if keyword_tokens:
+            matched = sum(1.0 if token in title_tokens else 0.25 if prefix_of_title_word(token) else 0.0 for token in keyword_tokens)
+            score += matched / len(keyword_tokens)
+        return score
+
+    @staticmethod
+    def state_score(window):
+        # The old preference order: the active window, then visible and restored ones, minimized last
+        try:
+            if window.isActive: return 0.3
+            if window.visible and not window.isMinimized: return 0.2
+            return -0.1 if window.isMinimized else 0.0
+        except Exception: # The window closed since the inventory was taken
+            return None
+
+    def rank(self, keyword, keyword_tokens): # Called with self.lock held
+        candidate_indexes = {index for token in keyword_tokens for index in self.token_index.get(token, ())}
+        candidate_indexes.update(index for index, entry in enumerate(self.entries) if keyword in entry["title"])
+        required = self.required_tokens(keyword_tokens)
+        ranked = []
+        for index in candidate_indexes:
+            entry = self.entries[index]
+            text = self.text_score(keyword, keyword_tokens, entry, required)
+            if text < WINDOW_MATCH_MIN_SCORE: continue
+            state = self.state_score(entry["window"])
+            if state is not None: ranked.append((text + state, -index, entry["window"]))
+        ranked.sort(key=lambda item: item[:2], reverse=True)
+        return [window for _, _, window in ranked]
+
+    def find(self, keyword_raw):
+        # Best window for the keyword, or None. Falls back to typo-tolerant matching of the keyword's
+        # words against the title vocabulary when nothing matches literally.
+        keyword = keyword_raw.lower().strip()
+        keyword_tokens = re.findall(r'\w+', keyword)
+        with self.lock:
+            self.refresh_if_stale()
+            cached = self.last_match.get(keyword)
+            if cached is not None:
+                for entry in self.entries:
+                    if entry["window"] == cached and self.text_score(keyword, keyword_tokens, entry, self.required_tokens(keyword_tokens)) >= WINDOW_MATCH_MIN_SCORE:
+                        if self.state_score(cached) is not None: return cached
+                        break
+                self.last_match.pop(keyword, None)
+            ranked = self.rank(keyword, keyword_tokens)
+            if not ranked and keyword_tokens:
+                corrected = [(difflib.get_close_matches(token, self.token_index.keys(), n=1, cutoff=0.75) or [token])[0] for token in keyword_tokens]
+                if corrected != keyword_tokens: ranked = self.rank(" ".join(corrected), corrected)
+            return ranked[0] if ranked else None
+
+    def remember(self, keyword_raw, window):
+        with self.lock:
+            self.last_match[keyword_raw.lower().strip()] = window
+
+window_inventory = WindowInventory()
+
+def activate_window(window):
+    # activate() once, then poll for the window to report focus with a short backoff (pygetwindow has
+    # no focus events). Returns whether focus was confirmed within WINDOW_ACTIVATE_TIMEOUT_SECONDS.
+    if window.isMinimized: window.restore()
+    deadline = time.monotonic() + WINDOW_ACTIVATE_TIMEOUT_SECONDS
+    retry_delay = 0.005
+    window.activate()
+    while True:
+        if window.isActive: return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0: return False
+        time.sleep(min(retry_delay, remaining))
+        retry_delay *= 2
+
 def focus_window(app_name_or_title_keyword):
     print(f"INFO: Focusing window: {app_name_or_title_keyword}")
-    if not pygetwindow_available: return False, "Window focusing unavailable; 'pygetwindow' missing."
+    if window_inventory.backend is None and not backend_available("pygetwindow"): return False, "Window focusing unavailable; 'pygetwindow' missing."
     try:
-        keyword_lower = app_name_or_title_keyword.lower(); windows = pygetwindow.getWindowsWithTitle(keyword_lower) # Exact match first
-        if not windows: # Try partial match
-            all_windows = pygetwindow.getAllWindows()
-            windows = [w for w in all_windows if keyword_lower in w.title.lower() and w.visible and not w.isMinimized]
-        if not windows: # Try very broad if still nothing
-            all_windows = pygetwindow.getAllWindows()
-            windows = [w for w in all_windows if keyword_lower in w.title.lower()]
-
-
-        target_window = None
-        if windows:
-            # Prefer active, then visible, then any
-            active_ones = [w for w in windows if w.isActive]
-            visible_ones = [w for w in windows if w.visible and not w.isMinimized] # isMinimized check added
-            
-            if active_ones: target_window = active_ones[0]
-            elif visible_ones: target_window = visible_ones[0]
-            else: target_window = windows[0] # Last resort
+        target_window = window_inventory.find(app_name_or_title_keyword)
 
         if target_window:
             try:
-                if target_window.isMinimized: target_window.restore()
-                target_window.activate()
-                # On some systems, a slight delay and re-activate helps
-                time.sleep(0.1)
-                target_window.activate()
+                if not activate_window(target_window):
+                    print(f"WARN: '{target_window.title}' did not report focus within {WINDOW_ACTIVATE_TIMEOUT_SECONDS}s of activate().")
+                    return False, f"Asked '{target_window.title}' to come to the front, but it didn't take focus."
+                window_inventory.remember(app_name_or_title_keyword, target_window)
                 return True, f"Focused window: {target_window.title}"
             except Exception as e_activate:
+                window_inventory.invalidate() # The window may have gone; re-list next time
                 # Fallback for some systems if activate() fails but window can be brought to front
                 if hasattr(target_window, 'show'): target_window.show()
                 if hasattr(target_window, 'raise_'): target_window.raise_() # newer pygetwindow
@@ -474,7 +1462,7 @@ def focus_window(app_name_or_title_keyword):
 
 def close_current_tab():
     print("INFO: Closing current tab.")
-    if not pynput_available: return False, "Cannot close tab; 'pynput' missing."
+    if not backend_available("pynput"): return False, "Cannot close tab; 'pynput' missing."
     try:
         if platform.system() == "Darwin":
             with keyboard.pressed(Key.cmd): keyboard.tap('w')
@@ -488,40 +1476,341 @@ def get_current_datetime_action():
     date_str = now.strftime("%A, %B %d, %Y"); time_str = now.strftime("%I:%M %p")
     return True, f"The current date is {date_str}, and the time is {time_str}."
 
+class SystemStatsSampler:
+    # Samples CPU (overall and per core), RAM, disk and network throughput every `interval` seconds on a
+    # daemon thread into fixed-size ring buffers (array('d'), one per field, newest at (count - 1) % capacity).
+    # Each field also keeps a ring of running totals, so the average over any recent span is one subtraction.
+    # The top processes by memory and CPU are recomputed every `process_interval` seconds.
+    FIELDS = ("cpu", "ram", "disk", "net_sent", "net_recv") # Percentages, then bytes per second
+
+    def __init__(self, capacity, interval, process_interval):
+        self.capacity, self.interval, self.process_interval = capacity, interval, process_interval
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.first_sample_event = threading.Event()
+        self.thread = None
+        self.times = array.array('d', [0.0]) * capacity
+        self.series = {field: array.array('d', [0.0]) * capacity for field in self.FIELDS}
+        self.running_totals = {field: array.array('d', [0.0]) * capacity for field in self.FIELDS}
+        self.totals = dict.fromkeys(self.FIELDS, 0.0)
+        self.core_count = 0
+        self.cores = None # Latest per-core percentages (array('d'), core_count long)
+        self.count = 0 # Samples taken so far
+        self.ram_total = 0
+        self.last_net = None # (time, bytes_sent, bytes_recv) of the previous sample
+        self.top_by_memory, self.top_by_cpu = [], [] # (name, pid, rss_bytes, cpu_percent_of_total)
+        self.processes_sampled_at = 0.0
+
+    def start(self):
+        # Starts the sampling thread once and waits (briefly) for its first sample
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.first_sample_event.wait(timeout=self.interval + 2)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        # Primes the CPU counters (system and per process); the first reading has nothing to compare with
+        psutil.cpu_percent(interval=None, percpu=True)
+        try: self.sample_processes(1)
+        except Exception: pass
+        delay = min(self.interval, 0.5)
+        while not self.stop_event.wait(delay):
+            try: self.take_sample()
+            except Exception as e: print(f"WARN: System stats sample failed: {e}")
+            self.first_sample_event.set()
+            delay = self.interval
+
+    def take_sample(self):
+        now = time.time()
+        per_core = psutil.cpu_percent(interval=None, percpu=True)
+        ram = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        net = psutil.net_io_counters()
+        sent_rate = recv_rate = 0.0
+        if self.last_net and net and now > self.last_net[0]:
+            elapsed = now - self.last_net[0]
+            sent_rate = max(0.0, (net.bytes_sent - self.last_net[1]) / elapsed)
+            recv_rate = max(0.0, (net.bytes_recv - self.last_net[2]) / elapsed)
+        if net: self.last_net = (now, net.bytes_sent, net.bytes_recv)
+        values = {"cpu": sum(per_core) / len(per_core) if per_core else 0.0, "ram": ram.percent, "disk": disk.percent,
+                  "net_sent": sent_rate, "net_recv": recv_rate}
+        top_lists = self.sample_processes(len(per_core)) if now - self.processes_sampled_at >= self.process_interval else None
+        with self.lock:
+            self.record(now, values)
+            self.core_count, self.cores = len(per_core), array.array('d', per_core)
+            self.ram_total = ram.total
+            if top_lists:
+                self.top_by_memory, self.top_by_cpu = top_lists
+                self.processes_sampled_at = now
+
+    def record(self, timestamp, values): # Called with self.lock held
+        slot = self.count % self.capacity
+        self.times[slot] = timestamp
+        for field in self.FIELDS:
+            self.series[field][slot] = values[field]
+            self.totals[field] += values[field]
+            self.running_totals[field][slot] = self.totals[field]
+        self.count += 1
+
+    def sample_processes(self, core_count):
+        # A full process scan (psutil keeps the Process objects, so cpu_percent is the use since the last scan)
+        processes = []
+        for proc in psutil.process_iter(['name', 'memory_info', 'cpu_percent']):
+            memory = proc.info.get('memory_info')
+            processes.append((proc.info.get('name') or f"pid {proc.pid}", proc.pid, memory.rss if memory else 0,
+                              (proc.info.get('cpu_percent') or 0.0) / max(core_count, 1)))
+        return (heapq.nlargest(STATS_TOP_PROCESSES, processes, key=lambda p: p[2]),
+                heapq.nlargest(STATS_TOP_PROCESSES, processes, key=lambda p: p[3]))
+
+    def latest(self):
+        # Newest sample as a dict (None before the first one)
+        with self.lock:
+            if not self.count: return None
+            slot = (self.count - 1) % self.capacity
+            sample = {field: self.series[field][slot] for field in self.FIELDS}
+            sample["time"], sample["ram_total"] = self.times[slot], self.ram_total
+            sample["busiest_core"] = max(self.cores) if self.cores else sample["cpu"]
+            sample["core_count"] = self.core_count
+            return sample
+
+    def average(self, field, seconds):
+        # (average, peak, seconds covered, samples) for `field` over the newest samples spanning `seconds`
+        with self.lock:
+            if not self.count: return None
+            available = min(self.count, self.capacity - 1) # One slot keeps the running total before the window
+            wanted = max(1, min(available, int(round(seconds / self.interval))))
+            newest = self.count - 1
+            totals = self.running_totals[field]
+            before = totals[(newest - wanted) % self.capacity] if newest - wanted >= 0 else 0.0
+            average = (totals[newest % self.capacity] - before) / wanted
+            values = self.series[field]
+            peak = max(values[(newest - k) % self.capacity] for k in range(wanted))
+            covered = self.times[newest % self.capacity] - self.times[(newest - wanted + 1) % self.capacity] + self.interval
+            return average, peak, covered, wanted
+
+    def top_processes(self, by="memory", count=5):
+        with self.lock:
+            return list(self.top_by_cpu if by == "cpu" else self.top_by_memory)[:count]
+
+system_stats_sampler = SystemStatsSampler(max(2, int(STATS_HISTORY_SECONDS / STATS_SAMPLE_INTERVAL_SECONDS)),
+                                          STATS_SAMPLE_INTERVAL_SECONDS, STATS_PROCESS_SAMPLE_SECONDS)
+
+def get_stats_sample():
+    # The sampler's newest sample, starting it on first use
+    system_stats_sampler.start()
+    return system_stats_sampler.latest()
+
+def format_byte_rate(bytes_per_second):
+    if bytes_per_second >= 1024**2: return f"{bytes_per_second / 1024**2:.1f} MB/s"
+    return f"{bytes_per_second / 1024:.1f} KB/s"
+
+def format_duration_words(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600 and seconds % 3600 == 0: return f"{seconds // 3600} hour{'s' if seconds != 3600 else ''}"
+    if seconds >= 60: return f"{seconds / 60:.0f} minute{'s' if round(seconds / 60) != 1 else ''}"
+    return f"{seconds} second{'s' if seconds != 1 else ''}"
+
 def get_system_stats_action():
-    if not psutil_available: return False, "Cannot get system stats; 'psutil' missing."
+    if not backend_available("psutil"): return False, "Cannot get system stats; 'psutil' missing."
+    try:
+        sample = get_stats_sample()
+        if not sample: return False, "The system stats sampler has no readings yet."
+        minute = system_stats_sampler.average("cpu", 60)
+        cpu_detail = f"{sample['cpu']:.1f}%"
+        if minute and minute[3] > 1: cpu_detail += f" (averaging {minute[0]:.1f}% over the last {format_duration_words(minute[2])}, busiest core {sample['busiest_core']:.1f}%)"
+        return True, (f"Current system load: CPU at {cpu_detail}, RAM at {sample['ram']:.1f}% (of {sample['ram_total'] / (1024**3):.1f}GB), "
+                      f"Disk at {sample['disk']:.1f}%, network {format_byte_rate(sample['net_recv'])} down / {format_byte_rate(sample['net_sent'])} up.")
+    except Exception as e: return False, f"Trouble getting system stats: {e}"
+
+def get_stats_average_action(metric, seconds):
+    # metric: "cpu", "ram", "disk" or "network"
+    if not backend_available("psutil"): return False, "Cannot get system stats; 'psutil' missing."
     try:
-        cpu_usage = psutil.cpu_percent(interval=0.5)
-        ram = psutil.virtual_memory(); ram_percent = ram.percent
-        disk = psutil.disk_usage('/'); disk_percent = disk.percent
-        return True, f"Current system load: CPU at {cpu_usage}%, RAM at {ram_percent}% (of {ram.total / (1024**3):.1f}GB), Disk at {disk_percent}%."
+        if not get_stats_sample(): return False, "The system stats sampler has no readings yet."
+        if metric == "network":
+            received, sent = system_stats_sampler.average("net_recv", seconds), system_stats_sampler.average("net_sent", seconds)
+            summary = (f"Network traffic averaged {format_byte_rate(received[0])} down (peak {format_byte_rate(received[1])}) and "
+                       f"{format_byte_rate(sent[0])} up (peak {format_byte_rate(sent[1])})")
+            covered = received[2]
+        else:
+            average, peak, covered, _ = system_stats_sampler.average(metric, seconds)
+            summary = f"{metric.upper()} usage averaged {average:.1f}% (peak {peak:.1f}%)"
+        span = f"over the last {format_duration_words(covered)}"
+        if covered + system_stats_sampler.interval < seconds: span += " (all the history recorded so far)"
+        return True, f"{summary} {span}."
     except Exception as e: return False, f"Trouble getting system stats: {e}"
 
-def list_directory_contents_action(path="."):
+def get_top_processes_action(by="memory", count=5):
+    if not backend_available("psutil"): return False, "Cannot list processes; 'psutil' missing."
+    try:
+        get_stats_sample()
+        top = system_stats_sampler.top_processes(by, count)
+        if not top: return False, "No process readings yet."
+        if by == "cpu": listed = [f"{name} (pid {pid}) {cpu:.1f}% CPU" for name, pid, _, cpu in top]
+        else: listed = [f"{name} (pid {pid}) {rss / 1024**2:.0f} MB" for name, pid, rss, _ in top]
+        return True, f"Top {len(top)} processes by {'CPU' if by == 'cpu' else 'memory'}: " + "; ".join(listed) + "."
+    except Exception as e: return False, f"Trouble listing processes: {e}"
+
+def iter_directory_entries(root, recursive=False, max_depth=0):
+    # Yields (relative_path, DirEntry) under root with os.scandir, depth-first and lazily, without following
+    # symlinked directories. DirEntry keeps the file type from the directory read, so is_dir()/is_file()
+    # need no extra stat call on most platforms. Unreadable subdirectories are skipped.
+    stack = [(root, "", 0)]
+    while stack:
+        directory, prefix, depth = stack.pop()
+        try: iterator = os.scandir(directory)
+        except OSError:
+            if depth == 0: raise
+            continue
+        with iterator:
+            for entry in iterator:
+                relative_path = prefix + entry.name
+                yield relative_path, entry
+                if recursive and depth < max_depth:
+                    try: is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError: is_dir = False
+                    if is_dir: stack.append((entry.path, relative_path + os.sep, depth + 1))
+
+def entry_stat_value(entry, attribute):
+    try: return getattr(entry.stat(), attribute)
+    except OSError: return -1 # Broken symlink or vanished file
+
+# Listing sort orders: sort name -> (key over (relative_path, entry, is_dir), largest/newest first?)
+DIRECTORY_SORTS = {
+    "name": (lambda item: item[0].lower(), False),
+    "largest": (lambda item: entry_stat_value(item[1], "st_size"), True),
+    "smallest": (lambda item: entry_stat_value(item[1], "st_size"), False),
+    "newest": (lambda item: entry_stat_value(item[1], "st_mtime"), True),
+    "oldest": (lambda item: entry_stat_value(item[1], "st_mtime"), False),
+}
+DIRECTORY_SORT_LABELS = {"name": "by name", "largest": "largest first", "smallest": "smallest first",
+                         "newest": "newest first", "oldest": "oldest first"}
+
+def format_file_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB": return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def summarize_directory(path, actual_path):
+    # The classic reply: counts plus the first few directories and files, in one streaming pass
+    dirs, files, others = [], [], []
+    dir_count = file_count = item_count = 0
+    for name, entry in iter_directory_entries(actual_path):
+        item_count += 1
+        if len(others) < 10: others.append(name)
+        try: is_dir, is_file = entry.is_dir(), entry.is_file()
+        except OSError: is_dir = is_file = False
+        if is_dir:
+            dir_count += 1
+            if len(dirs) < 5: dirs.append(name)
+        elif is_file:
+            file_count += 1
+            if len(files) < 5: files.append(name)
+    if not item_count: return True, f"The directory '{path}' is empty."
+
+    response_str = f"Contents of '{path}':"
+    if dirs:
+        response_str += f"\n  Directories: {', '.join(dirs)}"
+        if dir_count > 5: response_str += f", and {dir_count-5} more."
+    if files:
+        response_str += f"\n  Files: {', '.join(files)}"
+        if file_count > 5: response_str += f", and {file_count-5} more."
+    if not dirs and not files: # Other types of items
+        response_str += f"\n  Items: {', '.join(others)}"
+        if item_count > 10: response_str += f", and {item_count-10} more."
+    return True, response_str
+
+last_directory_listing = None # Options and next offset of the last listing, for 'next 20'
+# The last listing materialized in full (on its second page), so later pages are slices instead of rescans:
+# {"key": (path, sort, pattern, depth, directory mtime), "items": [(relative_path, is_dir, size or mtime)], "matched", "truncated"}
+directory_listing_cache = None
+
+def list_directory_contents_action(path=".", sort_by=None, pattern=None, recursive=False, max_depth=None, offset=0, limit=None):
+    # Without options: the classic summary. With any of them: one page of `limit` entries starting at `offset`,
+    # sorted by a DIRECTORY_SORTS order (kept to a bounded heap, never a full sort), filtered by a glob pattern,
+    # optionally recursive to max_depth. The first page is one streaming pass over the tree; the second
+    # materializes the whole (sorted) listing once, and later pages of it are slices of that.
+    global last_directory_listing, directory_listing_cache
     try:
         actual_path = os.path.expanduser(path.strip().strip("'\"")) # Clean path
         if not os.path.isdir(actual_path): return False, f"Path '{path}' isn't a directory or I can't find it."
-        items = os.listdir(actual_path)
-        if not items: return True, f"The directory '{path}' is empty."
-        
-        # Separate files and directories
-        files = [item for item in items if os.path.isfile(os.path.join(actual_path, item))]
-        dirs = [item for item in items if os.path.isdir(os.path.join(actual_path, item))]
-
-        response_str = f"Contents of '{path}':"
-        if dirs:
-            response_str += f"\n  Directories: {', '.join(dirs[:5])}"
-            if len(dirs) > 5: response_str += f", and {len(dirs)-5} more."
-        if files:
-            response_str += f"\n  Files: {', '.join(files[:5])}"
-            if len(files) > 5: response_str += f", and {len(files)-5} more."
-        if not dirs and not files and items: # Other types of items
-             response_str += f"\n  Items: {', '.join(items[:10])}"
-             if len(items) > 10: response_str += f", and {len(items)-10} more."
-
+        paged = sort_by or pattern or recursive or offset or limit
+        limit = limit or DIRECTORY_PAGE_SIZE
+        last_directory_listing = {"path": path, "sort_by": sort_by, "pattern": pattern, "recursive": recursive,
+                                  "max_depth": max_depth, "offset": offset, "limit": limit}
+        if not paged: return summarize_directory(path, actual_path)
+
+        depth = (max_depth if max_depth is not None else DIRECTORY_RECURSIVE_DEPTH) if recursive else 0
+        name_matches = re.compile(fnmatch.translate(pattern), re.IGNORECASE).match if pattern else None
+        by_size = sort_by in ("largest", "smallest")
+        stat_field = "st_size" if by_size else "st_mtime" if sort_by in ("newest", "oldest") else None
+        counts = {"scanned": 0, "matched": 0, "truncated": False}
+        def matching_entries():
+            for relative_path, entry in iter_directory_entries(actual_path, recursive, depth):
+                counts["scanned"] += 1
+                if counts["scanned"] > DIRECTORY_SCAN_LIMIT:
+                    counts["truncated"] = True
+                    return
+                if name_matches and not name_matches(entry.name): continue
+                try: is_dir = entry.is_dir()
+                except OSError: is_dir = False
+                if by_size and is_dir: continue # Directory sizes aren't their contents' sizes
+                counts["matched"] += 1
+                yield relative_path, entry, is_dir
+
+        def compact(items): # Drops the DirEntry objects; keeps what a reply line shows
+            return [(relative_path, is_dir, entry_stat_value(entry, stat_field) if stat_field else None)
+                    for relative_path, entry, is_dir in items]
+
+        # A recursive listing's key only covers the top directory's mtime; changes deeper down show up in a new listing
+        cache_key = (actual_path, sort_by, pattern, depth, os.stat(actual_path).st_mtime_ns)
+        cached = directory_listing_cache if offset and directory_listing_cache and directory_listing_cache["key"] == cache_key else None
+        if cached:
+            counts.update(matched=cached["matched"], truncated=cached["truncated"])
+            page = cached["items"][offset:offset + limit]
+        elif offset: # 'next': sort (nlargest/nsmallest order) or collect everything once, for this page and the following ones
+            items = compact(matching_entries())
+            if sort_by: # Same keys (and stable order for ties) as DIRECTORY_SORTS, over the compact tuples
+                items.sort(key=(lambda item: item[0].lower()) if sort_by == "name" else (lambda item: item[2]), reverse=DIRECTORY_SORTS[sort_by][1])
+            directory_listing_cache = {"key": cache_key, "items": items, "matched": counts["matched"], "truncated": counts["truncated"]}
+            page = items[offset:offset + limit]
+        elif sort_by:
+            key, descending = DIRECTORY_SORTS[sort_by]
+            page = compact((heapq.nlargest if descending else heapq.nsmallest)(limit, matching_entries(), key=key))
+        else:
+            entries = matching_entries()
+            page = compact(itertools.islice(entries, limit))
+            collections.deque(entries, maxlen=0) # Finish the pass for the total count
+        last_directory_listing["offset"] = offset + len(page)
+
+        details = ([f"matching '{pattern}'"] if pattern else []) + ([DIRECTORY_SORT_LABELS[sort_by]] if sort_by else []) + \
+                  ([f"recursive to depth {depth}"] if recursive else [])
+        description = f" ({', '.join(details)})" if details else ""
+        if not counts["matched"]: return True, f"Nothing in '{path}'{description}."
+        if not page: return True, f"No more entries in '{path}'{description}; all {counts['matched']} were listed."
+        response_str = f"Contents of '{path}'{description}, items {offset + 1}-{offset + len(page)} of {counts['matched']}"
+        if counts["truncated"]: response_str += f" (stopped after scanning {DIRECTORY_SCAN_LIMIT} entries)"
+        response_str += ":"
+        for relative_path, is_dir, stat_value in page:
+            line = relative_path + (os.sep if is_dir else "")
+            if by_size: line += f" ({format_file_size(stat_value)})"
+            elif stat_field and stat_value >= 0: line += f" ({datetime.datetime.fromtimestamp(stat_value).strftime('%Y-%m-%d %H:%M')})"
+            response_str += f"\n  {line}"
+        if offset + len(page) < counts["matched"]: response_str += f"\n  Say 'next {limit}' for more."
         return True, response_str
     except Exception as e: return False, f"Couldn't list contents of '{path}': {e}"
 
+def list_directory_next_page_action(count=None):
+    # Continues the last listing (None if there was none)
+    if not last_directory_listing: return None
+    listing = dict(last_directory_listing)
+    return list_directory_contents_action(listing["path"], listing["sort_by"], listing["pattern"], listing["recursive"],
+                                          listing["max_depth"], listing["offset"], count or listing["limit"])
+
 def create_directory_action(path):
     try:
         actual_path = os.path.expanduser(path.strip().strip("'\"")) # Clean path
@@ -532,11 +1821,19 @@ def create_directory_action(path):
 def open_file_with_default_app_action(filepath):
     try:
         actual_filepath = os.path.expanduser(filepath.strip().strip("'\"")) # Clean path
+        if not os.path.isfile(actual_filepath) and FILE_INDEX_ENABLED and not os.path.isabs(actual_filepath):
+            file_index_status_note()
+            best = file_index.search(os.path.basename(actual_filepath), limit=1) # Not a path; the best indexed name match
+            if best:
+                print(f"INFO: '{filepath}' resolved through the file index to {best[0][0]}")
+                actual_filepath = filepath = best[0][0]
         if not os.path.isfile(actual_filepath): return False, f"'{filepath}' isn't a file or I can't find it."
         print(f"INFO: Attempting to open file: {actual_filepath}")
         if platform.system() == "Windows": os.startfile(actual_filepath)
-        elif platform.system() == "Darwin": subprocess.run(['open', actual_filepath], check=True)
-        else: subprocess.run(['xdg-open', actual_filepath], check=True) # Linux
+        elif platform.system() == "Darwin": run_process(['open', actual_filepath], check=True)
+        else: # Linux: xdg-open, or whichever opener the capability probe found
+            backends = capability_registry.backends("open_file")
+            run_process(capability_command(backends[0], path=actual_filepath) if backends else ['xdg-open', actual_filepath], check=True)
         return True, f"File '{os.path.basename(filepath)}' should be opening with its default application."
     except FileNotFoundError: return False, f"File '{filepath}' not found at the specified path."
     except Exception as e: return False, f"An issue occurred when trying to open '{filepath}': {e}"
@@ -551,52 +1848,185 @@ def check_internet_connection_action():
         return False, "It seems I'm unable to connect to the internet at the moment."
 
 def take_note_action(note_content):
-    global jarvis_notes
-    with chat_history_lock: # Assuming notes might be accessed/modified from GUI thread later
-        jarvis_notes.append(note_content)
+    jarvis_store.add_note(note_content)
     return True, f"Noted. '{note_content[:30].strip()}...' has been added to my memory."
 
-def view_notes_action():
-    global jarvis_notes
-    with chat_history_lock:
-        if not jarvis_notes: return True, "My notepad is currently empty."
-        notes_str = "\n".join([f"- {note}" for note in jarvis_notes])
-    return True, f"Here are your current notes:\n{notes_str}"
+def format_notes_page(notes, total, page, what):
+    # One page of notes for the action status (and hence the prompt), with a hint when there are more
+    first = (page - 1) * NOTES_PAGE_SIZE + 1
+    notes_str = "\n".join([f"- {note}" for note in notes])
+    more_str = f"\n(Add 'page {page + 1}' to the request for more.)" if first + len(notes) - 1 < total else ""
+    range_str = f" ({first}-{first + len(notes) - 1} of {total})" if total > len(notes) else ""
+    return f"Here are {what}{range_str}:\n{notes_str}{more_str}"
+
+def view_notes_action(page=1):
+    total = jarvis_store.count_notes()
+    if not total: return True, "My notepad is currently empty."
+    notes = jarvis_store.list_notes(NOTES_PAGE_SIZE, (page - 1) * NOTES_PAGE_SIZE)
+    if not notes: return False, f"There is no page {page}; you have {total} note(s)."
+    return True, format_notes_page(notes, total, page, "your current notes")
+
+def search_notes_action(query_text, tag=None, page=1):
+    total, notes = jarvis_store.search_notes(query_text, tag, NOTES_PAGE_SIZE, (page - 1) * NOTES_PAGE_SIZE)
+    what = " and ".join(part for part in (f"matching '{query_text}'" if query_text else "", f"tagged #{tag}" if tag else "") if part)
+    if not total: return True, f"I found no notes {what}."
+    if not notes: return False, f"There is no page {page}; only {total} note(s) are {what}."
+    return True, format_notes_page(notes, total, page, f"the notes {what}")
+
+def recent_notes_action(count):
+    notes = jarvis_store.recent_notes(max(1, min(count, NOTES_PAGE_SIZE * 5)))
+    if not notes: return True, "My notepad is currently empty."
+    return True, format_notes_page(notes, len(notes), 1, f"your last {len(notes)} note(s)")
 
 def clear_notes_action():
-    global jarvis_notes
-    with chat_history_lock:
-        count = len(jarvis_notes)
-        jarvis_notes = []
+    count = jarvis_store.clear_notes()
     return True, f"All {count} note(s) have been cleared from my memory."
 
 def copy_to_clipboard_action(text_to_copy):
-    if not pyperclip_available: return False, "Clipboard operations unavailable; 'pyperclip' missing."
+    if not backend_available("pyperclip"): return False, "Clipboard operations unavailable; 'pyperclip' missing."
     try:
         pyperclip.copy(text_to_copy)
         return True, f"'{text_to_copy[:30].strip()}...' has been copied to the clipboard."
     except Exception as e: return False, f"A small hiccup occurred trying to copy to clipboard: {e}"
 
 def get_clipboard_content_action():
-    if not pyperclip_available: return False, "Clipboard operations unavailable; 'pyperclip' missing."
+    if not backend_available("pyperclip"): return False, "Clipboard operations unavailable; 'pyperclip' missing."
     try:
         content = pyperclip.paste()
         if not content: return True, "The clipboard is currently empty."
         return True, f"The clipboard contains: '{content[:100].strip()}{'...' if len(content)>100 else ''}'"
     except Exception as e: return False, f"There was a slight issue reading from the clipboard: {e}"
 
+class TextInjector:
+    # Puts the text of 'type ...' into the focused window from the async core. It first waits for
+    # focus to move off the window that was active when the command came in (polling, up to
+    # TYPE_TEXT_FOCUS_TIMEOUT_SECONDS; a fixed TYPE_TEXT_DELAY_SECONDS when the active window can't
+    # be read), then either pastes it (clipboard saved and put back afterwards) or types it in
+    # TYPE_TEXT_CHUNK_CHARS pieces at TYPE_TEXT_CHARS_PER_SECOND. cancel() stops it between chunks,
+    # and typing also stops if focus leaves the target window. The backends default to pynput,
+    # pyperclip and pygetwindow; the benchmark passes fakes.
+    def __init__(self, keyboard_backend=None, clipboard_backend=None, window_backend=None):
+        self.keyboard_backend = keyboard_backend
+        self.clipboard_backend = clipboard_backend
+        self.window_backend = window_backend
+        self.lock = threading.Lock()
+        self.task = None # concurrent future of the running injection
+
+    def get_keyboard(self): return self.keyboard_backend or keyboard
+    def get_clipboard(self):
+        if self.clipboard_backend: return self.clipboard_backend
+        return pyperclip if backend_available("pyperclip") else None
+    def get_windows(self):
+        if self.window_backend: return self.window_backend
+        return pygetwindow if backend_available("pygetwindow") else None
+
+    def choose_mode(self, text, mode=None):
+        mode = (mode or TYPE_TEXT_MODE).lower()
+        if mode == "auto": mode = "paste" if len(text) >= TYPE_TEXT_PASTE_MIN_CHARS else "type"
+        if mode == "paste" and self.get_clipboard() is None: mode = "type" # No clipboard library: type it instead
+        return mode
+
+    def active_window_key(self):
+        # Identity of the focused window, or None when it can't be read (no pygetwindow, or a
+        # platform where getActiveWindow() isn't implemented)
+        windows = self.get_windows()
+        if windows is None: return None
+        try: window = windows.getActiveWindow()
+        except Exception: return None
+        if window is None: return ""
+        return (getattr(window, "_hWnd", None) or id(window), window.title or "")
+
+    async def wait_for_target(self, origin_key):
+        # Returns the target window's key, None if focus can't be tracked (after the fixed delay),
+        # or False if focus never moved within the timeout
+        if origin_key is None:
+            await asyncio.sleep(TYPE_TEXT_DELAY_SECONDS)
+            return None
+        deadline = time.monotonic() + TYPE_TEXT_FOCUS_TIMEOUT_SECONDS
+        while time.monotonic() < deadline:
+            await asyncio.sleep(TYPE_TEXT_FOCUS_POLL_SECONDS)
+            key = await asyncio.to_thread(self.active_window_key)
+            if key and key != origin_key:
+                await asyncio.sleep(TYPE_TEXT_FOCUS_POLL_SECONDS) # Let the newly focused window finish activating
+                return key
+        return False
+
+    async def paste(self, text):
+        clipboard, kb = self.get_clipboard(), self.get_keyboard()
+        try: saved = await asyncio.to_thread(clipboard.paste)
+        except Exception: saved = None # Non-text clipboard contents can't be saved through pyperclip
+        try:
+            await asyncio.to_thread(clipboard.copy, text)
+            modifier = Key.cmd if platform.system() == "Darwin" else Key.ctrl
+            def press_paste():
+                with kb.pressed(modifier): kb.tap('v')
+            await asyncio.to_thread(press_paste)
+            await asyncio.sleep(TYPE_TEXT_PASTE_SETTLE_SECONDS) # The target reads the clipboard after the keystroke
+        finally:
+            if saved is not None: await asyncio.to_thread(clipboard.copy, saved)
+        return len(text)
+
+    async def type_chunks(self, text, target_key):
+        # Returns how many characters were typed; stops early (short count) if focus leaves the target
+        kb, typed = self.get_keyboard(), 0
+        started = time.monotonic()
+        while typed < len(text):
+            if target_key and await asyncio.to_thread(self.active_window_key) != target_key: break
+            chunk = text[typed:typed + TYPE_TEXT_CHUNK_CHARS]
+            await asyncio.to_thread(kb.type, chunk)
+            typed += len(chunk)
+            if TYPE_TEXT_CHARS_PER_SECOND > 0:
+                ahead = started + typed / TYPE_TEXT_CHARS_PER_SECOND - time.monotonic()
+                if ahead > 0: await asyncio.sleep(ahead)
+            else: await asyncio.sleep(0) # Still give cancel() a chance between chunks
+        return typed
+
+    async def inject(self, text, origin_key, mode):
+        try:
+            target_key = await self.wait_for_target(origin_key)
+            if target_key is False:
+                display_message_in_ui_or_console(f"Jarvis: Focus didn't move to another window within {TYPE_TEXT_FOCUS_TIMEOUT_SECONDS:g} seconds, so I didn't type anything.", role="system")
+                return 0
+            if mode == "paste": return await self.paste(text)
+            typed = await self.type_chunks(text, target_key)
+            if typed < len(text):
+                display_message_in_ui_or_console(f"Jarvis: The target window lost focus, so I stopped typing after {typed} of {len(text)} characters.", role="system")
+            return typed
+        except asyncio.CancelledError: raise
+        except Exception as e:
+            display_message_in_ui_or_console(f"Jarvis: My typing mechanism encountered an issue: {e}", role="system")
+            return 0
+
+    def start(self, text, mode=None):
+        # Returns the mode used; the origin window is read here, before the reply is shown
+        mode = self.choose_mode(text, mode)
+        origin_key = self.active_window_key()
+        with self.lock:
+            if self.task is not None: self.task.cancel() # A new 'type' replaces one still waiting or typing
+            self.task = async_core.submit(self.inject(text, origin_key, mode))
+        return mode, origin_key is not None
+
+    def cancel(self):
+        with self.lock:
+            task, self.task = self.task, None
+        return task is not None and task.cancel() # False if it had already finished
+
+text_injector = TextInjector()
+
 def type_text_action(text_to_type):
-    if not pynput_available: return False, "Typing capability unavailable; 'pynput' missing."
+    if not backend_available("pynput"): return False, "Typing capability unavailable; 'pynput' missing."
     try:
-        # Announce and delay
-        display_message_in_ui_or_console("Jarvis: I will begin typing in 2 seconds. Please focus the target window...")
-        time.sleep(2.5) # Give a bit more time
-        keyboard.type(text_to_type)
-        return True, "The requested text has been typed out."
+        mode, tracks_focus = text_injector.start(text_to_type)
+        how = "paste" if mode == "paste" else "type"
+        when = "as soon as you switch to the target window" if tracks_focus else f"in {TYPE_TEXT_DELAY_SECONDS:g} seconds. Please focus the target window"
+        return True, f"I will {how} {len(text_to_type)} characters {when}. Say 'stop typing' to cancel."
     except Exception as e: return False, f"My typing mechanism encountered an issue: {e}"
 
+def cancel_typing_action():
+    if text_injector.cancel(): return True, "Typing cancelled."
+    return False, "There is no typing in progress."
+
 def set_jarvis_timer_action(duration_str, description="timer"):
-    global active_timers, timer_id_counter, chat_history_lock
     seconds = 0
     original_input_for_message = duration_str # Keep original for messages
     duration_lower = duration_str.lower()
@@ -638,162 +2068,228 @@ def set_jarvis_timer_action(duration_str, description="timer"):
         return False, "That duration doesn't seem quite right. Could you specify it like '10 minutes' or '1h 30s'?"
 
     end_time = time.time() + seconds
-    with chat_history_lock: # Protect timer_id_counter and active_timers
-        timer_id_counter += 1
-        # Make description more robust
-        clean_description = description.strip().strip("'\"") if description else "your task"
-        if not clean_description: clean_description = "your task"
-
-        # Create a more readable duration string for the notification
-        readable_duration = ""
-        temp_seconds = seconds
-        _hours = temp_seconds // 3600
-        temp_seconds %= 3600
-        _minutes = temp_seconds // 60
-        _seconds = temp_seconds % 60
-        if _hours > 0: readable_duration += f"{_hours} hour{'s' if _hours > 1 else ''} "
-        if _minutes > 0: readable_duration += f"{_minutes} minute{'s' if _minutes > 1 else ''} "
-        if _seconds > 0 or not readable_duration : readable_duration += f"{_seconds} second{'s' if _seconds > 1 else ''}"
-        original_input_for_message = readable_duration.strip()
-
-
-        timer_entry = (end_time, original_input_for_message, clean_description, timer_id_counter)
-        active_timers.append(timer_entry)
-        active_timers.sort() # Keep sorted by end_time
-
-    return True, f"Understood. A {original_input_for_message} timer, ID {timer_id_counter}, has been set for '{clean_description}'."
+    # Make description more robust
+    clean_description = description.strip().strip("'\"") if description else "your task"
+    if not clean_description: clean_description = "your task"
+
+    # Create a more readable duration string for the notification
+    readable_duration = ""
+    temp_seconds = seconds
+    _hours = temp_seconds // 3600
+    temp_seconds %= 3600
+    _minutes = temp_seconds // 60
+    _seconds = temp_seconds % 60
+    if _hours > 0: readable_duration += f"{_hours} hour{'s' if _hours > 1 else ''} "
+    if _minutes > 0: readable_duration += f"{_minutes} minute{'s' if _minutes > 1 else ''} "
+    if _seconds > 0 or not readable_duration : readable_duration += f"{_seconds} second{'s' if _seconds > 1 else ''}"
+    original_input_for_message = readable_duration.strip()
+
+    timer_id = timer_scheduler.add(end_time, original_input_for_message, clean_description)
+    jarvis_store.save_timer((end_time, original_input_for_message, clean_description, timer_id))
+    return True, f"Understood. A {original_input_for_message} timer, ID {timer_id}, has been set for '{clean_description}'."
 
 def cancel_jarvis_timer_action(description_or_id=None):
-    global active_timers, chat_history_lock
-    with chat_history_lock: # Protect active_timers
-        if not active_timers: return False, "There are no active timers to cancel at the moment."
-
-        removed_timers_info = []
-        timers_to_keep = []
-        
-        if not description_or_id: # Cancel the most recently set one if ambiguous or only one exists
-            if len(active_timers) == 1:
-                target_timer = active_timers[0]
-                removed_timers_info.append(f"'{target_timer[2]}' (ID: {target_timer[3]}, duration: {target_timer[1]})")
-                # active_timers.pop(0) # No, rebuild list
-            else: # Multiple timers, no specific one mentioned
-                # Try to find the one added last by ID (highest ID)
-                # Or prompt for which one if LLM is to handle it
-                active_timers.sort(key=lambda t: t[3], reverse=True) # Sort by ID descending
-                target_timer = active_timers[0]
-                removed_timers_info.append(f"'{target_timer[2]}' (ID: {target_timer[3]}, duration: {target_timer[1]})")
-                # active_timers.pop(0) # No, rebuild list
-            active_timers = [t for t in active_timers if t[3] != target_timer[3]]
-
-        else: # Specific description or ID given
-            try: # Check if it's an ID
-                target_id = int(description_or_id.strip())
-                found_by_id = False
-                for timer in active_timers:
-                    if timer[3] == target_id:
-                        removed_timers_info.append(f"'{timer[2]}' (ID: {timer[3]}, duration: {timer[1]})")
-                        found_by_id = True
-                    else:
-                        timers_to_keep.append(timer)
-                if not found_by_id:
-                    return False, f"No timer found with ID {target_id}."
-                active_timers = timers_to_keep
-            except ValueError: # Not an ID, treat as description
-                keyword = description_or_id.lower().strip().strip("'\"")
-                found_by_description = False
-                for timer in active_timers:
-                    if keyword in timer[2].lower():
-                        removed_timers_info.append(f"'{timer[2]}' (ID: {timer[3]}, duration: {timer[1]})")
-                        found_by_description = True
-                    else:
-                        timers_to_keep.append(timer)
-                if not found_by_description:
-                     return False, f"No timer found matching the description '{description_or_id}'."
-                active_timers = timers_to_keep
-        
-        active_timers.sort() # Re-sort by end_time
-
+    # The scheduler does the lookup; an unspecific request cancels the most recently set timer
+    if timer_scheduler.count() == 0: return False, "There are no active timers to cancel at the moment."
+
+    if not description_or_id:
+        removed_timers = timer_scheduler.cancel_latest()
+    else: # Specific description or ID given
+        try: # Check if it's an ID
+            target_id = int(description_or_id.strip())
+            removed_timers = timer_scheduler.cancel_by_id(target_id)
+            if not removed_timers:
+                return False, f"No timer found with ID {target_id}."
+        except ValueError: # Not an ID, treat as description
+            keyword = description_or_id.lower().strip().strip("'\"")
+            removed_timers = timer_scheduler.cancel_matching(keyword)
+            if not removed_timers:
+                 return False, f"No timer found matching the description '{description_or_id}'."
+
+    jarvis_store.delete_timers([timer[3] for timer in removed_timers])
+    removed_timers_info = [f"'{timer[2]}' (ID: {timer[3]}, duration: {timer[1]})" for timer in removed_timers]
     if removed_timers_info:
         return True, f"The following timer(s) have been cancelled: {', '.join(removed_timers_info)}."
-    else: # Should have been caught by earlier checks, but as a fallback
+    else: # Only reachable if the last timer fired between the check above and the cancel
         return False, "Could not identify a specific timer to cancel based on your request."
 
 
 def cancel_all_jarvis_timers_action():
-    global active_timers, chat_history_lock
-    with chat_history_lock:
-        if not active_timers: return False, "There were no active timers to cancel."
-        count = len(active_timers)
-        active_timers.clear()
+    count = len(timer_scheduler.cancel_all())
+    jarvis_store.delete_all_timers()
+    if not count: return False, "There were no active timers to cancel."
     return True, f"All {count} active timer(s) have been successfully cancelled."
 
-def calculate_action(expression_str):
-    # Clean up common spoken prefixes and symbols
-    expression = re.sub(r'^(what is|calculate|compute|evaluate|maths?)\s+', '', expression_str, flags=re.IGNORECASE).strip()
-    expression = expression.replace(" plus ", "+").replace(" minus ", "-").replace(" times ", "*") \
-                         .replace(" multiplied by ", "*").replace(" divided by ", "/").replace(" over ", "/") \
-                         .replace(" to the power of ", "**").replace("^", "**") \
-                         .replace(" x ", "*").replace(" mod ", "%").replace(" modulo ", "%")
-    
-    # Allow basic math functions if we want to extend later, but for now, stick to ast
-    # For security, only allow specific AST nodes
-    allowed_node_types = (
-        ast.Expression, ast.Constant, ast.Num, ast.BinOp, ast.UnaryOp, ast.Add, ast.Sub,
-        ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.USub, ast.UAdd, ast.Call, ast.Name, ast.Load
-    )
-    # Whitelist of safe functions (if we were to allow ast.Call)
-    # safe_functions = {'round': round, 'abs': abs} # Example
+# --- Calculator engine ---
+# Expressions are normalized from spoken forms, validated and compiled once into a tree of closures
+# (cached per normalized text), then run. Only numbers, + - * / // % **, CALCULATOR_CONSTANTS and
+# CALCULATOR_FUNCTIONS are allowed; integer powers, products and factorials are checked against
+# CALCULATOR_MAX_INT_BITS before they are computed, so '9**9**9' fails at once instead of hanging.
+CALCULATOR_WORD_OPERATORS = {"plus": "+", "minus": "-", "times": "*", "multiplied by": "*", "divided by": "/", "over": "/",
+                             "to the power of": "**", "x": "*", "mod": "%", "modulo": "%"}
+CALCULATOR_WORD_OPERATOR_REGEX = re.compile(r'\s+(to the power of|multiplied by|divided by|plus|minus|times|over|x|modulo|mod)\s+')
+CALCULATOR_SPOKEN_FORMS = [ # (regex, replacement) for spoken function forms
+    (re.compile(r'\b(square root|cube root|sqrt|cbrt|log|ln|sin|cos|tan|factorial|abs|absolute value) of\s+(-?[\w.]+)'), lambda m: f"{m.group(1).replace('square root', 'sqrt').replace('cube root', 'cbrt').replace('absolute value', 'abs')}({m.group(2)})"),
+    (re.compile(r'([\w.]+|\([^()]*\))\s+(squared|cubed)\b'), lambda m: f"({m.group(1)})**{2 if m.group(2) == 'squared' else 3}"),
+    (re.compile(r'([\d.]+)\s*(?:%|percent)\s+of\s+'), lambda m: f"{m.group(1)}/100*"),
+    (re.compile(r'(\d+|\([^()]*\))!'), lambda m: f"factorial({m.group(1)})"),
+]
+
+def calculator_int_bits(value):
+    return value.bit_length() if isinstance(value, int) else 0
+
+def calculator_power(base, exponent):
+    if isinstance(base, int) and isinstance(exponent, int) and exponent > 0 and abs(base) > 1:
+        if exponent * math.log2(abs(base)) > CALCULATOR_MAX_INT_BITS: raise OverflowError("That power is too large to compute.")
+    result = base ** exponent
+    if isinstance(result, complex): raise ValueError("The result is a complex number, which I don't handle.")
+    return result
+
+def calculator_multiply(left, right):
+    if calculator_int_bits(left) + calculator_int_bits(right) > CALCULATOR_MAX_INT_BITS + 1:
+        raise OverflowError("That product is too large to compute.")
+    return left * right
+
+def calculator_divide(left, right):
+    if right == 0: raise ZeroDivisionError("Division by zero is not permitted.")
+    return left / right
+
+def calculator_floor_divide(left, right):
+    if right == 0: raise ZeroDivisionError("Division by zero is not permitted.")
+    return left // right
+
+def calculator_modulo(left, right):
+    if right == 0: raise ZeroDivisionError("Modulo by zero is not permitted.")
+    return left % right
+
+def calculator_factorial(n):
+    if isinstance(n, float) and n.is_integer(): n = int(n)
+    if not isinstance(n, int) or n < 0: raise ValueError("factorial needs a whole number of 0 or more.")
+    if n > CALCULATOR_MAX_FACTORIAL: raise OverflowError(f"factorial is limited to {CALCULATOR_MAX_FACTORIAL}.")
+    return math.factorial(n)
+
+def calculator_log(x, base=None):
+    return math.log(x) if base is None else math.log(x, base)
+
+CALCULATOR_BINARY_OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: calculator_multiply, ast.Div: calculator_divide,
+                               ast.FloorDiv: calculator_floor_divide, ast.Mod: calculator_modulo, ast.Pow: calculator_power}
+CALCULATOR_CONSTANTS = {"pi": math.pi, "e": math.e, "tau": math.tau}
+CALCULATOR_FUNCTIONS = { # Trigonometry works in radians
+    "sqrt": math.sqrt, "cbrt": lambda x: math.copysign(abs(x) ** (1 / 3), x), "exp": math.exp,
+    "log": calculator_log, "ln": math.log, "log10": math.log10, "log2": math.log2,
+    "sin": math.sin, "cos": math.cos, "tan": math.tan, "asin": math.asin, "acos": math.acos, "atan": math.atan,
+    "sinh": math.sinh, "cosh": math.cosh, "tanh": math.tanh, "degrees": math.degrees, "radians": math.radians,
+    "hypot": math.hypot, "abs": abs, "round": round, "floor": math.floor, "ceil": math.ceil,
+    "factorial": calculator_factorial, "gcd": math.gcd, "min": min, "max": max,
+}
+
+def compile_calculator_node(node):
+    # Validates one AST node and returns a zero-argument function computing it
+    if isinstance(node, ast.Expression): return compile_calculator_node(node.body)
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise ValueError(f"Unsupported value in expression: {node.value!r}")
+        value = node.value
+        return lambda: value
+    if isinstance(node, ast.Name):
+        if node.id not in CALCULATOR_CONSTANTS: raise ValueError(f"Unknown name in expression: '{node.id}'")
+        value = CALCULATOR_CONSTANTS[node.id]
+        return lambda: value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        operand = compile_calculator_node(node.operand)
+        return (lambda: -operand()) if isinstance(node.op, ast.USub) else operand
+    if isinstance(node, ast.BinOp) and type(node.op) in CALCULATOR_BINARY_OPERATORS:
+        function, left, right = CALCULATOR_BINARY_OPERATORS[type(node.op)], compile_calculator_node(node.left), compile_calculator_node(node.right)
+        return lambda: function(left(), right())
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in CALCULATOR_FUNCTIONS or node.keywords:
+            raise ValueError(f"Unsupported function in expression: {ast.unparse(node.func)}")
+        function, arguments = CALCULATOR_FUNCTIONS[node.func.id], [compile_calculator_node(argument) for argument in node.args]
+        return lambda: function(*[argument() for argument in arguments])
+    raise ValueError(f"Unsupported operation or character in expression: {type(node).__name__}")
+
+@functools.lru_cache(maxsize=CALCULATOR_CACHE_SIZE)
+def compile_calculator_expression(expression):
+    # Normalized expression text -> compiled evaluator (raises SyntaxError/ValueError for invalid input)
+    if len(expression) > CALCULATOR_MAX_EXPRESSION_CHARS:
+        raise ValueError(f"Expressions are limited to {CALCULATOR_MAX_EXPRESSION_CHARS} characters.")
+    return compile_calculator_node(ast.parse(expression, mode='eval'))
+
+def normalize_calculator_expression(expression_str):
+    # Clean up common spoken prefixes, words and symbols
+    expression = re.sub(r'^(what is|calculate|compute|evaluate|maths?)\s+', '', expression_str, flags=re.IGNORECASE).strip().rstrip("?").strip()
+    expression = expression.lower()
+    for pattern, replacement in CALCULATOR_SPOKEN_FORMS: expression = pattern.sub(replacement, expression)
+    expression = CALCULATOR_WORD_OPERATOR_REGEX.sub(lambda m: CALCULATOR_WORD_OPERATORS[m.group(1)], expression)
+    return expression.replace("^", "**")
+
+def evaluate_calculator_expression(expression):
+    # Normalized expression -> number, formatted like the calculator always has
+    result = compile_calculator_expression(" ".join(expression.split()))() # Runs of spaces collapsed for the cache key only
+    if isinstance(result, float):
+        if not math.isfinite(result): raise OverflowError("The result is too large to represent.")
+        if result.is_integer(): result = int(result)
+        else: result = round(result, 6) # Limit precision for floats
+    return result
+
+# Unit conversions: alias -> (dimension, factor to the dimension's base unit). Temperatures use offsets instead.
+UNIT_DEFINITIONS = {
+    "length": {"m": 1, "meter": 1, "metre": 1, "km": 1000, "kilometer": 1000, "kilometre": 1000, "cm": 0.01, "centimeter": 0.01,
+               "mm": 0.001, "millimeter": 0.001, "mi": 1609.344, "mile": 1609.344, "yd": 0.9144, "yard": 0.9144,
+               "ft": 0.3048, "foot": 0.3048, "feet": 0.3048, "in": 0.0254, "inch": 0.0254, "inches": 0.0254, "nmi": 1852},
+    "mass": {"kg": 1, "kilogram": 1, "g": 0.001, "gram": 0.001, "mg": 1e-6, "milligram": 1e-6, "t": 1000, "tonne": 1000,
+             "lb": 0.45359237, "lbs": 0.45359237, "pound": 0.45359237, "oz": 0.028349523125, "ounce": 0.028349523125, "stone": 6.35029318},
+    "volume": {"l": 1, "liter": 1, "litre": 1, "ml": 0.001, "milliliter": 0.001, "millilitre": 0.001, "gallon": 3.785411784,
+               "gal": 3.785411784, "quart": 0.946352946, "pint": 0.473176473, "cup": 0.2365882365, "tbsp": 0.01478676478125,
+               "tablespoon": 0.01478676478125, "tsp": 0.00492892159375, "teaspoon": 0.00492892159375},
+    "time": {"s": 1, "sec": 1, "second": 1, "ms": 0.001, "millisecond": 0.001, "min": 60, "minute": 60, "h": 3600, "hr": 3600,
+             "hour": 3600, "day": 86400, "week": 604800, "year": 31557600},
+    "speed": {"m/s": 1, "km/h": 1 / 3.6, "kph": 1 / 3.6, "mph": 0.44704, "knot": 0.514444},
+    "data": {"b": 1, "byte": 1, "kb": 1024, "kilobyte": 1024, "mb": 1024**2, "megabyte": 1024**2, "gb": 1024**3, "gigabyte": 1024**3,
+             "tb": 1024**4, "terabyte": 1024**4},
+    "area": {"m2": 1, "sqm": 1, "km2": 1e6, "hectare": 1e4, "ha": 1e4, "acre": 4046.8564224, "sqft": 0.09290304, "ft2": 0.09290304},
+}
+UNIT_ALIASES = {alias: (dimension, factor) for dimension, units in UNIT_DEFINITIONS.items() for alias, factor in units.items()}
+TEMPERATURE_UNITS = {"c": "C", "celsius": "C", "°c": "C", "f": "F", "fahrenheit": "F", "°f": "F", "k": "K", "kelvin": "K"}
+UNIT_CONVERSION_REGEX = re.compile(r'^(?:convert\s+)?(.+?)\s*([a-z°/]+[a-z0-9]?)\s+(?:to|in|into|as)\s+([a-z°/]+[a-z0-9]?)$')
+
+def lookup_unit(word):
+    if word in TEMPERATURE_UNITS: return ("temperature", TEMPERATURE_UNITS[word])
+    if word in UNIT_ALIASES: return UNIT_ALIASES[word]
+    if word.endswith("s") and word[:-1] in UNIT_ALIASES: return UNIT_ALIASES[word[:-1]] # "miles", "hours"
+    return None
+
+def convert_units(amount, from_unit, to_unit):
+    if from_unit[0] == "temperature":
+        kelvin = {"C": lambda v: v + 273.15, "F": lambda v: (v - 32) * 5 / 9 + 273.15, "K": lambda v: v}[from_unit[1]](amount)
+        return {"C": kelvin - 273.15, "F": (kelvin - 273.15) * 9 / 5 + 32, "K": kelvin}[to_unit[1]]
+    return amount * from_unit[1] / to_unit[1]
+
+def parse_unit_conversion(expression):
+    # (amount expression, from word, to word, from unit, to unit) for "5 km to miles", else None
+    match = UNIT_CONVERSION_REGEX.match(expression)
+    if not match: return None
+    from_unit, to_unit = lookup_unit(match.group(2)), lookup_unit(match.group(3))
+    if not from_unit or not to_unit or from_unit[0] != to_unit[0]: return None
+    return match.group(1), match.group(2), match.group(3), from_unit, to_unit
 
+def calculate_action(expression_str):
+    expression = normalize_calculator_expression(expression_str)
     try:
-        # Parse the expression
-        node = ast.parse(expression, mode='eval')
-
-        # Validate all nodes in the AST
-        for sub_node in ast.walk(node):
-            if not isinstance(sub_node, allowed_node_types):
-                # If we encounter an ast.Name (variable) or ast.Call (function call) not explicitly handled, deny.
-                if isinstance(sub_node, ast.Name) or isinstance(sub_node, ast.Call):
-                     raise ValueError(f"Unsupported element in expression: {type(sub_node).__name__} ('{ast.dump(sub_node)}')")
-                # For other disallowed types
-                if type(sub_node) not in allowed_node_types:
-                    raise ValueError(f"Unsupported operation or character in expression: {type(sub_node).__name__}")
-
-
-        # Safely evaluate the parsed expression tree
-        # Using a simple recursive evaluator for basic ops
-        def _eval_ast(node):
-            if isinstance(node, ast.Constant): return node.value # Python 3.8+
-            if isinstance(node, ast.Num): return node.n # Older Python
-
-            if isinstance(node, ast.Expression): return _eval_ast(node.body)
-            if isinstance(node, ast.UnaryOp):
-                operand = _eval_ast(node.operand)
-                if isinstance(node.op, ast.UAdd): return +operand
-                if isinstance(node.op, ast.USub): return -operand
-            if isinstance(node, ast.BinOp):
-                left = _eval_ast(node.left)
-                right = _eval_ast(node.right)
-                if isinstance(node.op, ast.Add): return left + right
-                if isinstance(node.op, ast.Sub): return left - right
-                if isinstance(node.op, ast.Mult): return left * right
-                if isinstance(node.op, ast.Div):
-                    if right == 0: raise ZeroDivisionError("Division by zero is not permitted.")
-                    return left / right
-                if isinstance(node.op, ast.Pow): return left ** right
-                if isinstance(node.op, ast.Mod):
-                    if right == 0: raise ZeroDivisionError("Modulo by zero is not permitted.")
-                    return left % right
-            raise TypeError(f"Unsupported AST node type: {type(node)}")
-
-        result = _eval_ast(node)
-        # Format result nicely
-        if isinstance(result, float) and result.is_integer(): result = int(result)
-        if isinstance(result, float): result = round(result, 6) # Limit precision for floats
-
+        conversion = parse_unit_conversion(expression)
+        if conversion:
+            amount_expression, from_word, to_word, from_unit, to_unit = conversion
+            amount = evaluate_calculator_expression(amount_expression)
+            result = convert_units(amount, from_unit, to_unit)
+            result = int(result) if float(result).is_integer() else round(result, 6)
+            return True, f"{amount} {from_word} is {result} {to_word}."
+        result = evaluate_calculator_expression(expression)
         return True, f"The result of '{expression_str}' is {result}."
     except ZeroDivisionError as zde:
         return False, str(zde)
-    except (SyntaxError, TypeError, ValueError) as e:
+    except OverflowError as e_size:
+        return False, f"'{expression_str}' is too large for me to compute. ({e_size})"
+    except (SyntaxError, TypeError, ValueError, RecursionError, MemoryError) as e:
         # print(f"WARN: Calculator error for '{expression}': {e}")
         return False, f"I'm sorry, I couldn't quite understand or compute '{expression_str}'. Please try a simpler arithmetic expression. (Details: {e})"
     except Exception as e_calc: # Catch-all for other unexpected issues
@@ -837,7 +2333,7 @@ def generate_random_number_action(min_val_str, max_val_str):
         return False, "Please provide two valid whole numbers for the range, for example, '1 and 100'."
 
 def get_system_uptime_action():
-    if not psutil_available: return False, "Uptime information is unavailable; 'psutil' library missing."
+    if not backend_available("psutil"): return False, "Uptime information is unavailable; 'psutil' library missing."
     try:
         boot_time_timestamp = psutil.boot_time()
         boot_time_datetime = datetime.datetime.fromtimestamp(boot_time_timestamp)
@@ -865,7 +2361,7 @@ def empty_recycle_bin_action(confirmation_expected=False):
 
     os_type = platform.system()
     if os_type == "Windows":
-        if not winshell_available: return False, "Cannot empty recycle bin on Windows; 'winshell' library missing."
+        if not backend_available("winshell"): return False, "Cannot empty recycle bin on Windows; 'winshell' library missing."
         try:
             winshell.recycle_bin().empty(confirm=False, show_progress=False, sound=False)
             return True, "The Windows Recycle Bin has been emptied."
@@ -910,33 +2406,23 @@ def lock_screen_action():
     cmd = None
     try:
         if os_type == "Windows":
-            subprocess.run(["rundll32.exe", "user32.dll,LockWorkStation"], check=True)
+            run_process(["rundll32.exe", "user32.dll,LockWorkStation"], check=True)
             return True, "Screen lock initiated on Windows."
         elif os_type == "Darwin": # macOS
             # This is generally reliable
-            subprocess.run(["/System/Library/CoreServices/Menu Extras/User.menu/Contents/Resources/CGSession", "-suspend"], check=True)
+            run_process(["/System/Library/CoreServices/Menu Extras/User.menu/Contents/Resources/CGSession", "-suspend"], check=True)
             return True, "Screen lock initiated on macOS."
         elif os_type == "Linux":
-            # Try a few common screen lockers
-            lock_commands = [
-                "xdg-screensaver lock",
-                "gnome-screensaver-command -l", # GNOME
-                "mate-screensaver-command -l",  # MATE
-                "cinnamon-screensaver-command -l", # Cinnamon
-                "qdbus org.freedesktop.ScreenSaver /ScreenSaver Lock", # KDE Plasma via D-Bus
-                "i3lock", # Common for i3 and other WMs
-                "dm-tool lock" # LightDM based systems
-            ]
-            for locker_cmd_str in lock_commands:
-                cmd_parts = locker_cmd_str.split()
+            # Lockers installed here, best first (probed at startup); normally the first one works
+            for candidate in capability_registry.backends("screen_lock"):
+                cmd_parts = capability_command(candidate)
                 try:
-                    # Use Popen to avoid blocking if the command itself daemonizes or waits
-                    subprocess.Popen(cmd_parts, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                    time.sleep(0.5) # Give it a moment to take effect
-                    # It's hard to verify success directly for all, assume it worked if no error
-                    return True, f"Screen lock attempted using '{cmd_parts[0]}' on Linux."
-                except (FileNotFoundError, subprocess.CalledProcessError):
-                    continue # Try next command
+                    # Lockers either exit at once or keep running; one that fails within the settle time is skipped
+                    exit_code = async_core.run(launch_and_settle_async(cmd_parts, LOCK_SCREEN_SETTLE_SECONDS))
+                    if exit_code in (None, 0): return True, f"Screen lock attempted using '{cmd_parts[0]}' on Linux."
+                except OSError:
+                    pass
+                capability_registry.report_failure("screen_lock", candidate["name"])
             return False, "Could not find a common screen locker for this Linux distribution. You might need to configure one."
         else:
             return False, f"Screen locking is not supported on this operating system ({os_type})."
@@ -968,14 +2454,12 @@ def system_power_action(action_type, confirmation_expected=False):
         if action_type == "shutdown": cmd = ["systemctl", "poweroff"] # Modern systemd
         elif action_type == "restart": cmd = ["systemctl", "reboot"]  # Modern systemd
         elif action_type == "logout":
-            # Logout is very Desktop Environment specific on Linux
-            desktop_env = os.environ.get("XDG_CURRENT_DESKTOP", "").lower()
-            if "gnome" in desktop_env: cmd = ["gnome-session-quit", "--logout", "--no-prompt"]
-            elif "kde" in desktop_env or "plasma" in desktop_env: cmd = ["qdbus", "org.kde.ksmserver", "/KSMServer", "logout", "0", "0", "0"]
-            elif "mate" in desktop_env: cmd = ["mate-session-save", "--logout-dialog"] # Might show dialog
-            elif "xfce" in desktop_env: cmd = ["xfce4-session-logout", "--logout"]
-            elif "cinnamon" in desktop_env: cmd = ["cinnamon-session-quit", "--logout", "--no-prompt"]
-            else: return False, f"Automated logout for Linux desktop '{desktop_env if desktop_env else 'unknown'}' is not specifically supported. You might need to do this manually."
+            # Logout is very Desktop Environment specific on Linux; the registry has matched it to this desktop
+            backends = capability_registry.backends("logout")
+            if backends: cmd = capability_command(backends[0])
+            else:
+                desktop_env = os.environ.get("XDG_CURRENT_DESKTOP", "").lower()
+                return False, f"Automated logout for Linux desktop '{desktop_env if desktop_env else 'unknown'}' is not specifically supported. You might need to do this manually."
         else: return False, f"Unknown power action '{action_type}' for Linux."
     else:
         return False, f"System power actions are not supported on this operating system ({os_type})."
@@ -997,39 +2481,1058 @@ def system_power_action(action_type, confirmation_expected=False):
         return False, f"An error occurred while trying to {action_type} the system: {e}. This action might require elevated privileges."
 
 
+# --- Persistent Store (SQLite) ---
+class JarvisStore:
+    # Notes, timers and conversation history in one SQLite database (WAL journal, so a crash or
+    # os._exit() never corrupts it). Writes are queued and committed in batches by a background
+    # thread; every read first commits whatever is still queued, so callers always see their own writes.
+    def __init__(self, db_path, flush_interval=PERSIST_FLUSH_INTERVAL_SECONDS):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.conn = None # Opened lazily, so importing jarvis.py never touches the disk
+        self.lock = threading.Lock() # Guards conn and pending
+        self.pending = [] # (sql, params) not yet committed
+        self.wake_event = threading.Event()
+        self.writer_thread = None
+        self.closed = False
+        self.notes_fts_available = False # Set on open: SQLite built with FTS5
+
+    @staticmethod
+    def connect(db_path):
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL") # WAL keeps the file consistent; at worst the last batch is lost
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS notes (id INTEGER PRIMARY KEY, content TEXT NOT NULL, created_at REAL NOT NULL, tags TEXT NOT NULL DEFAULT '');
+            CREATE TABLE IF NOT EXISTS timers (id INTEGER PRIMARY KEY, end_time REAL NOT NULL, duration TEXT NOT NULL, description TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY, role TEXT NOT NULL, text TEXT NOT NULL, created_at REAL NOT NULL);
+        """)
+        if "tags" not in [row[1] for row in conn.execute("PRAGMA table_info(notes)")]: # Database from before tagging
+            conn.execute("ALTER TABLE notes ADD COLUMN tags TEXT NOT NULL DEFAULT ''")
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def setup_notes_search(conn):
+        # FTS5 index over the notes table, kept in sync by triggers. Returns False if this SQLite
+        # build has no FTS5; searches then fall back to (slower) LIKE scans.
+        try:
+            index_exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'notes_fts'").fetchone()
+            conn.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(content, tags, content='notes', content_rowid='id');
+                CREATE TRIGGER IF NOT EXISTS notes_fts_insert AFTER INSERT ON notes BEGIN
+                    INSERT INTO notes_fts (rowid, content, tags) VALUES (new.id, new.content, new.tags);
+                END;
+                CREATE TRIGGER IF NOT EXISTS notes_fts_delete AFTER DELETE ON notes BEGIN
+                    INSERT INTO notes_fts (notes_fts, rowid, content, tags) VALUES ('delete', old.id, old.content, old.tags);
+                END;
+            """)
+            if not index_exists: conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')") # Index notes saved before FTS
+            conn.commit()
+            return True
+        except sqlite3.OperationalError as e_fts:
+            print(f"WARN: SQLite full-text search (FTS5) unavailable, note searches will be slower: {e_fts}")
+            return False
+
+    def open_if_needed(self): # Called with self.lock held
+        if self.conn is not None: return
+        try:
+            self.conn = self.connect(self.db_path)
+        except sqlite3.Error as e_open:
+            print(f"ERROR: Could not open '{self.db_path}' ({e_open}). Notes, timers and history will not be saved this session.")
+            self.db_path = ":memory:"
+            self.conn = self.connect(self.db_path)
+        self.notes_fts_available = self.setup_notes_search(self.conn)
+
+    def commit_pending(self): # Called with self.lock held
+        if not self.pending: return
+        self.open_if_needed()
+        batch, self.pending = self.pending, []
+        try:
+            with self.conn: # One transaction per batch
+                for sql, params in batch: self.conn.execute(sql, params)
+                if any(sql.startswith("INSERT INTO history") for sql, _ in batch): self.prune_history()
+        except sqlite3.Error as e_write:
+            print(f"ERROR: Could not save {len(batch)} change(s) to '{self.db_path}': {e_write}")
+
+    def writer_loop(self):
+        while not self.closed:
+            self.wake_event.wait()
+            time.sleep(self.flush_interval) # Let more writes join the batch
+            self.wake_event.clear()
+            with self.lock:
+                if not self.closed: self.commit_pending()
+
+    def queue_write(self, sql, params=()):
+        with self.lock:
+            if self.closed: return
+            self.pending.append((sql, params))
+            if self.writer_thread is None:
+                self.writer_thread = threading.Thread(target=self.writer_loop, daemon=True)
+                self.writer_thread.start()
+        self.wake_event.set()
+
+    def query(self, sql, params=()):
+        with self.lock:
+            self.open_if_needed()
+            self.commit_pending()
+            return self.conn.execute(sql, params).fetchall()
+
+    def flush(self):
+        with self.lock: self.commit_pending()
+
+    def close(self):
+        with self.lock:
+            if self.closed: return
+            self.commit_pending()
+            self.closed = True
+            if self.conn is not None: self.conn.close(); self.conn = None
+        self.wake_event.set()
+
+    # Notes
+    def add_note(self, content):
+        tags = " ".join(dict.fromkeys(tag.lower() for tag in re.findall(r"#(\w+)", content))) # "#work #idea" in the text
+        self.queue_write("INSERT INTO notes (content, created_at, tags) VALUES (?, ?, ?)", (content, time.time(), tags))
+
+    def list_notes(self, limit=-1, offset=0):
+        return [row[0] for row in self.query("SELECT content FROM notes ORDER BY id LIMIT ? OFFSET ?", (limit, offset))]
+
+    def recent_notes(self, count):
+        return [row[0] for row in reversed(self.query("SELECT content FROM notes ORDER BY id DESC LIMIT ?", (count,)))]
+
+    def search_notes(self, query_text, tag=None, limit=-1, offset=0):
+        # Notes containing every word of query_text (prefix match) and/or carrying `tag`, newest first.
+        # (Newest-first lets FTS5 stop after one page; ranking by bm25 would score every match.)
+        # Returns (total_matches, contents).
+        words = re.findall(r"\w+", (query_text or "").lower())
+        tag = tag.lower().lstrip("#") if tag else None
+        if not words and not tag: return 0, []
+        with self.lock: self.open_if_needed()
+        if self.notes_fts_available:
+            terms = [f'content : "{word}"*' for word in words] + ([f'tags : "{tag}"'] if tag else [])
+            fts_query = " AND ".join(terms)
+            total = self.query("SELECT COUNT(*) FROM notes_fts WHERE notes_fts MATCH ?", (fts_query,))[0][0]
+            rows = self.query("SELECT notes.content FROM notes_fts JOIN notes ON notes.id = notes_fts.rowid "
+                              "WHERE notes_fts MATCH ? ORDER BY notes_fts.rowid DESC LIMIT ? OFFSET ?", (fts_query, limit, offset))
+        else:
+            conditions = ["content LIKE ?"] * len(words) + (["(' ' || tags || ' ') LIKE ?"] if tag else [])
+            params = [f"%{word}%" for word in words] + ([f"% {tag} %"] if tag else [])
+            where_sql = " AND ".join(conditions)
+            total = self.query(f"SELECT COUNT(*) FROM notes WHERE {where_sql}", params)[0][0]
+            rows = self.query(f"SELECT content FROM notes WHERE {where_sql} ORDER BY id DESC LIMIT ? OFFSET ?", params + [limit, offset])
+        return total, [row[0] for row in rows]
+
+    def count_notes(self):
+        return self.query("SELECT COUNT(*) FROM notes")[0][0]
+
+    def clear_notes(self):
+        with self.lock:
+            self.open_if_needed()
+            self.commit_pending()
+            with self.conn: return self.conn.execute("DELETE FROM notes").rowcount
+
+    # Timers
+    def save_timer(self, entry):
+        end_time, duration, description, timer_id = entry
+        self.queue_write("INSERT OR REPLACE INTO timers (id, end_time, duration, description) VALUES (?, ?, ?, ?)",
+                         (timer_id, end_time, duration, description))
+
+    def delete_timers(self, timer_ids):
+        for timer_id in timer_ids: self.queue_write("DELETE FROM timers WHERE id = ?", (timer_id,))
+
+    def delete_all_timers(self):
+        self.queue_write("DELETE FROM timers")
+
+    def load_timers(self):
+        return self.query("SELECT end_time, duration, description, id FROM timers ORDER BY end_time")
+
+    # Conversation history
+    def prune_history(self): # Called inside commit_pending's transaction; both deletes walk the id primary key
+        self.conn.execute("DELETE FROM history WHERE id <= (SELECT id FROM history ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                          (PERSISTED_HISTORY_MAX_MESSAGES,))
+        self.conn.execute("DELETE FROM history WHERE id <= (SELECT MAX(id) FROM history WHERE created_at < ?)",
+                          (time.time() - PERSISTED_HISTORY_MAX_DAYS * 86400,)) # created_at grows with id
+
+    def append_history(self, role, text):
+        self.queue_write("INSERT INTO history (role, text, created_at) VALUES (?, ?, ?)", (role, text, time.time()))
+
+    def load_recent_history(self, message_count):
+        rows = self.query("SELECT role, text FROM history ORDER BY id DESC LIMIT ?", (message_count,))
+        return [{"role": role, "text": text} for role, text in reversed(rows)]
+
+jarvis_store = JarvisStore(JARVIS_DB_PATH if PERSISTENCE_ENABLED and not BENCHMARK_MODE else ":memory:")
+atexit.register(jarvis_store.close)
+
+def restore_persisted_state():
+    # Reload timers and recent history from the previous session. Timers keep their original
+    # wall-clock deadline, so ones that ran out while Jarvis was closed fire as soon as the timer thread starts.
+    try:
+        timers = jarvis_store.load_timers()
+        history = jarvis_store.load_recent_history(RESTORED_HISTORY_MESSAGES)
+        note_count = jarvis_store.count_notes()
+    except sqlite3.Error as e_restore:
+        print(f"ERROR: Could not restore saved state from '{jarvis_store.db_path}': {e_restore}")
+        return
+    for entry in timers: timer_scheduler.restore(entry)
+    for item in history: add_to_conversation_history(item["role"], item["text"], persist=False)
+    if timers or history or note_count:
+        print(f"INFO: Restored {len(timers)} timer(s), {note_count} note(s) and {len(history)} history message(s).")
+
+# --- File Index (SQLite) ---
+class FileIndex:
+    # Files under FILE_INDEX_ROOTS in their own SQLite database (WAL, read through mmap), crawled by a
+    # background thread every `rescan_interval` seconds. A rescan re-reads only directories whose mtime
+    # changed since they were indexed (adding, removing or renaming an entry changes it); a full re-read
+    # every FILE_INDEX_FULL_RESCAN_SECONDS also picks up files modified in place. File names are indexed
+    # with the FTS5 trigram tokenizer, so any 3+ character fragment of a name is an index lookup.
+    def __init__(self, db_path, roots, rescan_interval=FILE_INDEX_RESCAN_SECONDS):
+        self.db_path, self.roots, self.rescan_interval = db_path, list(roots), rescan_interval
+        self.conn = None # Opened lazily; shared by the crawler and queries under self.lock
+        self.lock = threading.Lock()
+        self.trigram_available = False # Set on open: SQLite 3.34+ with FTS5
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.first_scan_event = threading.Event()
+        self.last_full_scan = 0.0
+        self.last_scan = {} # Summary of the most recent crawl: seconds, dirs_read, dirs_skipped, files
+
+    @staticmethod
+    def connect(db_path):
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={FILE_INDEX_MMAP_BYTES}")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, dir TEXT NOT NULL, name TEXT NOT NULL, ext TEXT NOT NULL,
+                                              size INTEGER NOT NULL, mtime REAL NOT NULL);
+            CREATE UNIQUE INDEX IF NOT EXISTS files_dir_name ON files (dir, name);
+            CREATE INDEX IF NOT EXISTS files_ext_mtime ON files (ext, mtime);
+            CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime);
+            CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+        """)
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def setup_name_search(conn):
+        # Trigram FTS5 index over file names, kept in sync by triggers. Returns False without trigram
+        # support; name searches then fall back to LIKE scans.
+        try:
+            conn.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(name, content='files', content_rowid='id', tokenize='trigram');
+                CREATE TRIGGER IF NOT EXISTS files_fts_insert AFTER INSERT ON files BEGIN
+                    INSERT INTO files_fts (rowid, name) VALUES (new.id, new.name);
+                END;
+                CREATE TRIGGER IF NOT EXISTS files_fts_delete AFTER DELETE ON files BEGIN
+                    INSERT INTO files_fts (files_fts, rowid, name) VALUES ('delete', old.id, old.name);
+                END;
+            """)
+            conn.commit()
+            return True
+        except sqlite3.OperationalError as e_fts:
+            print(f"WARN: SQLite trigram search unavailable, file searches will be slower: {e_fts}")
+            return False
+
+    def open_if_needed(self): # Called with self.lock held
+        if self.conn is not None: return
+        try:
+            self.conn = self.connect(self.db_path)
+        except sqlite3.Error as e_open:
+            print(f"ERROR: Could not open '{self.db_path}' ({e_open}). The file index will not be kept this session.")
+            self.db_path = ":memory:"
+            self.conn = self.connect(self.db_path)
+        self.trigram_available = self.setup_name_search(self.conn)
+
+    def query(self, sql, params=()):
+        with self.lock:
+            self.open_if_needed()
+            return self.conn.execute(sql, params).fetchall()
+
+    def close(self):
+        self.stop_event.set()
+        with self.lock:
+            if self.conn is not None: self.conn.close(); self.conn = None
+
+    # Crawling
+    def start(self):
+        with self.lock:
+            if self.thread is None and not self.stop_event.is_set():
+                self.thread = threading.Thread(target=self.crawl_loop, daemon=True)
+                self.thread.start()
+
+    def crawl_loop(self):
+        while not self.stop_event.is_set():
+            try: self.scan(full=time.time() - self.last_full_scan >= FILE_INDEX_FULL_RESCAN_SECONDS)
+            except Exception as e: print(f"WARN: File index crawl failed: {e}")
+            self.first_scan_event.set()
+            if self.stop_event.wait(self.rescan_interval): break
+
+    def scan(self, full=False):
+        started = time.perf_counter()
+        dirs_read = dirs_skipped = 0
+        for root in self.roots:
+            root = os.path.abspath(os.path.expanduser(root))
+            stack = [(root, None)]
+            while stack and not self.stop_event.is_set():
+                directory, parent = stack.pop()
+                try: directory_mtime = os.stat(directory).st_mtime
+                except OSError:
+                    with self.lock:
+                        self.open_if_needed()
+                        with self.conn: self.forget_tree(directory)
+                    continue
+                known = self.query("SELECT mtime FROM dirs WHERE path = ?", (directory,))
+                if not full and known and known[0][0] == directory_mtime: # Unchanged listing: only descend
+                    stack.extend((row[0], directory) for row in self.query("SELECT path FROM dirs WHERE parent = ?", (directory,)))
+                    dirs_skipped += 1
+                    continue
+                files, subdirs = self.read_directory(directory)
+                self.store_directory(directory, parent, directory_mtime, files, subdirs)
+                stack.extend((subdir, directory) for subdir in subdirs)
+                dirs_read += 1
+        if full: self.last_full_scan = time.time()
+        self.last_scan = {"seconds": time.perf_counter() - started, "dirs_read": dirs_read, "dirs_skipped": dirs_skipped,
+                          "files": self.query("SELECT COUNT(*) FROM files")[0][0]}
+        return self.last_scan
+
+    @staticmethod
+    def read_directory(directory):
+        # ({name: (ext, size, mtime)}, [subdirectory paths]); hidden entries and FILE_INDEX_SKIP_DIRS are left out
+        files, subdirs = {}, []
+        try:
+            with os.scandir(directory) as iterator:
+                for entry in iterator:
+                    if entry.name.startswith("."): continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in FILE_INDEX_SKIP_DIRS: subdirs.append(entry.path)
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            files[entry.name] = (os.path.splitext(entry.name)[1].lower().lstrip("."), stat.st_size, stat.st_mtime)
+                    except OSError: continue # Vanished or unreadable entry
+        except OSError: pass # Unreadable directory: indexed as empty
+        return files, subdirs
+
+    def store_directory(self, directory, parent, directory_mtime, files, subdirs):
+        # Brings one directory's rows in line with `files`/`subdirs` in a single transaction
+        with self.lock:
+            self.open_if_needed()
+            with self.conn:
+                known = {name: (row_id, size, mtime) for row_id, name, size, mtime in
+                         self.conn.execute("SELECT id, name, size, mtime FROM files WHERE dir = ?", (directory,))}
+                removed = [(known[name][0],) for name in known.keys() - files.keys()]
+                if removed: self.conn.executemany("DELETE FROM files WHERE id = ?", removed)
+                self.conn.executemany("INSERT INTO files (dir, name, ext, size, mtime) VALUES (?, ?, ?, ?, ?)",
+                                      [(directory, name, *files[name]) for name in files.keys() - known.keys()])
+                self.conn.executemany("UPDATE files SET size = ?, mtime = ? WHERE id = ?",
+                                      [(files[name][1], files[name][2], row[0]) for name, row in known.items()
+                                       if name in files and (row[1], row[2]) != files[name][1:]])
+                subdir_set = set(subdirs)
+                for (known_subdir,) in self.conn.execute("SELECT path FROM dirs WHERE parent = ?", (directory,)).fetchall():
+                    if known_subdir not in subdir_set: self.forget_tree(known_subdir)
+                self.conn.execute("INSERT OR REPLACE INTO dirs (path, parent, mtime) VALUES (?, ?, ?)", (directory, parent, directory_mtime))
+
+    def forget_tree(self, directory): # Called with self.lock held, inside the caller's `with self.conn:` transaction
+        lower, upper = directory + os.sep, directory + chr(ord(os.sep) + 1) # Every path below `directory` sorts in [lower, upper)
+        self.conn.execute("DELETE FROM files WHERE dir = ? OR (dir >= ? AND dir < ?)", (directory, lower, upper))
+        self.conn.execute("DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)", (directory, lower, upper))
+
+    # Queries
+    def search(self, query_text="", extensions=None, under=None, newest=False, limit=10):
+        # Files whose name contains every word of query_text, optionally limited to `extensions` and to the
+        # tree under `under`. Ranked by how well the name matches (whole words, then prefixes), newest first
+        # on ties, or purely newest first with newest=True. Returns (path, size, mtime) tuples.
+        words = re.findall(r"\w+", (query_text or "").lower())
+        conditions, params = [], []
+        if extensions:
+            conditions.append(f"files.ext IN ({', '.join('?' * len(extensions))})"); params += list(extensions)
+        if under:
+            under = os.path.abspath(os.path.expanduser(under))
+            conditions.append("(files.dir = ? OR (files.dir >= ? AND files.dir < ?))")
+            params += [under, under + os.sep, under + chr(ord(os.sep) + 1)]
+        with self.lock: self.open_if_needed()
+        trigram_words = [word for word in words if len(word) >= 3] if self.trigram_available else []
+        conditions += ["files.name LIKE ?"] * (len(words) - len(trigram_words))
+        params += [f"%{word}%" for word in words if word not in trigram_words]
+        where_sql = " AND ".join(conditions) or "1"
+        if trigram_words: # Newest-indexed matches first, so FTS5 stops after FILE_INDEX_CANDIDATES
+            fts_query = " AND ".join(f'"{word}"' for word in trigram_words)
+            rows = self.query(f"SELECT files.dir, files.name, files.size, files.mtime FROM files_fts JOIN files ON files.id = files_fts.rowid "
+                              f"WHERE files_fts MATCH ? AND {where_sql} ORDER BY files_fts.rowid DESC LIMIT ?",
+                              [fts_query] + params + [FILE_INDEX_CANDIDATES])
+        else:
+            rows = self.query(f"SELECT dir, name, size, mtime FROM files WHERE {where_sql.replace('files.', '')} ORDER BY mtime DESC LIMIT ?",
+                              params + [FILE_INDEX_CANDIDATES])
+        def match_score(name):
+            stem, name_words = os.path.splitext(name)[0].lower(), set(re.findall(r"[a-z]+|\d+", name.lower()))
+            score = 3.0 if stem == " ".join(words) or stem == "_".join(words) else 0.0
+            for word in words:
+                score += 2.0 if word in name_words else 1.0 if any(w.startswith(word) for w in name_words) else 0.5
+            return score
+        if newest: rows.sort(key=lambda row: row[3], reverse=True)
+        else: rows.sort(key=lambda row: (match_score(row[1]), row[3]), reverse=True)
+        return [(os.path.join(directory, name), size, mtime) for directory, name, size, mtime in rows[:limit]]
+
+    def file_count(self):
+        return self.query("SELECT COUNT(*) FROM files")[0][0]
+
+file_index = FileIndex(FILE_INDEX_DB_PATH if not BENCHMARK_MODE else ":memory:", FILE_INDEX_ROOTS)
+atexit.register(file_index.close)
+
+# Words that stand for a set of extensions in "open the latest pdf" / "find photos"
+FILE_KIND_EXTENSIONS = {
+    "pdf": ("pdf",), "document": ("pdf", "doc", "docx", "odt", "rtf", "txt", "md"), "doc": ("doc", "docx"),
+    "spreadsheet": ("xls", "xlsx", "ods", "csv"), "presentation": ("ppt", "pptx", "odp", "key"),
+    "image": ("jpg", "jpeg", "png", "gif", "heic", "webp", "bmp"), "photo": ("jpg", "jpeg", "png", "heic"),
+    "picture": ("jpg", "jpeg", "png", "gif", "heic", "webp"), "screenshot": ("png", "jpg"),
+    "video": ("mp4", "mov", "mkv", "avi", "webm"), "song": ("mp3", "m4a", "flac", "wav", "ogg"),
+    "music": ("mp3", "m4a", "flac", "wav", "ogg"), "archive": ("zip", "rar", "7z", "tar", "gz"),
+}
+
+def file_index_location(location):
+    # "downloads" -> the FILE_INDEX_ROOTS entry with that name; anything else is treated as a path
+    if not location: return None
+    location = location.strip().strip("'\"")
+    for root in file_index.roots:
+        if os.path.basename(os.path.normpath(root)).lower() == location.lower(): return root
+    return location
+
+def file_index_status_note():
+    if not FILE_INDEX_ENABLED: return ""
+    file_index.start()
+    if not file_index.first_scan_event.wait(timeout=FILE_INDEX_FIRST_SCAN_WAIT_SECONDS):
+        return f" (I'm still indexing your files; {file_index.file_count()} so far.)"
+    return ""
+
+def find_file_action(query_text, location=None):
+    if not FILE_INDEX_ENABLED: return False, "The file index is disabled."
+    try:
+        note = file_index_status_note()
+        matches = file_index.search(query_text, under=file_index_location(location))
+        if not matches: return False, f"No indexed file matches '{query_text}'.{note}"
+        lines = [f"  {path} ({format_file_size(size)}, modified {datetime.datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M')})"
+                 for path, size, mtime in matches]
+        return True, f"Files matching '{query_text}':\n" + "\n".join(lines) + note
+    except Exception as e: return False, f"Trouble searching the file index: {e}"
+
+def open_latest_file_action(kind, location=None):
+    # Opens the newest file of a kind ("pdf", "photo", "file", ...) under location (a root name or a path)
+    if not FILE_INDEX_ENABLED: return False, "The file index is disabled."
+    try:
+        kind = kind.lower()
+        if kind not in FILE_KIND_EXTENSIONS and kind.endswith("s"): kind = kind[:-1] # "pdfs", "photos", "files"
+        extensions = None if kind in ("file", "download", "") else FILE_KIND_EXTENSIONS.get(kind, (kind,))
+        note = file_index_status_note()
+        matches = file_index.search(extensions=extensions, under=file_index_location(location), newest=True, limit=1)
+        if not matches: return False, f"I couldn't find any {kind} files{' in ' + location if location else ''}.{note}"
+        return open_file_with_default_app_action(matches[0][0])
+    except Exception as e: return False, f"Trouble searching the file index: {e}"
+
 # --- Timer Management Thread ---
-def timer_checker_thread_func(stop_event, new_timer_notification_callback):
-    global active_timers, chat_history_lock
-    print("INFO: Jarvis Timer Checker thread started.")
+class TimerScheduler:
+    # Min-heap of (end_time, id) plus an id -> entry index. Cancelling only drops the index entry;
+    # stale heap items are skipped when they reach the top (and compacted if they pile up).
+    # The checker task on the async core sleeps until the earliest deadline, and is woken early
+    # (thread-safely, through the loop) whenever a new earliest timer is added or it is asked to stop.
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.heap = []
+        self.wakeup = None # asyncio.Event owned by the running checker task
+        self.wakeup_loop = None
+        self.entries = {} # id -> (end_time, original_duration_str, description, id)
+        self.next_id = 0
+
+    def add(self, end_time, original_duration, description):
+        with self.condition:
+            self.next_id += 1
+            timer_id = self.next_id
+            self.entries[timer_id] = (end_time, original_duration, description, timer_id)
+            heapq.heappush(self.heap, (end_time, timer_id))
+            if self.heap[0][1] == timer_id: self.notify_checker() # New earliest deadline
+            return timer_id
+
+    def remove_ids(self, timer_ids): # Called with self.condition held
+        removed = [self.entries.pop(timer_id) for timer_id in timer_ids if timer_id in self.entries]
+        if len(self.heap) > 2 * len(self.entries) + 64: # Mostly cancelled items: rebuild
+            self.heap = [(entry[0], entry[3]) for entry in self.entries.values()]
+            heapq.heapify(self.heap)
+        return sorted(removed)
+
+    def restore(self, entry): # Re-add a timer under its original id (loaded from jarvis_store)
+        with self.condition:
+            end_time, _, _, timer_id = entry
+            self.entries[timer_id] = tuple(entry)
+            heapq.heappush(self.heap, (end_time, timer_id))
+            self.next_id = max(self.next_id, timer_id)
+            self.notify_checker()
+
+    def cancel_by_id(self, timer_id):
+        with self.condition: return self.remove_ids([timer_id])
+
+    def cancel_latest(self):
+        with self.condition: return self.remove_ids([max(self.entries)] if self.entries else [])
+
+    def cancel_matching(self, keyword):
+        with self.condition:
+            return self.remove_ids([timer_id for timer_id, entry in self.entries.items() if keyword in entry[2].lower()])
+
+    def cancel_all(self):
+        with self.condition:
+            removed = list(self.entries.values())
+            self.entries.clear(); self.heap.clear()
+            return removed
+
+    def count(self):
+        with self.condition: return len(self.entries)
+
+    def snapshot(self): # Active timers sorted by end_time
+        with self.condition: return sorted(self.entries.values())
+
+    def pop_due(self, now): # Called with self.condition held
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            _, timer_id = heapq.heappop(self.heap)
+            entry = self.entries.pop(timer_id, None)
+            if entry: due.append(entry) # else: cancelled earlier
+        return due
+
+    async def wait_for_due(self, stop_event):
+        # Waits until at least one timer is due (returned, soonest first) or stop_event is set ([]).
+        with self.condition:
+            self.wakeup_loop, self.wakeup = asyncio.get_running_loop(), asyncio.Event()
+        while not stop_event.is_set():
+            with self.condition: # Clearing under the lock: an add() after this wakes the wait below
+                self.wakeup.clear()
+                now = time.time()
+                due = self.pop_due(now)
+                if due: return due
+                while self.heap and self.heap[0][1] not in self.entries: heapq.heappop(self.heap) # Drop cancelled tops
+                # Deadlines are wall-clock (they survive restarts), so cap the sleep in case the clock is adjusted
+                timeout = min(self.heap[0][0] - now, TIMER_MAX_WAIT_SECONDS) if self.heap else TIMER_MAX_WAIT_SECONDS
+            try: await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError: pass
+        return []
+
+    def notify_checker(self): # Called with self.condition held, from any thread
+        if self.wakeup_loop is not None and not self.wakeup_loop.is_closed():
+            self.wakeup_loop.call_soon_threadsafe(self.wakeup.set)
+
+    def wake(self):
+        with self.condition: self.notify_checker()
+
+timer_scheduler = TimerScheduler()
+
+def stop_timer_thread():
+    timer_thread_stop_event.set()
+    timer_scheduler.wake()
+
+async def run_timer_checker(stop_event, new_timer_notification_callback):
+    # Runs on the async core (async_core.submit); the timers cost no thread of their own
+    print("INFO: Jarvis Timer Checker started.")
     while not stop_event.is_set():
-        now = time.time()
-        timers_to_remove = []
-        notifications_to_send = []
-
-        with chat_history_lock: # Access active_timers safely
-            if active_timers:
-                for i, timer_entry in enumerate(list(active_timers)): # Iterate copy
-                    end_time, original_duration, description, timer_id = timer_entry
-                    if now >= end_time:
-                        notification = f"{JARVIS_INTERNAL_TIMER_PREFIX} Your {original_duration} timer for '{description}' (ID: {timer_id}) has concluded!"
-                        notifications_to_send.append(notification)
-                        timers_to_remove.append(timer_entry)
-                    else:
-                        break # List is sorted by end_time
-
-            for t in timers_to_remove:
-                if t in active_timers:
-                    active_timers.remove(t)
-        
-        for notification in notifications_to_send: # Send notifications outside the lock
-            new_timer_notification_callback(notification)
-            
-        time.sleep(1) # Check every second
-    print("INFO: Jarvis Timer Checker thread stopped.")
+        due_timers = await timer_scheduler.wait_for_due(stop_event)
+        jarvis_store.delete_timers([timer[3] for timer in due_timers])
+        for end_time, original_duration, description, timer_id in due_timers:
+            # Send notifications outside the scheduler lock
+            notification = f"{JARVIS_INTERNAL_TIMER_PREFIX} Your {original_duration} timer for '{description}' (ID: {timer_id}) has concluded!"
+            await asyncio.to_thread(new_timer_notification_callback, notification) # It records history, which may count tokens over the API
+    print("INFO: Jarvis Timer Checker stopped.")
+
+# --- LLM Reply Generation (shared by CLI and GUI) ---
+def estimate_tokens(text):
+    # Local estimate (~4 characters per token for English), free and good enough for budgeting
+    return (len(text) + 3) // 4
+
+def count_text_tokens(text):
+    if USE_MODEL_TOKEN_COUNTER and GEMINI_API_KEY != "YOUR_GEMINI_API_KEY":
+        try:
+            return get_model().count_tokens(text).total_tokens
+        except Exception as e_count:
+            print(f"WARN: model.count_tokens failed, using local estimate: {e_count}")
+    return estimate_tokens(text)
+
+def clip_to_token_budget(text, max_tokens):
+    if estimate_tokens(text) <= max_tokens: return text
+    return text[:max_tokens * 4].rstrip() + " ...[truncated]"
+
+class PromptBuilder:
+    # Keeps the LLM-facing history pre-rendered ("You: ...", "Jarvis: ...", raw system lines) in a
+    # ring that mirrors conversation_history, so a turn costs one render per new message instead of
+    # re-rendering the whole history. The persona template is split once around its placeholders.
+    # The ring is bounded by a token budget as well as an item count: each line is counted once when
+    # appended, over-long messages are clipped, and lines pushed out of the window are folded into a
+    # running summary line rather than dropped.
+    # Callers hold chat_history_lock around append() and build() (see add_to_conversation_history).
+    HISTORY_MARKER = "\x00history\x00"
+    USER_INPUT_MARKER = "\x00user_input\x00"
+    SUMMARY_GIST_WORDS = 12
+
+    def __init__(self, persona_template, max_history_items, history_token_budget=None, summary_token_budget=None):
+        self.max_history_items = max_history_items
+        self.history_token_budget = history_token_budget or HISTORY_TOKEN_BUDGET
+        self.summary_token_budget = summary_token_budget or HISTORY_SUMMARY_TOKEN_BUDGET
+        self.rendered_lines = collections.deque() # Rendered lines, oldest first
+        self.line_tokens = collections.deque() # Token count of each rendered line
+        self.history_tokens = 0
+        self.summary_gists = collections.deque() # (gist, tokens) of evicted lines, oldest first
+        self.summary_tokens = 0
+        self.evicted_lines_total = 0
+        filled = persona_template.format(history=self.HISTORY_MARKER, user_input=self.USER_INPUT_MARKER)
+        self.prompt_head, rest = filled.split(self.HISTORY_MARKER)
+        self.prompt_middle, self.prompt_tail = rest.split(self.USER_INPUT_MARKER)
+
+    @staticmethod
+    def render_line(role, text):
+        if role == 'system': return text
+        return f"{'Jarvis' if role == 'model' else 'You'}: {text}"
+
+    def append(self, role, text, tokens=None):
+        # `tokens`: the clipped text's count when the caller already has it (the role prefix is estimated on top)
+        clipped = clip_to_token_budget(text, MAX_MESSAGE_TOKENS)
+        line = self.render_line(role, clipped)
+        tokens = count_text_tokens(line) if tokens is None else tokens + estimate_tokens(line) - estimate_tokens(clipped)
+        self.rendered_lines.append(line)
+        self.line_tokens.append(tokens)
+        self.history_tokens += tokens
+        while len(self.rendered_lines) > 1 and (len(self.rendered_lines) > self.max_history_items or
+                                                self.history_tokens + self.summary_tokens > self.history_token_budget):
+            self.evict_oldest_line()
+
+    def evict_oldest_line(self):
+        line = self.rendered_lines.popleft()
+        self.history_tokens -= self.line_tokens.popleft()
+        self.evicted_lines_total += 1
+        words = line.replace(ACTION_STATUS_PREFIX, "System:").replace(JARVIS_INTERNAL_TIMER_PREFIX, "Timer:").split()
+        gist = " ".join(words[:self.SUMMARY_GIST_WORDS]) + (" ..." if len(words) > self.SUMMARY_GIST_WORDS else "")
+        gist_tokens = estimate_tokens(gist) + 1 # +1 for the "; " separator
+        self.summary_gists.append((gist, gist_tokens))
+        self.summary_tokens += gist_tokens
+        while self.summary_tokens > self.summary_token_budget and len(self.summary_gists) > 1:
+            self.summary_tokens -= self.summary_gists.popleft()[1] # The oldest gists fade out first
+
+    def summary_line(self):
+        if not self.summary_gists: return None
+        return "Summary of earlier conversation: " + "; ".join(gist for gist, _ in self.summary_gists)
+
+    def build(self, user_input_raw, action_status=None):
+        # The current user input (and action status) are not committed yet; they take the newest slots
+        pending_lines = [self.render_line("user", clip_to_token_budget(user_input_raw, MAX_MESSAGE_TOKENS))]
+        if action_status: pending_lines.append(self.render_line("system", clip_to_token_budget(action_status, MAX_MESSAGE_TOKENS)))
+        skip = max(0, len(self.rendered_lines) + len(pending_lines) - self.max_history_items)
+        summary = self.summary_line()
+        lines = itertools.chain([summary] if summary else [], itertools.islice(self.rendered_lines, skip, None), pending_lines)
+        return "".join((self.prompt_head, "\n".join(lines).strip(), self.prompt_middle, user_input_raw, self.prompt_tail))
+
+prompt_builder = PromptBuilder(JARVIS_PERSONA_BASE_PROMPT, MAX_HISTORY_TURNS * 3 + 20)
+
+class ChatTurnBuffer:
+    # History for the "chat" backend, kept as structured Gemini Content turns ({"role", "parts"}).
+    # Only "user" and "model" roles exist there, so system statuses and timer notifications become
+    # extra parts of the neighbouring user turn; consecutive same-role messages share one turn.
+    # Bounded by the same token budget as PromptBuilder (oldest turns go first).
+    # Callers hold chat_history_lock around append() and build().
+    def __init__(self, history_token_budget=None):
+        self.history_token_budget = history_token_budget or HISTORY_TOKEN_BUDGET
+        self.turns = collections.deque() # {"role": "user"|"model", "parts": [str, ...]}
+        self.turn_tokens = collections.deque()
+        self.history_tokens = 0
+
+    @staticmethod
+    def content_role(role):
+        return "model" if role == "model" else "user"
+
+    def append(self, role, text, tokens=None):
+        content_role, part = self.content_role(role), clip_to_token_budget(text, MAX_MESSAGE_TOKENS) # Statuses keep their "[SYSTEM_...]" prefix
+        if tokens is None: tokens = count_text_tokens(part)
+        if self.turns and self.turns[-1]["role"] == content_role:
+            self.turns[-1]["parts"].append(part)
+            self.turn_tokens[-1] += tokens
+        else:
+            self.turns.append({"role": content_role, "parts": [part]})
+            self.turn_tokens.append(tokens)
+        self.history_tokens += tokens
+        while len(self.turns) > 1 and self.history_tokens > self.history_token_budget:
+            self.turns.popleft()
+            self.history_tokens -= self.turn_tokens.popleft()
+
+    def build(self, user_input_raw, action_status=None):
+        # Returns {"history": [...], "message": [parts]} ready for start_chat()/send_message_async()
+        history = [{"role": turn["role"], "parts": list(turn["parts"])} for turn in self.turns]
+        message = [clip_to_token_budget(user_input_raw, MAX_MESSAGE_TOKENS)]
+        if action_status: message.append(clip_to_token_budget(action_status, MAX_MESSAGE_TOKENS))
+        if history and history[-1]["role"] == "user": # e.g. a timer notification since the last reply
+            message = history.pop()["parts"] + message
+        return {"history": history, "message": message}
+
+chat_turn_buffer = ChatTurnBuffer()
+chat_model = None # GenerativeModel carrying the persona as its system instruction ("chat" backend)
+
+def get_chat_model():
+    global chat_model
+    if chat_model is None and get_model() is not None: # get_model() also makes sure genai is imported
+        chat_model = genai.GenerativeModel(model_name, system_instruction=JARVIS_SYSTEM_INSTRUCTION)
+    return chat_model
+
+def build_llm_request(user_input_raw, action_status):
+    # A flattened prompt string for the "prompt" backend, structured turns for the "chat" backend
+    with chat_history_lock: # Rendering reads the history buffers, so keep writers out
+        if LLM_BACKEND == "chat":
+            return chat_turn_buffer.build(user_input_raw, action_status)
+        return prompt_builder.build(user_input_raw, action_status)
+
+async def send_llm_request_async(llm_request, stream=False):
+    if not model_ready_event.is_set(): # Wait for the warm-up without holding up the loop
+        await asyncio.to_thread(get_model)
+    if isinstance(llm_request, str):
+        return await get_model().generate_content_async(llm_request, stream=stream)
+    chat_session = get_chat_model().start_chat(history=llm_request["history"])
+    return await chat_session.send_message_async(llm_request["message"], stream=stream)
+
+def llm_request_text(llm_request):
+    # Everything sent as input for this request, for size accounting
+    if isinstance(llm_request, str): return llm_request
+    parts = [JARVIS_SYSTEM_INSTRUCTION] + [part for turn in llm_request["history"] for part in turn["parts"]] + llm_request["message"]
+    return "\n".join(parts)
+
+turn_stats = collections.deque(maxlen=TURN_STATS_HISTORY) # Per-turn prompt size and LLM latency
+
+def active_history_tokens():
+    return chat_turn_buffer.history_tokens if LLM_BACKEND == "chat" else prompt_builder.history_tokens
+
+def record_turn_stats(context_label, llm_request, first_chunk_seconds, total_seconds):
+    with chat_history_lock:
+        turn_stats.append({
+            "time": time.time(), "context": context_label,
+            "prompt_tokens": estimate_tokens(llm_request_text(llm_request)), "prompt_chars": len(llm_request_text(llm_request)),
+            "backend": LLM_BACKEND, "history_tokens": active_history_tokens(), "summary_tokens": prompt_builder.summary_tokens,
+            "history_lines": len(prompt_builder.rendered_lines), "evicted_lines_total": prompt_builder.evicted_lines_total,
+            "first_chunk_ms": round(first_chunk_seconds * 1000, 1) if first_chunk_seconds is not None else None,
+            "llm_ms": round(total_seconds * 1000, 1),
+        })
+
+def get_context_stats_action():
+    with chat_history_lock:
+        recent = list(turn_stats)
+        history_tokens = active_history_tokens()
+        summary_tokens = prompt_builder.summary_tokens if LLM_BACKEND == "prompt" else 0
+    budget_str = f"History is using {history_tokens + summary_tokens} of {HISTORY_TOKEN_BUDGET} budgeted tokens ({summary_tokens} in the running summary)."
+    scheduler_str = f" {gui_request_scheduler.summary()}" if gui_request_scheduler.stats["submitted"] else ""
+    if not recent: return True, f"No language-model turns have been recorded yet. {budget_str} {response_cache.summary()}{scheduler_str}"
+    last = recent[-1]
+    avg_tokens = sum(t["prompt_tokens"] for t in recent) / len(recent)
+    avg_ms = sum(t["llm_ms"] for t in recent) / len(recent)
+    first_chunk_str = f", first text after {last['first_chunk_ms']:.0f} ms" if last["first_chunk_ms"] is not None else ""
+    return True, (f"Last prompt was about {last['prompt_tokens']} tokens and the reply took {last['llm_ms']:.0f} ms{first_chunk_str}. "
+                  f"Over the last {len(recent)} turn(s): {avg_tokens:.0f} tokens and {avg_ms:.0f} ms on average. {budget_str} "
+                  f"{response_cache.summary()}{scheduler_str}")
+
+def generate_jarvis_reply(llm_request, fallback_reply, on_chunk=None, context_label="CLI", outcome=None):
+    # Blocking bridge for the CLI loop and GUI workers: the request runs on the async core, and
+    # on_chunk is called from the loop thread.
+    return async_core.run(generate_jarvis_reply_async(llm_request, fallback_reply, on_chunk, context_label, outcome))
+
+async def generate_jarvis_reply_async(llm_request, fallback_reply, on_chunk=None, context_label="CLI", outcome=None):
+    # Returns Jarvis's reply text. When on_chunk is given, the whole returned text (including any
+    # error/blocked message) has been passed through it by the time this returns: piece by piece as
+    # the model streams when STREAM_LLM_RESPONSES is on, in one piece otherwise. Callers use on_chunk
+    # as their display sink and must not show the reply a second time.
+    # If an `outcome` dict is passed, outcome["ok"] tells whether the text is a genuine model reply.
+    streaming = bool(on_chunk) and STREAM_LLM_RESPONSES
+    jarvis_reply = fallback_reply
+    streamed_parts = []
+    request_started_at = time.perf_counter()
+    first_chunk_at = None
+    try:
+        if GEMINI_API_KEY == "YOUR_GEMINI_API_KEY" or not GEMINI_API_KEY:
+            jarvis_reply = "My connection to the Gemini network is not configured. Please set the API key."
+        elif streaming:
+            response = await send_llm_request_async(llm_request, stream=True)
+            if response.prompt_feedback and response.prompt_feedback.block_reason:
+                jarvis_reply = f"I'm unable to respond to that request due to content policy: {response.prompt_feedback.block_reason_message or response.prompt_feedback.block_reason}"
+                print(f"WARN: LLM response blocked. Reason: {response.prompt_feedback.block_reason_message or response.prompt_feedback.block_reason}")
+            else:
+                async for chunk in response:
+                    if not (chunk.candidates and chunk.candidates[0].content.parts): continue
+                    piece = chunk.text if streamed_parts else chunk.text.lstrip()
+                    if not piece: continue
+                    if not streamed_parts: first_chunk_at = time.perf_counter()
+                    streamed_parts.append(piece)
+                    on_chunk(piece)
+                if streamed_parts:
+                    jarvis_reply = "".join(streamed_parts).strip()
+                    if outcome is not None: outcome["ok"] = True
+                else: print(f"WARN: LLM streamed response empty/malformed: {response}")
+        else:
+            response = await send_llm_request_async(llm_request)
+            if response.candidates and response.candidates[0].content.parts:
+                jarvis_reply = response.text.strip()
+                if outcome is not None: outcome["ok"] = True
+            elif response.prompt_feedback and response.prompt_feedback.block_reason:
+                jarvis_reply = f"I'm unable to respond to that request due to content policy: {response.prompt_feedback.block_reason_message or response.prompt_feedback.block_reason}"
+                print(f"WARN: LLM response blocked. Reason: {response.prompt_feedback.block_reason_message or response.prompt_feedback.block_reason}")
+            else:
+                 print(f"WARN: LLM response empty/malformed: {response}")
+
+    except Exception as e_llm:
+        error_message_detail = str(e_llm)
+        if "API key not valid" in error_message_detail:
+            jarvis_reply = "There appears to be an issue with the API key configuration. I am unable to connect."
+        else:
+            jarvis_reply = f"A slight cognitive dissonance occurred. If you could rephrase, perhaps? (Error: {str(e_llm)[:100]}...)"
+        print(f"ERROR: LLM call failed ({context_label}): {e_llm}")
+        if outcome is not None: outcome["ok"] = False
+        if streamed_parts: # Part of the reply is already on screen; finish it with the error note
+            on_chunk(f" {jarvis_reply}")
+            jarvis_reply = f"{''.join(streamed_parts).strip()} {jarvis_reply}"
+
+    if on_chunk and not streamed_parts: # Not streaming, or nothing streamed (blocked, error, no key)
+        on_chunk(jarvis_reply)
+    finished_at = time.perf_counter()
+    record_turn_stats(context_label, llm_request,
+                      first_chunk_at - request_started_at if first_chunk_at else None, finished_at - request_started_at)
+    return jarvis_reply
+
+class ResponseCache:
+    # LRU + TTL cache of LLM replies, keyed on the normalised user input, the action status and a
+    # fingerprint of the last few history messages. Only replies to an action status are cached: those
+    # rephrase a deterministic result, while open-ended or creative prompts ("tell me a joke") should
+    # get a fresh answer each time. Optionally persisted to a JSON file, written by a background thread
+    # at most every RESPONSE_CACHE_SAVE_DELAY_SECONDS (and on exit).
+    def __init__(self, max_entries, ttl_seconds, persist_path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+        self.entries = collections.OrderedDict() # key -> (stored_at, reply), least recently used first
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "bypasses": 0, "expired": 0, "evictions": 0}
+        self.loaded = False
+        self.dirty = False # Entries changed since the last save
+        self.save_event = threading.Event()
+        self.save_lock = threading.Lock() # One writer of the file at a time
+        self.saver_thread = None
+
+    @staticmethod
+    def normalise(text):
+        return " ".join(re.sub(r"[^\w\s%]", " ", (text or "").lower()).split())
+
+    def make_key(self, user_input_raw, action_status, recent_history):
+        # None means "don't cache": conversation without an action status, time-sensitive statuses and
+        # pending confirmations always go to the LLM
+        if not action_status: return None
+        texts = [user_input_raw, action_status] + [item["text"] for item in recent_history]
+        if any(marker in text for text in texts for marker in RESPONSE_CACHE_BYPASS_MARKERS):
+            return None
+        fingerprint = "|".join(f"{item['role']}:{self.normalise(item['text'])}" for item in recent_history)
+        key_source = "\x1f".join((LLM_BACKEND, self.normalise(user_input_raw), self.normalise(action_status), fingerprint))
+        return hashlib.sha1(key_source.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            self.load_if_needed()
+            if key is None:
+                self.stats["bypasses"] += 1; return None
+            entry = self.entries.get(key)
+            if entry and time.time() - entry[0] > self.ttl_seconds:
+                del self.entries[key]; entry = None
+                self.stats["expired"] += 1
+            if not entry:
+                self.stats["misses"] += 1; return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def put(self, key, reply):
+        if key is None: return
+        with self.lock:
+            self.entries[key] = (time.time(), reply)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+            if self.persist_path: self.schedule_save()
+
+    def schedule_save(self): # Called with self.lock held
+        self.dirty = True
+        if self.saver_thread is None:
+            self.saver_thread = threading.Thread(target=self.saver_loop, daemon=True)
+            self.saver_thread.start()
+        self.save_event.set()
+
+    def saver_loop(self):
+        while True:
+            self.save_event.wait()
+            time.sleep(RESPONSE_CACHE_SAVE_DELAY_SECONDS) # Let more replies join the write
+            self.save_event.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not (self.dirty and self.persist_path): return
+            self.dirty = False
+            snapshot = [[key, stored_at, reply] for key, (stored_at, reply) in self.entries.items()]
+        self.save(snapshot) # The file is written outside the lock, so lookups never wait for the disk
+
+    def load_if_needed(self): # Called with self.lock held
+        if self.loaded: return
+        self.loaded = True
+        if not (self.persist_path and os.path.isfile(self.persist_path)): return
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as cache_file:
+                stored = json.load(cache_file)
+            now = time.time()
+            for key, stored_at, reply in stored[-self.max_entries:]:
+                if now - stored_at <= self.ttl_seconds: self.entries[key] = (stored_at, reply)
+        except (OSError, ValueError, TypeError) as e_load:
+            print(f"WARN: Could not load response cache from '{self.persist_path}': {e_load}")
+
+    def save(self, snapshot): # Write-then-rename so a crash never leaves half a file
+        with self.save_lock:
+            try:
+                temp_path = self.persist_path + ".tmp"
+                with open(temp_path, "w", encoding="utf-8") as cache_file:
+                    json.dump(snapshot, cache_file)
+                os.replace(temp_path, self.persist_path)
+            except OSError as e_save:
+                print(f"WARN: Could not save response cache to '{self.persist_path}': {e_save}")
+
+    def summary(self):
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            hit_rate = (self.stats["hits"] / lookups * 100) if lookups else 0.0
+            return (f"Response cache: {self.stats['hits']} hit(s), {self.stats['misses']} miss(es) ({hit_rate:.0f}% hit rate), "
+                    f"{self.stats['bypasses']} bypassed, {len(self.entries)} of {self.max_entries} entries.")
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS,
+                               RESPONSE_CACHE_FILE if RESPONSE_CACHE_PERSIST else None)
+atexit.register(response_cache.flush)
+
+def generate_cached_jarvis_reply(user_input_raw, action_status, fallback_reply, on_chunk=None, context_label="CLI"):
+    # generate_jarvis_reply() behind the response cache (same on_chunk contract)
+    cache_key = None
+    if RESPONSE_CACHE_ENABLED:
+        with chat_history_lock:
+            recent_history = conversation_history[-RESPONSE_CACHE_HISTORY_ITEMS:] if RESPONSE_CACHE_HISTORY_ITEMS else []
+        cache_key = response_cache.make_key(user_input_raw, action_status, recent_history)
+        cached_reply = response_cache.get(cache_key)
+        if cached_reply is not None:
+            if on_chunk: on_chunk(cached_reply)
+            return cached_reply
+
+    outcome = {"ok": False}
+    jarvis_reply = generate_jarvis_reply(build_llm_request(user_input_raw, action_status), fallback_reply,
+                                         on_chunk=on_chunk, context_label=context_label, outcome=outcome)
+    if RESPONSE_CACHE_ENABLED and outcome["ok"]:
+        response_cache.put(cache_key, jarvis_reply)
+    return jarvis_reply
+
+# --- GUI Request Scheduler ---
+class RequestScheduler:
+    # Runs submitted requests on a fixed pool of worker threads. Requests for the same conversation key
+    # run one at a time in submission order, so each one sees the previous turn in the history and replies
+    # are committed in order; different conversations can run side by side. Each conversation queues at most
+    # `queue_limit` waiting requests and submit() refuses more (back-pressure the caller shows to the user).
+    # Repeated text is queued like any other request; cancel_pending() (Esc in the GUI) drops waiting ones.
+    def __init__(self, worker_count, queue_limit, on_change=None):
+        self.worker_count, self.queue_limit, self.on_change = worker_count, queue_limit, on_change
+        self.condition = threading.Condition()
+        self.pending = {} # Conversation key -> deque of waiting requests
+        self.running = {} # Conversation key -> request in progress
+        self.ready_keys = collections.deque() # Keys whose next waiting request may start
+        self.workers = []
+        self.request_ids = itertools.count(1)
+        self.wait_times_ms = collections.deque(maxlen=REQUEST_METRICS_HISTORY)
+        self.stats = {"submitted": 0, "completed": 0, "rejected": 0, "cancelled": 0, "max_depth": 0}
+
+    def submit(self, key, text, function, *args):
+        # Returns the queued request, or None when the conversation's queue is full
+        with self.condition:
+            waiting = self.pending.setdefault(key, collections.deque())
+            if len(waiting) >= self.queue_limit:
+                self.stats["rejected"] += 1
+                return None
+            request = {"id": next(self.request_ids), "key": key, "text": text, "function": function, "args": args,
+                       "submitted_at": time.perf_counter()}
+            waiting.append(request)
+            if key not in self.running and key not in self.ready_keys: self.ready_keys.append(key)
+            self.stats["submitted"] += 1
+            self.stats["max_depth"] = max(self.stats["max_depth"], len(waiting) + (key in self.running))
+            while len(self.workers) < self.worker_count:
+                worker = threading.Thread(target=self.worker_loop, daemon=True)
+                worker.start()
+                self.workers.append(worker)
+            self.condition.notify()
+        self.notify_change(key)
+        return request
+
+    def cancel_pending(self, key):
+        # Drops the conversation's waiting requests (the running one finishes); returns how many
+        with self.condition:
+            waiting = self.pending.get(key) or ()
+            count = len(waiting)
+            if count: waiting.clear()
+            self.stats["cancelled"] += count
+        self.notify_change(key)
+        return count
+
+    def worker_loop(self):
+        while True:
+            with self.condition:
+                while not self.ready_keys: self.condition.wait()
+                key = self.ready_keys.popleft()
+                waiting = self.pending.get(key)
+                if not waiting: continue # Cancelled while it was ready
+                request = waiting.popleft()
+                self.running[key] = request
+                self.wait_times_ms.append((time.perf_counter() - request["submitted_at"]) * 1000)
+            self.notify_change(key)
+            try: request["function"](*request["args"])
+            except Exception as e: print(f"ERROR: Request '{request['text'][:40]}' failed: {e}")
+            with self.condition:
+                del self.running[key]
+                self.stats["completed"] += 1
+                if self.pending.get(key):
+                    self.ready_keys.append(key)
+                    self.condition.notify()
+            self.notify_change(key)
+
+    def notify_change(self, key):
+        if self.on_change:
+            try: self.on_change(key, *self.depth(key))
+            except Exception as e: print(f"WARN: Request scheduler status callback failed: {e}")
+
+    def depth(self, key):
+        # (waiting, running) for a conversation
+        with self.condition:
+            return len(self.pending.get(key) or ()), int(key in self.running)
+
+    def metrics(self):
+        with self.condition:
+            waits = sorted(self.wait_times_ms)
+            return dict(self.stats, waiting=sum(len(waiting) for waiting in self.pending.values()), running=len(self.running),
+                        avg_wait_ms=sum(waits) / len(waits) if waits else 0.0,
+                        p95_wait_ms=waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0)
+
+    def summary(self):
+        m = self.metrics()
+        return (f"GUI requests: {m['submitted']} submitted, {m['waiting']} waiting now (peak {m['max_depth']}), "
+                f"{m['rejected']} refused while busy, {m['cancelled']} cancelled; "
+                f"queue wait {m['avg_wait_ms']:.0f} ms average, {m['p95_wait_ms']:.0f} ms p95.")
+
+def update_gui_request_status(key, waiting, running):
+    # Scheduler callback (any thread): shows how much is queued under the input field
+    if not (gui_window and gui_status_label_gui): return
+    if waiting: status = f"Working... {waiting} more request{'s' if waiting > 1 else ''} waiting (Esc cancels waiting ones)"
+    elif running: status = "Working..."
+    else: status = ""
+    try: gui_window.after(0, lambda: gui_status_label_gui.config(text=status))
+    except Exception: pass # Window closing
+
+gui_request_scheduler = RequestScheduler(GUI_WORKER_THREADS, GUI_REQUEST_QUEUE_LIMIT, on_change=update_gui_request_status)
 
 # --- GUI Functions ---
 def launch_gui_interface():
-    global gui_active_flag, gui_window, chat_display_area_gui, user_input_field_gui
+    global gui_active_flag, gui_window, chat_display_area_gui, user_input_field_gui, gui_status_label_gui
 
     if gui_active_flag and gui_window and gui_window.winfo_exists():
         gui_window.lift()
@@ -1037,6 +3540,9 @@ def launch_gui_interface():
         display_message_in_ui_or_console("Jarvis: The interface is already active.", role="model")
         return True, "Interface is already active and has been brought to focus."
 
+    if not backend_available("tkinter"): # Imported only now, on 'open gui'
+        return False, "The graphical interface needs tkinter, which is not installed."
+
     gui_active_flag = True # Set flag before creating window
 
     # This function will now run in the main thread.
@@ -1063,6 +3569,7 @@ def launch_gui_interface():
                                                       relief=tk.FLAT, borderwidth=2,
                                                       padx=5, pady=5)
     chat_display_area_gui.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
+    chat_render_queue.attach(chat_display_area_gui, gui_window.after)
 
     # Input frame
     input_frame = tk.Frame(gui_window, bg=bg_color)
@@ -1079,6 +3586,11 @@ def launch_gui_interface():
                             bg=button_bg, fg=fg_color, activebackground=button_active_bg,
                             relief=tk.FLAT, padx=10, font=chat_font)
     send_button.pack(side=tk.RIGHT, padx=(5,0))
+    user_input_field_gui.bind("<Escape>", lambda event: cancel_waiting_gui_requests())
+
+    # Busy / queue status line
+    gui_status_label_gui = tk.Label(gui_window, text="", anchor="w", bg=bg_color, fg="#A0A0A0", font=("Arial", 9, "italic"))
+    gui_status_label_gui.pack(fill=tk.X, padx=10, pady=(0, 5))
 
     gui_window.protocol("WM_DELETE_WINDOW", on_gui_close)
     
@@ -1098,6 +3610,7 @@ def launch_gui_interface():
         on_gui_close() # Graceful shutdown
     finally:
         gui_active_flag = False # Ensure flag is reset
+        chat_render_queue.detach()
         print("INFO: GUI mainloop ended.")
     return True, "Interface has been launched." # This message is for the CLI->GUI transition call
 
@@ -1105,7 +3618,7 @@ def on_gui_close():
     global gui_active_flag, timer_thread_stop_event, gui_window
     if messagebox.askokcancel("Quit", "Are you sure you want to close Jarvis?"):
         gui_active_flag = False
-        timer_thread_stop_event.set() # Signal timer thread to stop
+        stop_timer_thread() # Signal timer thread to stop
         
         if gui_window:
             try:
@@ -1118,6 +3631,7 @@ def on_gui_close():
         # For now, closing GUI exits the program.
         print("Jarvis: Interface closed. Shutting down systems. It was a pleasure.")
         gui_thread_stop_event.set() # Signal main script if it's waiting on this
+        jarvis_store.close() # os._exit() skips atexit handlers, so commit queued writes now
         os._exit(0) # Force exit if threads are stubborn
 
 def handle_gui_input_submission():
@@ -1126,473 +3640,860 @@ def handle_gui_input_submission():
     if not user_input_raw:
         return
 
+    # Processed on the scheduler's worker threads to keep the GUI responsive, one request at a time in
+    # submission order; process_and_respond_for_gui handles history and the LLM call
+    request = gui_request_scheduler.submit("gui", user_input_raw, process_and_respond_for_gui, user_input_raw)
+    if request is None: # Queue full: keep the text in the field so it can be sent again
+        gui_status_label_gui.config(text=f"Still working through {GUI_REQUEST_QUEUE_LIMIT} waiting requests; please send that again in a moment.")
+        return
     display_message_in_ui_or_console(f"You: {user_input_raw}", role="user", is_gui_message=True)
     user_input_field_gui.delete(0, tk.END)
 
-    # Process the command in a new thread to keep GUI responsive
-    # The process_and_respond_for_gui function will handle history and LLM call
-    thread = threading.Thread(target=process_and_respond_for_gui, args=(user_input_raw,), daemon=True)
-    thread.start()
-
+def cancel_waiting_gui_requests():
+    count = gui_request_scheduler.cancel_pending("gui")
+    if count:
+        display_message_in_ui_or_console(f"(Cancelled {count} waiting request{'s' if count > 1 else ''}.)", role="system_gui", is_gui_message=True)
 
 
 def process_and_respond_for_gui(user_input_raw):
     # This function runs in a worker thread
     global conversation_history, model, gui_window # Ensure gui_window is accessible
 
-    current_user_input_item = {"role": "user", "text": user_input_raw}
-    
-    with chat_history_lock:
-        temp_history_for_command_processing = list(conversation_history)
-    temp_history_for_command_processing.append(current_user_input_item)
-
-    action_status = process_command(user_input_raw, temp_history_for_command_processing) 
-
-    with chat_history_lock:
-        llm_prompt_history_list = list(conversation_history) 
-    llm_prompt_history_list.append(current_user_input_item)
-    if action_status:
-        llm_prompt_history_list.append({"role": "system", "text": action_status})
-    
-    history_str_for_llm = ""
-    relevant_llm_history_items = llm_prompt_history_list[-(MAX_HISTORY_TURNS * 3 + 20):] 
-    for item in relevant_llm_history_items:
-        role_display = "Jarvis" if item['role'] == 'model' else "You" if item['role'] == 'user' else "System"
-        if item['role'] == 'system': 
-            history_str_for_llm += f"{item['text']}\n"
-        else:
-            history_str_for_llm += f"{role_display}: {item['text']}\n"
-    
-    full_prompt_for_llm = JARVIS_PERSONA_BASE_PROMPT.format(history=history_str_for_llm.strip(), user_input=user_input_raw)
-
-    jarvis_reply = "My apologies, I seem to be experiencing a momentary lapse in communication. Could you try that again?"
-    try:
-        if GEMINI_API_KEY == "YOUR_GEMINI_API_KEY" or not GEMINI_API_KEY:
-             jarvis_reply = "My connection to the Gemini network is not configured. Please set the API key."
-        else:
-            response = model.generate_content(full_prompt_for_llm)
-            if response.candidates and response.candidates[0].content.parts:
-                jarvis_reply = response.text.strip()
-            elif response.prompt_feedback and response.prompt_feedback.block_reason:
-                jarvis_reply = f"I'm unable to respond to that request due to content policy: {response.prompt_feedback.block_reason_message or response.prompt_feedback.block_reason}"
-                print(f"WARN: LLM response blocked. Reason: {response.prompt_feedback.block_reason_message or response.prompt_feedback.block_reason}")
-            else:
-                 print(f"WARN: LLM response empty/malformed: {response}")
+    intent_name, action_status = route_command(user_input_raw, dialogue_state)
 
-    except Exception as e_llm:
-        error_message_detail = str(e_llm)
-        if "API key not valid" in error_message_detail:
-            jarvis_reply = "There appears to be an issue with the API key configuration. I am unable to connect."
-        else:
-            jarvis_reply = f"A slight cognitive dissonance occurred. If you could rephrase, perhaps? (Error: {str(e_llm)[:100]}...)"
-        print(f"ERROR: LLM call failed (GUI): {e_llm}")
+    templated_reply = render_templated_reply(intent_name, action_status)
+    if templated_reply: # Deterministic result: answer locally, no LLM round-trip
+        add_to_conversation_history("user", user_input_raw)
+        add_to_conversation_history("system", action_status)
+        add_to_conversation_history("model", templated_reply)
+        if gui_window and gui_window.winfo_exists():
+            gui_window.after(0, display_message_in_ui_or_console, f"Jarvis: {templated_reply}", "model", True)
+        start_deferred_embellishment(intent_name, "GUI")
+        return
 
-    # --- Start of Corrected Section ---
+    # Show the system note before the reply starts streaming in
+    if action_status and not action_status.startswith(f"{ACTION_STATUS_PREFIX} CONFIRMATION_REQUIRED"):
+        if gui_window and gui_window.winfo_exists():
+            gui_window.after(0, display_message_in_ui_or_console,
+                             f"{action_status.replace(ACTION_STATUS_PREFIX, 'System Note:')}",
+                             "system_gui",  # role
+                             True)          # is_gui_message
+
+    reply_stream = GuiReplyStream(prefix="Jarvis: ", role="model")
+    jarvis_reply = generate_cached_jarvis_reply(user_input_raw, action_status,
+                                                "My apologies, I seem to be experiencing a momentary lapse in communication. Could you try that again?",
+                                                on_chunk=reply_stream.write, context_label="GUI")
+    reply_stream.close()
+
+    # The turn is committed once, after the whole reply is in
     add_to_conversation_history("user", user_input_raw)
-    if action_status:
-        add_to_conversation_history("system", action_status) 
-        if not action_status.startswith(f"{ACTION_STATUS_PREFIX} CONFIRMATION_REQUIRED"):
-            if gui_window and gui_window.winfo_exists(): 
-                # CORRECTED LINE 1 for action_status:
-                gui_window.after(0, display_message_in_ui_or_console, 
-                                 f"{action_status.replace(ACTION_STATUS_PREFIX, 'System Note:')}", 
-                                 "system_gui",  # role
-                                 True)          # is_gui_message
-
+    if action_status: add_to_conversation_history("system", action_status)
     add_to_conversation_history("model", jarvis_reply)
-    if gui_window and gui_window.winfo_exists(): 
-        # CORRECTED LINE 2 for jarvis_reply:
-        gui_window.after(0, display_message_in_ui_or_console, 
-                         f"Jarvis: {jarvis_reply}", 
-                         "model",  # role
-                         True)     # is_gui_message
-    # --- End of Corrected Section ---
-
 
 
-def display_message_in_ui_or_console(message, role="system", is_gui_message=False):
+CHAT_DISPLAY_TAG_STYLES = { # Configured once on the chat display when the GUI starts
+    "user": {"foreground": "#A0D0FF"}, # Light blue for user
+    "model": {"foreground": "#90EE90"}, # Light green for Jarvis
+    "system_gui": {"foreground": "#FFA07A", "font": ("Arial", 9, "italic")}, # Light Salmon, italic
+    "timer_notification_gui": {"foreground": "#FFD700", "font": ("Arial", 10, "bold")}, # Gold, bold
+}
+
+class ChatRenderQueue:
+    # Text for the chat display, queued from any thread and rendered on the Tk thread at most once
+    # per interval: everything queued since the last frame goes in with one state toggle, one
+    # multi-range insert (adjacent pieces with the same tag merged) and one see(). The display keeps
+    # at most max_lines lines, trimmed from the top in steps of trim_lines; queued text that would
+    # be trimmed straight away is never inserted.
+    def __init__(self, max_lines, trim_lines, interval_ms):
+        self.max_lines = max_lines
+        self.trim_lines = trim_lines
+        self.interval_ms = interval_ms
+        self.widget = None
+        self.schedule = None # schedule(delay_ms, callback) on the Tk thread, i.e. gui_window.after
+        self.pending = [] # (text, tag)
+        self.lock = threading.Lock()
+        self.flush_scheduled = False
+        self.last_flush_time = 0.0
+        self.line_count = 1 # Lines in the widget (Tk counts the empty last line too)
+        self.stats = {"frames": 0, "pieces": 0, "inserts": 0, "trimmed_lines": 0, "dropped_lines": 0, "slowest_frame_ms": 0.0}
+
+    def attach(self, widget, schedule): # Called on the Tk thread with a new, empty display
+        for tag_name, style in CHAT_DISPLAY_TAG_STYLES.items():
+            widget.tag_configure(tag_name, **style)
+        with self.lock:
+            self.widget, self.schedule = widget, schedule
+            self.pending, self.flush_scheduled, self.line_count = [], False, 1
+
+    def detach(self):
+        with self.lock:
+            self.widget, self.schedule, self.pending = None, None, []
+
+    def enqueue(self, text, tag_name):
+        # Returns False when no display is attached. The first piece after a quiet spell renders at once.
+        with self.lock:
+            if self.widget is None: return False
+            self.pending.append((text, tag_name))
+            self.stats["pieces"] += 1
+            if self.flush_scheduled: return True
+            self.flush_scheduled = True
+            delay_ms = max(0, int(self.interval_ms - (time.time() - self.last_flush_time) * 1000))
+            schedule = self.schedule
+        schedule(delay_ms, self.flush)
+        return True
+
+    def visible_runs(self, batch):
+        # Merge adjacent same-tag pieces, then keep only the text that fits in max_lines. Returns
+        # (runs, replace_all): replace_all means the batch alone fills the display.
+        runs = []
+        for text, tag_name in batch:
+            if runs and runs[-1][1] == tag_name: runs[-1][0].append(text)
+            else: runs.append(([text], tag_name))
+        kept, newlines = [], 0
+        for parts, tag_name in reversed(runs):
+            text = "".join(parts)
+            allowed = self.max_lines - 1 - newlines # Newlines that still fit
+            if text.count("\n") > allowed:
+                lines = text.split("\n")
+                self.stats["dropped_lines"] += len(lines) - allowed - 1
+                if allowed >= 0: kept.append(("\n".join(lines[-allowed - 1:]), tag_name))
+                return kept[::-1], True
+            kept.append((text, tag_name))
+            newlines += text.count("\n")
+        return kept[::-1], False
+
+    def flush(self): # Runs on the Tk thread
+        with self.lock:
+            batch, self.pending = self.pending, []
+            self.flush_scheduled = False
+            self.last_flush_time = time.time()
+            widget = self.widget
+        if not batch or widget is None: return
+        started = time.perf_counter()
+        runs, replace_all = self.visible_runs(batch)
+        widget.config(state='normal')
+        if replace_all:
+            widget.delete("1.0", tk.END)
+            self.stats["trimmed_lines"] += self.line_count - 1
+            self.line_count = 1
+        widget.insert(tk.END, *[item for text, tag_name in runs for item in (text, (tag_name,))])
+        self.line_count += sum(text.count("\n") for text, _ in runs)
+        if self.line_count > self.max_lines:
+            excess = min(self.line_count - self.max_lines + self.trim_lines, self.line_count - 1)
+            widget.delete("1.0", f"{excess + 1}.0")
+            self.line_count -= excess
+            self.stats["trimmed_lines"] += excess
+        widget.config(state='disabled')
+        widget.see(tk.END) # Scroll to the end
+        self.stats["frames"] += 1
+        self.stats["inserts"] += len(batch)
+        self.stats["slowest_frame_ms"] = max(self.stats["slowest_frame_ms"], (time.perf_counter() - started) * 1000)
+
+chat_render_queue = ChatRenderQueue(GUI_SCROLLBACK_MAX_LINES, GUI_SCROLLBACK_TRIM_LINES, GUI_RENDER_INTERVAL_MS)
+
+class GuiReplyStream:
+    # Streamed reply chunks from a worker thread go to the chat render queue, which batches them
+    # per frame so a fast stream doesn't flood the event loop. The prefix goes out with the first chunk.
+    def __init__(self, prefix, role):
+        self.role = role
+        self.prefix = prefix
+
+    def write(self, chunk):
+        if self.prefix: chunk, self.prefix = self.prefix + chunk, ""
+        chat_render_queue.enqueue(chunk, self.role)
+
+    def close(self):
+        self.write("\n\n")
+
+
+def display_message_in_ui_or_console(message, role="system", is_gui_message=False, end="\n"):
     global chat_display_area_gui, gui_active_flag
 
-    if gui_active_flag and chat_display_area_gui and gui_window and gui_window.winfo_exists():
-        chat_display_area_gui.config(state='normal')
-        
-        # Basic tagging for colors based on role
-        tag_name = role
-        if role == "user":
-            chat_display_area_gui.tag_configure("user", foreground="#A0D0FF") # Light blue for user
-        elif role == "model":
-            chat_display_area_gui.tag_configure("model", foreground="#90EE90") # Light green for Jarvis
-        elif role == "system_gui": # For system messages in GUI, make them distinct
-            chat_display_area_gui.tag_configure("system_gui", foreground="#FFA07A", font=("Arial", 9, "italic")) # Light Salmon, italic
-        elif role == "timer_notification_gui":
-            chat_display_area_gui.tag_configure("timer_notification_gui", foreground="#FFD700", font=("Arial", 10, "bold")) # Gold, bold
-
-        chat_display_area_gui.insert(tk.END, message + "\n\n", (tag_name,))
-        chat_display_area_gui.config(state='disabled')
-        chat_display_area_gui.see(tk.END) # Scroll to the end
-    else:
-        # Fallback to console if GUI is not active or message is specifically for console
-        if not is_gui_message:
-            print(message)
+    # Safe from any thread: GUI text is queued and rendered on the Tk thread, coloured by the role's tag
+    if gui_active_flag and chat_display_area_gui and chat_render_queue.enqueue(message + "\n\n", role):
+        return
+    # Fallback to console if GUI is not active or message is specifically for console
+    if not is_gui_message:
+        print(message, end=end, flush=True)
 
 
 # --- COMMAND PARSING AND EXECUTION ---
-def process_command(user_input_raw, current_conversation_history_for_command):
-    text = user_input_raw.lower().strip()
-    action_status_message = None
-    
-    # Extract last Jarvis response for confirmation checks
-    last_jarvis_response = ""
-    relevant_history = [item for item in current_conversation_history_for_command if item['role'] == 'model']
-    if relevant_history:
-        last_jarvis_response = relevant_history[-1]['text'].lower()
-
-    # Confirmation handling for sensitive actions
-    # Empty Recycle Bin Confirmation
-    if "emptying the recycle bin is a permanent action" in last_jarvis_response or \
-       "emptying the recycle bin is permanent" in last_jarvis_response: # Added from my prompt for Jarvis
-        if "yes, empty it" in text or "confirm empty recycle bin" in text or \
-           (text == "yes" and "recycle bin" in last_jarvis_response.lower()):
+# --- INTENT ROUTER ---
+# Every command intent is registered once at import: its regex patterns are compiled up front
+# and it declares "trigger" literals, at least one of which must appear in the text for any of
+# its patterns to match. A single overlapping scan over the input for all trigger literals picks
+# the candidate intents; only those run their compiled patterns, still in registration order.
+# A handler gets (match, text, dialogue) and returns an action status, or None to fall through.
+INTENT_ROUTES = [] # List of dicts: name, sources, flags, patterns, triggers, handler
+intent_trigger_regex = None # Lookahead alternation over the reduced trigger literals
+intent_trigger_map = {} # Reduced trigger literal -> set of route indexes
+intent_untriggered_routes = set() # Routes with no triggers are always candidates
+
+def register_intent(name, patterns, triggers, handler, flags=0):
+    INTENT_ROUTES.append({
+        "name": name, "sources": tuple(patterns), "flags": flags,
+        "patterns": tuple(re.compile(p, flags) for p in patterns),
+        "triggers": tuple(triggers), "handler": handler
+    })
+
+def build_intent_router():
+    global intent_trigger_regex, intent_trigger_map, intent_untriggered_routes
+    literals = {t for route in INTENT_ROUTES for t in route["triggers"]}
+    # A literal containing a shorter literal is replaced by the shorter one (it fires whenever the
+    # longer one would). The reduced set has no literal inside another, so the lookahead scan
+    # below reports every occurrence of every literal in one pass.
+    reduced = {}
+    for literal in literals:
+        contained = [other for other in literals if other != literal and other in literal]
+        reduced[literal] = min(contained, key=len) if contained else literal
+
+    intent_trigger_map = {}
+    intent_untriggered_routes = set()
+    for index, route in enumerate(INTENT_ROUTES):
+        if not route["triggers"]:
+            intent_untriggered_routes.add(index)
+        for literal in route["triggers"]:
+            intent_trigger_map.setdefault(reduced[literal], set()).add(index)
+    alternation = "|".join(re.escape(lit) for lit in sorted(intent_trigger_map, key=len, reverse=True))
+    intent_trigger_regex = re.compile(f"(?=({alternation}))")
+
+def iter_intent_matches(text):
+    # Yields (route, match) for candidate routes in priority order. Pattern-less routes yield
+    # match=None and do their own (cheap) keyword checks in the handler.
+    candidates = set(intent_untriggered_routes)
+    for hit in intent_trigger_regex.finditer(text):
+        candidates.update(intent_trigger_map[hit.group(1)])
+    for index in sorted(candidates):
+        route = INTENT_ROUTES[index]
+        if not route["patterns"]:
+            yield route, None
+            continue
+        for pattern in route["patterns"]:
+            match = pattern.search(text)
+            if match:
+                yield route, match
+                break
+
+def handle_gui_intent(match, text, dialogue):
+    # This command will be handled in the main loop to transition to GUI mode
+    return f"{ACTION_STATUS_PREFIX} GUI_LAUNCH_REQUESTED"
+
+def handle_set_timer_intent(match, text, dialogue):
+    duration_part = match.group(2).strip()
+    description_part = match.group(3).strip().strip("'\"") if match.group(3) else "your task"
+
+    # Try to extract description if it's embedded in duration_part
+    # e.g., "timer 5 minutes for cookies"
+    potential_desc_match = re.match(r'(.+?)\s+(?:for|called|named|regarding)\s+["\']?(.+?)["\']?$', duration_part, re.IGNORECASE)
+    if potential_desc_match:
+        duration_actual = potential_desc_match.group(1).strip()
+        description_actual = potential_desc_match.group(2).strip().strip("'\"")
+        if description_part == "your task" or not description_part : description_part = description_actual # Prefer explicit one if available
+        duration_part = duration_actual
+
+    success, message = set_jarvis_timer_action(duration_part, description_part)
+    timer_id = re.search(r'\bID (\d+)', message) if success else None
+    if timer_id: dialogue.remember("timer", timer_id.group(1))
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Timer Error: {message}"
+
+def handle_cancel_timer_intent(match, text, dialogue):
+    desc_or_id = match.group(2).strip().strip("'\"") if match.group(2) else None
+    if desc_or_id and desc_or_id.lower() in DIALOGUE_REFERENCE_WORDS: # "cancel that (timer)": the timer last set
+        if "timer" not in text and dialogue.active_domain() != "timers": return None
+        desc_or_id = dialogue.resolve(desc_or_id, "timer")
+    success, message = cancel_jarvis_timer_action(desc_or_id)
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Cancel Timer Error: {message}"
+
+def handle_cancel_all_timers_intent(match, text, dialogue):
+    success, message = cancel_all_jarvis_timers_action()
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Cancel All Timers Error: {message}"
+
+# Words that mean "what is ..." isn't arithmetic; matched at word starts, so "kilograms" or "3 times 4" still calculate
+CALCULATOR_EXCLUDED_TOPICS = re.compile(r'\b(?:time(?!s\b)|date|weather|system status|cpu|ram|memory|process|uptime|my name|your name|note|file|folder)')
+
+def handle_calculate_intent(match, text, dialogue):
+    expression = match.group(2).strip()
+    # Avoid triggering calculator for phrases like "what is the time"
+    if CALCULATOR_EXCLUDED_TOPICS.search(expression.lower()):
+        return None
+    success, message = calculate_action(expression) # Pass original expression for better message
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Calculation Error: {message}"
+
+def handle_convert_units_intent(match, text, dialogue):
+    if not parse_unit_conversion(normalize_calculator_expression(match.group(1))):
+        return None # Not a number with known units
+    success, message = calculate_action(match.group(1))
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Calculation Error: {message}"
+
+def handle_weather_intent(match, text, dialogue):
+    location = match.group(1).strip().replace("like in", "").replace("like for", "").strip()
+    if not location:
+        return None
+    success, message = get_weather_action(location)
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Weather Access Error: {message}"
+
+def handle_roll_dice_intent(match, text, dialogue):
+    success, message = roll_dice_action(); return f"{ACTION_STATUS_PREFIX} {message}"
+
+def handle_flip_coin_intent(match, text, dialogue):
+    success, message = flip_coin_action(); return f"{ACTION_STATUS_PREFIX} {message}"
+
+def handle_joke_intent(match, text, dialogue):
+    success, message = get_joke_action(); return f"{ACTION_STATUS_PREFIX} {message}"
+
+def handle_random_number_intent(match, text, dialogue):
+    min_val, max_val = match.group(1), match.group(2)
+    success, message = generate_random_number_action(min_val, max_val)
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Random Number Generation Error: {message}"
+
+def handle_uptime_intent(match, text, dialogue):
+    success, message = get_system_uptime_action()
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Uptime Inquiry Error: {message}"
+
+def handle_empty_recycle_bin_intent(match, text, dialogue):
+    result, message = empty_recycle_bin_action(confirmation_expected=False) # Will return "CONFIRMATION_NEEDED" or (bool, msg)
+    if result == "CONFIRMATION_NEEDED":
+        return f"{ACTION_STATUS_PREFIX} CONFIRMATION_REQUIRED_FOR_EMPTY_RECYCLE_BIN: {message}"
+    elif isinstance(result, bool) and result: # Success
+        return f"{ACTION_STATUS_PREFIX} {message}"
+    return f"{ACTION_STATUS_PREFIX} Recycle Bin Operation Error: {message}"
+
+def handle_lock_screen_intent(match, text, dialogue):
+    success, message = lock_screen_action()
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Screen Lock Error: {message}"
+
+def handle_power_intent(match, text, dialogue):
+    action_word = match.group(1).lower()
+    action_type = "logout" if action_word in ["log off", "logout", "sign out"] else \
+                  "restart" if action_word in ["restart", "reboot"] else \
+                  "shutdown" if action_word == "shutdown" else None
+    if not action_type:
+        return None
+    result, message = system_power_action(action_type, confirmation_expected=False)
+    if result == "CONFIRMATION_NEEDED":
+        return f"{ACTION_STATUS_PREFIX} CONFIRMATION_REQUIRED_FOR_{action_type.upper()}: {message}"
+    elif isinstance(result, bool) and result: # Success
+        return f"{ACTION_STATUS_PREFIX} {message}"
+    return f"{ACTION_STATUS_PREFIX} System {action_type.capitalize()} Error: {message}"
+
+def handle_datetime_intent(match, text, dialogue):
+    success, message = get_current_datetime_action()
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Date/Time Inquiry Error: {message}"
+
+def handle_system_stats_intent(match, text, dialogue):
+    success, message = get_system_stats_action()
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} System Stats Inquiry Error: {message}"
+
+STATS_METRIC_WORDS = {"cpu": "cpu", "processor": "cpu", "ram": "ram", "memory": "ram", "disk": "disk", "network": "network", "net": "network"}
+STATS_UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600}
+
+def handle_stats_average_intent(match, text, dialogue):
+    metric = STATS_METRIC_WORDS[match.group("metric").lower()]
+    seconds = 60 # Just "average cpu" means the last minute
+    if match.group("unit"):
+        amount = match.group("amount")
+        amount = int(amount) if amount and amount.isdigit() else 1 # "an hour", "the last minute"
+        seconds = amount * STATS_UNIT_SECONDS[match.group("unit")[0].lower()]
+    success, message = get_stats_average_action(metric, seconds)
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} System Stats Inquiry Error: {message}"
+
+def handle_top_processes_intent(match, text, dialogue):
+    groups = match.groupdict()
+    by = "cpu" if (groups.get("metric") or "memory").lower() in ("cpu", "processor") else "memory"
+    count = min(int(groups.get("count") or 5), STATS_TOP_PROCESSES)
+    success, message = get_top_processes_action(by, max(count, 1))
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Process List Error: {message}"
+
+def handle_internet_check_intent(match, text, dialogue):
+    success, message = check_internet_connection_action()
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Internet Connection Check Error: {message}"
+
+def handle_context_stats_intent(match, text, dialogue):
+    success, message = get_context_stats_action()
+    return f"{ACTION_STATUS_PREFIX} {message}"
+
+# Listing options recognised after the path: option -> regex whose group 1 is the value
+LISTING_OPTION_PATTERNS = [
+    ("sort_by", r'\b(?:sort(?:ed)?\s+)?by\s+(size|name|date|modified|mtime|time)\b'),
+    ("sort_by", r'\b(largest|biggest|smallest|newest|latest|oldest|most\s+recent)(?:\s+first)?\b'),
+    ("max_depth", r'\b(?:to\s+|max\s+)?(?:depth|levels?)\s+(\d+)\b'),
+    ("recursive", r'\b(recursively|recursive)\b'),
+    ("limit", r'\b(?:first|top|limit)\s+(\d+)\b'),
+    # A glob needs a '*', or 'matching'/'named'/'like' in front when its only wildcard is '?'
+    ("pattern", r'\b(?:matching|named|like)\s+["\']?([^\s"\']*[*?][^\s"\']*)["\']?|["\']?([^\s"\']*\*[^\s"\']*)["\']?'),
+]
+LISTING_KEYWORD_GLOB_AT_END = re.compile(r'\b(?:matching|named|like)\s+["\']?[^\s"\']*\?["\']?$')
+LISTING_SORT_WORDS = {"size": "largest", "biggest": "largest", "date": "newest", "modified": "newest", "mtime": "newest",
+                      "time": "newest", "latest": "newest", "recent": "newest"}
+
+def parse_listing_request(request_text):
+    # Splits e.g. "in downloads *.pdf sorted by size" into the path and list_directory_contents_action options
+    options = {}
+    request_text = request_text.strip()
+    if request_text.endswith("?") and not LISTING_KEYWORD_GLOB_AT_END.search(request_text):
+        request_text = request_text[:-1] # "list files in downloads?" asks a question, it isn't a glob
+    for option, pattern in LISTING_OPTION_PATTERNS:
+        found = re.search(pattern, request_text)
+        if not found: continue
+        value = found.group(found.lastindex).split()[-1]
+        options[option] = LISTING_SORT_WORDS.get(value, value) if option == "sort_by" else \
+                          int(value) if option in ("max_depth", "limit") else True if option == "recursive" else value
+        request_text = request_text[:found.start()] + " " + request_text[found.end():]
+    if "max_depth" in options: options["recursive"] = True
+    path = re.sub(r'^(?:in|of)(?:\s+|$)', '', request_text.strip()).strip()
+    return path or ".", options
+
+def handle_list_directory_intent(match, text, dialogue):
+    path_to_list, options = parse_listing_request(match.group(1).strip() if match.group(1) else "")
+    success, message = list_directory_contents_action(path_to_list, **options)
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} List Directory Error: {message}"
+
+def handle_list_directory_next_intent(match, text, dialogue):
+    count = match.groupdict().get("count")
+    result = list_directory_next_page_action(int(count) if count else None)
+    if result is None: return None # No listing to continue; e.g. "next" for media
+    success, message = result
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} List Directory Error: {message}"
+
+def handle_create_directory_intent(match, text, dialogue):
+    path_to_create = match.group(1).strip()
+    success, message = create_directory_action(path_to_create)
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Create Directory Error: {message}"
+
+def handle_open_file_intent(match, text, dialogue):
+    filepath_to_open = match.group(1).strip().strip("'\"")
+    success, message = open_file_with_default_app_action(filepath_to_open)
+    if success: dialogue.remember("file", filepath_to_open)
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Open File Error: {message}"
+
+def handle_find_file_intent(match, text, dialogue):
+    query_text, location = match.group(1).strip().strip("'\""), match.group(2)
+    success, message = find_file_action(query_text, location.strip() if location else None)
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Find File Error: {message}"
+
+def handle_open_latest_file_intent(match, text, dialogue):
+    location = match.group(2)
+    success, message = open_latest_file_action(match.group(1), location.strip() if location else None)
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Open File Error: {message}"
+
+def handle_take_note_intent(match, text, dialogue):
+    note = match.group(1).strip()
+    if not note: # Ensure there's content for the note
+        return None
+    success, message = take_note_action(note)
+    return f"{ACTION_STATUS_PREFIX} {message}"
+
+def split_notes_page(text):
+    # "find notes about tax page 2" -> ("find notes about tax", 2)
+    page_match = re.search(r'\s*\bpage\s+(\d+)\s*$', text)
+    if not page_match: return text, 1
+    return text[:page_match.start()], max(1, int(page_match.group(1)))
+
+def handle_view_notes_intent(match, text, dialogue):
+    success, message = view_notes_action(split_notes_page(text)[1])
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Notes Error: {message}"
+
+def handle_search_notes_intent(match, text, dialogue):
+    query_text, page = split_notes_page(match.group(1).strip())
+    query_text = query_text.strip(" ?.!'\"")
+    tag_match = re.search(r'#(\w+)', query_text) # "find notes about budget #work"
+    tag = tag_match.group(1) if tag_match else None
+    if tag_match: query_text = (query_text[:tag_match.start()] + query_text[tag_match.end():]).strip()
+    if not query_text and not tag: return None
+    success, message = search_notes_action(query_text, tag, page)
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Notes Error: {message}"
+
+def handle_tagged_notes_intent(match, text, dialogue):
+    success, message = search_notes_action("", match.group(1), split_notes_page(text)[1])
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Notes Error: {message}"
+
+def handle_recent_notes_intent(match, text, dialogue):
+    success, message = recent_notes_action(int(match.group(1)) if match.group(1) else 5)
+    return f"{ACTION_STATUS_PREFIX} {message}"
+
+def handle_clear_notes_intent(match, text, dialogue):
+    success, message = clear_notes_action()
+    return f"{ACTION_STATUS_PREFIX} {message}"
+
+def handle_copy_intent(match, text, dialogue):
+    text_to_copy = match.group(1) if len(match.groups()) == 1 else match.group(2)
+    text_to_copy = text_to_copy.strip()
+    if not text_to_copy:
+        return None
+    success, message = copy_to_clipboard_action(text_to_copy)
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Clipboard Copy Error: {message}"
+
+def handle_read_clipboard_intent(match, text, dialogue):
+    success, message = get_clipboard_content_action()
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Clipboard Read Error: {message}"
+
+def handle_type_text_intent(match, text, dialogue):
+    text_to_type = match.group(1) if len(match.groups()) == 1 else match.group(2)
+    # Don't strip here, preserve original spacing for typing
+    if not text_to_type: # Check if there's actually something to type
+        return None
+    success, message = type_text_action(text_to_type)
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Typing Operation Error: {message}"
+
+def handle_cancel_typing_intent(match, text, dialogue):
+    success, message = cancel_typing_action()
+    return f"{ACTION_STATUS_PREFIX} {message}"
+
+def handle_open_url_intent(match, text, dialogue):
+    url_to_open = match.group(2)
+    # Basic validation that it looks like a URL structure, not just "open settings"
+    if "." not in url_to_open or url_to_open.lower().endswith((".txt", ".doc", ".pdf")): # Avoid mistaking filenames for URLs
+        return None
+    success, message = open_url_in_browser(url_to_open)
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} URL Opening Error: {message}"
+
+def handle_web_search_intent(match, text, dialogue):
+    query = match.group(2).strip()
+    # Avoid searching if it's clearly an internal command keyword
+    internal_command_keywords = [
+        "open", "launch", "close", "quit", "list", "create", "copy", "paste", "type", "timer",
+        "calculate", "weather", "roll", "flip", "joke", "uptime", "lock", "shutdown", "restart", "logout",
+        "note", "clipboard", "volume", "gui", "interface", "help", "time", "date", "stats", "internet"
+    ]
+    query_first_word = query.split(' ')[0].lower()
+    if query_first_word in internal_command_keywords or len(query) <= 2: # Simple check
+        return None
+    success, message = perform_web_search(query)
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Web Search Error: {message}"
+
+def handle_open_app_intent(match, text, dialogue):
+    app_name = match.group(2).strip().replace(" application", "").replace(" app", "").strip()
+    if app_name.lower() in DIALOGUE_REFERENCE_WORDS: # "open it": the file or app last referred to
+        file_path = dialogue.resolve(app_name, "file") if dialogue.active_domain() == "files" else None
+        if file_path:
+            success, message = open_file_with_default_app_action(file_path)
+            return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Open File Error: {message}"
+        app_name = dialogue.resolve(app_name, "app") or app_name
+    # Filter out common words that are not app names
+    filter_words = ["website", "url", "link", "tab", "window", "file", "document", "folder", "directory",
+                    "the", "a", "an", "my", "some", "for", "me", "current", "this", "that", "page",
+                    "timer", "note", "calculator", "settings", "preferences", "gui", "interface"]
+    if app_name.lower() in filter_words or len(app_name) <= 1: # Min length for app name
+        return None
+    if open_application(app_name):
+        dialogue.remember("app", app_name)
+        return f"{ACTION_STATUS_PREFIX} Application '{app_name}' launch initiated."
+    return f"{ACTION_STATUS_PREFIX} Failed to launch application '{app_name}'. It might not be installed or the name is incorrect."
+
+def handle_close_app_intent(match, text, dialogue):
+    app_name = match.group(2).strip().replace(" application", "").replace(" app", "").strip()
+    app_name = dialogue.resolve(app_name, "app") # "close it": the app last referred to
+    if not app_name: return None # Nothing referred to yet; let the model ask which app
+    filter_words = ["tab", "window", "current tab", "this tab", "the tab", "me", "this", "the session",
+                    "program", "the", "a", "my", "timer", "note"]
+    if app_name.lower() in filter_words or len(app_name) <= 1:
+        return None
+    success, message = close_application(app_name)
+    if success: dialogue.remember("app", app_name)
+    return f"{ACTION_STATUS_PREFIX} {message}" # message from close_application is already descriptive
+
+def handle_media_playpause_intent(match, text, dialogue):
+    if not ((any(kw in text for kw in ["music", "song", "track", "sound", "audio", "video", "media", "playback"])) or \
+            (text in ["play", "pause", "resume"] and dialogue.recently("media"))): # context
+        return None
+    success, message = control_media('playpause')
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Media Control Error: {message}"
+
+def handle_media_next_intent(match, text, dialogue):
+    if not ((any(kw in text for kw in ["song", "track", "media"])) or \
+            (text == "next" and dialogue.recently("media"))):
+        return None
+    success, message = control_media('next')
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Media Control Error: {message}"
+
+def handle_media_previous_intent(match, text, dialogue):
+    if not any(kw in text for kw in ["song", "track", "media"]):
+        return None
+    success, message = control_media('previous')
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Media Control Error: {message}"
+
+def handle_media_stop_intent(match, text, dialogue):
+    if not any(kw in text for kw in ["music", "playback", "media", "song", "video", "sound", "audio"]):
+        return None
+    success, message = control_media('stop')
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Media Control Error: {message}"
+
+def handle_volume_level_intent(match, text, dialogue):
+    level = int(match.group(2))
+    success, message = change_volume(level)
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Volume Control Error: {message}"
+
+def handle_volume_up_intent(match, text, dialogue):
+    if not any(kw in text for kw in ["volume up", "increase volume", "louder", "turn it up", "raise volume"]):
+        return None
+    success, message = change_volume("up")
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Volume Control Error: {message}"
+
+def handle_volume_down_intent(match, text, dialogue):
+    if not any(kw in text for kw in ["volume down", "decrease volume", "quieter", "softer", "turn it down", "lower volume"]):
+        return None
+    success, message = change_volume("down")
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Volume Control Error: {message}"
+
+def handle_mute_intent(match, text, dialogue):
+    if not ('volume' in text or 'sound' in text or 'audio' in text or len(text.split()) < 3):
+        return None
+    success, message = change_volume("mute")
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Volume Control Error: {message}"
+
+def handle_focus_window_intent(match, text, dialogue):
+    target_keyword = dialogue.resolve(match.group(2).strip(), "app") or match.group(2).strip() # "switch to it"
+    if target_keyword.lower() in ["me", "this", "here"]: # Avoid self-referential focus
+        return None
+    success, message = focus_window(target_keyword)
+    if success: dialogue.remember("app", target_keyword)
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Window Focus Error: {message}"
+
+def handle_close_tab_intent(match, text, dialogue):
+    if not any(kw in text for kw in ["close tab", "close current tab", "close this tab"]):
+        return None
+    success, message = close_current_tab()
+    return f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Tab Closing Error: {message}"
+
+def handle_help_intent(match, text, dialogue):
+    if text not in ["help", "list commands", "show commands", "what can you do", "commands"]:
+        return None
+    print_help_to_console() # Display in console for now
+    return f"{ACTION_STATUS_PREFIX} Help information has been displayed in the console."
+
+# Registration order is match priority (e.g. URL opening before general search, search before apps).
+register_intent("gui", [r'\b(open gui|launch interface|show gui|graphical mode|start interface)\b'],
+                ["open gui", "launch interface", "show gui", "graphical mode", "start interface"], handle_gui_intent)
+# Timer Commands (more flexible matching); second pattern is the simpler "timer 5 minutes for pizza"
+register_intent("set_timer", [r'\b(set|start|create|new)\s+(?:a\s+)?timer\s+(?:for\s+|of\s+)?([\w\s\d.,:"\'-]+?)(?:\s+(?:called|named|for|regarding)\s*["\']?(.+?)["\']?)?$',
+                              r'^(timer)\s+([\w\s\d.,:"\'-]+?)(?:\s+(?:called|named|for|regarding)\s*["\']?(.+?)["\']?)?$'],
+                ["timer"], handle_set_timer_intent, re.IGNORECASE)
+register_intent("cancel_timer", [r'\b(cancel|stop|delete|remove)\s+(?:the\s+)?timer(?:\s+(?:for|called|named|with id|id)\s*["\']?(.+?)["\']?)?$',
+                                 r'^(cancel|delete|remove)\s+(it|that|this|that one|this one)$'], # Only while talking about timers
+                ["timer", "cancel", "delete", "remove"], handle_cancel_timer_intent, re.IGNORECASE)
+register_intent("cancel_all_timers", [r'\b(cancel all timers|stop all timers|clear all timers)\b'],
+                ["all timers"], handle_cancel_all_timers_intent, re.IGNORECASE)
+register_intent("calculate", [r'\b(what is|calculate|compute|evaluate|maths?|calc)\s+(.+)'],
+                ["what is", "calc", "compute", "evaluate", "math"], handle_calculate_intent, re.IGNORECASE)
+register_intent("convert_units", [r'^convert\s+(.+?)\s*\??$', r'^([\d.][\d.,\s+\-*/()]*\s*[a-z°/]+[a-z0-9]?\s+(?:to|in|into)\s+[a-z°/]+[a-z0-9]?)\s*\??$'],
+                ["convert", " to ", " in ", " into "], handle_convert_units_intent)
+register_intent("weather", [r'\b(?:what.s\s+the\s+weather|weather\s+(?:in|for|like\s+in)|how.s\s+the\s+weather\s+(?:in|for))\s+([\w\s,-]+)\b'],
+                ["weather"], handle_weather_intent, re.IGNORECASE)
+# Fun Commands
+register_intent("roll_dice", [r'\b(roll a dice|roll dice|dice roll)\b'], ["dice"], handle_roll_dice_intent)
+register_intent("flip_coin", [r'\b(flip a coin|coin flip|heads or tails)\b'], ["coin", "heads or tails"], handle_flip_coin_intent)
+register_intent("joke", [r'\b(tell me a joke|joke|make me laugh|say something funny|another joke)\b'],
+                ["joke", "make me laugh", "say something funny"], handle_joke_intent)
+register_intent("random_number", [r'\b(?:random number|generate number|pick a number)\s+(?:between\s+)?(-?\d+)\s+(?:and|to)\s+(-?\d+)\b'],
+                ["random number", "generate number", "pick a number"], handle_random_number_intent, re.IGNORECASE)
+# System Info & Control (Advanced)
+register_intent("uptime", [r'\b(system uptime|how long (?:has )?(?:this pc|the system|it) (?:been )?running|pc uptime|server uptime|uptime)\b'],
+                ["uptime", "how long"], handle_uptime_intent, re.IGNORECASE)
+register_intent("empty_recycle_bin", [r'\b(empty recycle bin|empty (?:the )?trash|clear (?:the )?trash)\b'],
+                ["empty recycle bin", "trash"], handle_empty_recycle_bin_intent, re.IGNORECASE)
+register_intent("lock_screen", [r'\b(lock screen|lock (?:my|the) (?:computer|pc|system)|secure screen)\b'],
+                ["lock ", "secure screen"], handle_lock_screen_intent, re.IGNORECASE)
+register_intent("power", [r'\b(shutdown|restart|reboot|log off|logout|sign out)\b(?:\s+(?:my|the)?\s*(?:computer|pc|system|session|now))?'],
+                ["shutdown", "restart", "reboot", "log off", "logout", "sign out"], handle_power_intent, re.IGNORECASE)
+register_intent("datetime", [r'\b(what time is it|current time|date and time|today.s date|tell me the date|tell me the time)\b'],
+                ["time", "date"], handle_datetime_intent)
+register_intent("stats_average", [r'\b(?:average|avg|mean)\s+(?P<metric>cpu|processor|ram|memory|disk|network|net)\b(?:\s+(?:usage|load|use))?(?:\s+(?:over|for|in|during|across)\s+(?:the\s+)?(?:last|past)\s+(?P<amount>\d+|an?|one)?\s*(?P<unit>seconds?|secs?|minutes?|mins?|hours?|hrs?))?',
+                                  r'\b(?P<metric>cpu|processor|ram|memory|disk|network|net)\s+(?:usage\s+|load\s+)?(?:average|avg)\b(?:\s+(?:usage|load|use))?(?:\s+(?:over|for|in|during|across)\s+(?:the\s+)?(?:last|past)\s+(?P<amount>\d+|an?|one)?\s*(?P<unit>seconds?|secs?|minutes?|mins?|hours?|hrs?))?'],
+                ["average", "avg", "mean"], handle_stats_average_intent, re.IGNORECASE)
+register_intent("top_processes", [r'\btop\s+(?:(?P<count>\d+)\s+)?(?:processes|apps|applications|programs|tasks)\b(?:\s+(?:by|using|for)\s+(?:the\s+most\s+)?(?P<metric>cpu|processor|ram|memory))?',
+                                  r'\b(?:which|what)\s+(?:processes|apps|programs)\s+(?:are\s+)?(?:using|use|eating|hogging)\s+(?:the\s+)?(?:most\s+)?(?P<metric>cpu|processor|ram|memory)'],
+                ["top", "processes", "apps", "programs"], handle_top_processes_intent, re.IGNORECASE)
+register_intent("system_stats", [r'\b(system status|pc status|system stats|cpu usage|ram usage|performance|system load)\b'],
+                ["status", "stats", "usage", "performance", "system load"], handle_system_stats_intent)
+register_intent("internet_check", [r'\b(check internet|internet connection|am i online|are we connected|internet status)\b'],
+                ["internet", "am i online", "are we connected"], handle_internet_check_intent)
+register_intent("context_stats", [r'\b(context stats|prompt stats|token usage|context usage)\b'],
+                ["context stats", "prompt stats", "token usage", "context usage"], handle_context_stats_intent)
+# File/Directory Operations
+register_intent("list_directory", [r'\b(?:list files|show files|directory contents|ls|dir)\s*(?:in|of\s+)?(["\']?[\w\s\/\.:\-\\~*?]+["\']?)?'],
+                ["list files", "show files", "ls", "dir"], handle_list_directory_intent, re.IGNORECASE)
+register_intent("list_directory_next", [r'^(?:show\s+)?(?:the\s+)?next\s+(?P<count>\d+)(?:\s+(?:files|items|entries))?$',
+                                        r'^(?:show\s+)?(?:the\s+)?(?:next page|more files|more items|more entries)$'],
+                ["next", "more"], handle_list_directory_next_intent)
+register_intent("create_directory", [r'\b(?:create directory|make directory|mkdir|new folder)\s+(["\']?[\w\s\/\.:\-\\]+["\']?)'],
+                ["directory", "mkdir", "new folder"], handle_create_directory_intent, re.IGNORECASE)
+register_intent("open_file", [r'\b(?:open file|show file|edit file|view file|launch file)\s+(["\']?[\w\s\/\.:\-\\]+["\']?)'],
+                ["file"], handle_open_file_intent, re.IGNORECASE)
+register_intent("find_file", [r'\b(?:find|locate|search for|where is|where.s)\s+(?:the\s+|my\s+)?(?:files?|documents?)\s+(?:named\s+|called\s+)?(.+?)(?:\s+in\s+(?:my\s+|the\s+)?([\w\/\.:~\-\\]+))?$'],
+                ["file", "document"], handle_find_file_intent, re.IGNORECASE)
+register_intent("open_latest_file", [r'\b(?:open|show|launch|view)\s+(?:the\s+|my\s+)?(?:latest|newest|most recent|last)\s+(\w+?)(?:\s+files?)?(?:\s+(?:in|from)\s+(?:my\s+|the\s+)?([\w\/\.:~\-\\]+))?$'],
+                ["latest", "newest", "most recent", "last"], handle_open_latest_file_intent, re.IGNORECASE)
+# Notes
+register_intent("take_note", [r'\b(?:take a note|make a note|note down|remember this|add note|note that|remember that)\s*[:\s]\s*(.+)'],
+                ["note", "remember this", "remember that"], handle_take_note_intent, re.IGNORECASE)
+register_intent("tagged_notes", [r'\bnotes?\s+(?:tagged|with (?:the )?tag)\s+#?(\w+)', r'\b(?:show|list|find|view)\s+(?:my\s+)?#(\w+)\s+notes\b'],
+                ["note"], handle_tagged_notes_intent, re.IGNORECASE)
+register_intent("search_notes", [r'\b(?:find|search|search for|look up|look for)\s+(?:my\s+|the\s+|any\s+)?notes?\s+(?:about|for|on|mentioning|containing|with|that mention)\s+(.+)',
+                                 r'\b(?:show|list|view|read)\s+(?:my\s+|the\s+)?notes?\s+(?:about|on|mentioning|containing)\s+(.+)'],
+                ["note"], handle_search_notes_intent, re.IGNORECASE)
+register_intent("recent_notes", [r'\b(?:last|latest|recent|newest|most recent)\s+(?:(\d+)\s+)?notes?\b'],
+                ["note"], handle_recent_notes_intent, re.IGNORECASE)
+register_intent("view_notes", [r'\b(show notes|view notes|what are my notes|read my notes|list notes)\b'],
+                ["notes"], handle_view_notes_intent, re.IGNORECASE)
+register_intent("clear_notes", [r'\b(clear notes|delete all notes|forget notes|erase notes|remove all notes)\b'],
+                ["notes"], handle_clear_notes_intent, re.IGNORECASE)
+# Clipboard; second pattern handles copy "text" or copy 'text'
+register_intent("copy", [r'\b(?:copy to clipboard|copy this|copy)\s*[:\s]\s*(.+)', r"\bcopy\s+(['\"])(.+?)\1"],
+                ["copy"], handle_copy_intent, re.IGNORECASE)
+register_intent("read_clipboard", [r'\b(paste from clipboard|what.s on the clipboard|get clipboard|show clipboard|read clipboard)\b'],
+                ["clipboard"], handle_read_clipboard_intent, re.IGNORECASE)
+# Type Text; 'stop typing' first so it never reaches the type pattern
+register_intent("cancel_typing", [r'\b(stop|cancel|abort|quit)\s+(?:the\s+)?typing\b'],
+                ["typing"], handle_cancel_typing_intent, re.IGNORECASE)
+register_intent("type_text", [r'\b(?:type this|type out|enter text|type)\s*[:\s]\s*(.+)', r"\btype\s+(['\"])(.+?)\1"],
+                ["type", "enter text"], handle_type_text_intent, re.IGNORECASE)
+# Web Search & URL Opening (Order matters: URL check before general search)
+register_intent("open_url", [r'\b(open|launch|go to|visit|show me)\s+((?:https?:\/\/)?[\w\d\-_]+(?:\.[\w\d\-_]+)+(?:[\/\?#][^\s]*)?)'],
+                ["open", "launch", "go to", "visit", "show me"], handle_open_url_intent, re.IGNORECASE)
+register_intent("web_search", [r'\b(search|find|google|look up|what is|who is|tell me about|search for)\s+(?:for\s+)?(.+)'],
+                ["search", "find", "google", "look up", "what is", "who is", "tell me about"], handle_web_search_intent, re.IGNORECASE)
+# Application Control (Open/Close) - specific names; second pattern is the broader "open chrome browser"
+register_intent("open_app", [r'\b(open|launch|start)\s+(?:app(?:lication)?\s+)?([\w\s().-]+?)(?:\s+app(?:lication)?)?$',
+                             r'\b(open|launch|start)\s+([\w\s().-]+)'],
+                ["open", "launch", "start"], handle_open_app_intent, re.IGNORECASE)
+register_intent("close_app", [r'\b(close|quit|exit|terminate|kill)\s+(?:app(?:lication)?\s+)?([\w\s().-]+?)(?:\s+app(?:lication)?)?$',
+                              r'\b(close|quit|exit|terminate|kill)\s+([\w\s().-]+)'],
+                ["close", "quit", "exit", "terminate", "kill"], handle_close_app_intent, re.IGNORECASE)
+# Media Controls (keyword checks live in the handlers)
+register_intent("media_playpause", [], ["play", "pause", "resume"], handle_media_playpause_intent)
+register_intent("media_next", [], ["next", "skip"], handle_media_next_intent)
+register_intent("media_previous", [], ["previous", "last", "back"], handle_media_previous_intent)
+register_intent("media_stop", [], ["stop"], handle_media_stop_intent)
+# Volume Control
+register_intent("volume_level", [r'(set\s+)?volume\s+(?:to\s+|level\s+)?(\d{1,3})(?:%|\spercent)?'],
+                ["volume"], handle_volume_level_intent, re.IGNORECASE)
+register_intent("volume_up", [], ["volume up", "increase volume", "louder", "turn it up", "raise volume"], handle_volume_up_intent)
+register_intent("volume_down", [], ["volume down", "decrease volume", "quieter", "softer", "turn it down", "lower volume"], handle_volume_down_intent)
+register_intent("mute", [r'\b(mute|unmute)\b'], ["mute"], handle_mute_intent, re.IGNORECASE)
+# Window Focusing
+register_intent("focus_window", [r'\b(focus on|switch to|bring to front|activate window|focus)\s+([\w\s\.:-]+)'],
+                ["focus", "switch to", "bring to front", "activate window"], handle_focus_window_intent, re.IGNORECASE)
+# Tab Closing
+register_intent("close_tab", [], ["close tab", "close current tab", "close this tab"], handle_close_tab_intent)
+# Help
+register_intent("help", [], ["help", "list commands", "show commands", "what can you do", "commands"], handle_help_intent)
+build_intent_router()
+
+# --- Dialogue State ---
+# Words that put a message into a domain (substring match on the lowercased text)
+DIALOGUE_DOMAIN_KEYWORDS = {"media": ("music", "song"), "timers": ("timer",), "files": ("file", "folder", "directory")}
+# Intents that put the conversation into a domain when they run
+DIALOGUE_INTENT_DOMAINS = {
+    "media_playpause": "media", "media_next": "media", "media_previous": "media", "media_stop": "media",
+    "volume_level": "media", "volume_up": "media", "volume_down": "media", "mute": "media",
+    "set_timer": "timers", "cancel_timer": "timers", "cancel_all_timers": "timers",
+    "list_directory": "files", "list_directory_next": "files", "create_directory": "files",
+    "open_file": "files", "find_file": "files", "open_latest_file": "files",
+    "open_app": "apps", "close_app": "apps", "focus_window": "apps",
+}
+DIALOGUE_REFERENCE_WORDS = {"it", "that", "this", "that one", "this one"} # "close it", "cancel that", ...
+DIALOGUE_CONFIRMATION_MARKER = re.compile(r'CONFIRMATION_REQUIRED_FOR_(\w+):')
+
+class DialogueState:
+    # What the conversation is currently about, updated message by message so routing never rescans
+    # the history: the pending recycle-bin/power confirmation (valid for the next input only, and for
+    # at most DIALOGUE_CONFIRMATION_TIMEOUT_SECONDS), the message number at which each domain (media,
+    # timers, files, apps) was last mentioned or used, and the app, file and timer last referred to.
+    # add_to_conversation_history() feeds it every message (observe), route_command() every routed intent (note_route).
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.message_count = 0
+        self.domain_seen = {} # domain -> message_count when last mentioned or used
+        self.references = {} # "app" / "file" / "timer" -> last referred-to value
+        self.pending = None # {"kind": "empty_recycle_bin" | "power", "action", "expires_at"}
+
+    def observe(self, role, text):
+        lowered = text.lower()
+        with self.lock:
+            self.message_count += 1
+            for domain, keywords in DIALOGUE_DOMAIN_KEYWORDS.items():
+                if any(keyword in lowered for keyword in keywords): self.domain_seen[domain] = self.message_count
+
+    def note_route(self, intent_name, action_status):
+        domain = DIALOGUE_INTENT_DOMAINS.get(intent_name)
+        if domain:
+            with self.lock: self.domain_seen[domain] = self.message_count
+        self.note_status(action_status)
+
+    def note_status(self, action_status):
+        marker = DIALOGUE_CONFIRMATION_MARKER.search(action_status or "")
+        if not marker: return
+        kind = marker.group(1).lower()
+        pending = {"kind": "empty_recycle_bin" if kind == "empty_recycle_bin" else "power", "action": kind,
+                   "expires_at": time.monotonic() + DIALOGUE_CONFIRMATION_TIMEOUT_SECONDS}
+        with self.lock: self.pending = pending
+
+    def take_pending(self):
+        # The pending confirmation, if still valid; either way it is used up by this input
+        with self.lock:
+            pending, self.pending = self.pending, None
+        return pending if pending and time.monotonic() < pending["expires_at"] else None
+
+    def recently(self, domain):
+        with self.lock:
+            seen = self.domain_seen.get(domain)
+            return seen is not None and self.message_count - seen < DIALOGUE_CONTEXT_MESSAGES
+
+    def active_domain(self):
+        # The most recently touched domain that is still within DIALOGUE_CONTEXT_MESSAGES, or None
+        with self.lock:
+            if not self.domain_seen: return None
+            domain, seen = max(self.domain_seen.items(), key=lambda item: item[1])
+            return domain if self.message_count - seen < DIALOGUE_CONTEXT_MESSAGES else None
+
+    def remember(self, kind, value):
+        with self.lock: self.references[kind] = value
+
+    def resolve(self, name, kind):
+        # The last referred-to `kind` when name is "it", "that", ...; name itself otherwise (None if nothing was referred to yet)
+        if name.lower() not in DIALOGUE_REFERENCE_WORDS: return name
+        with self.lock: return self.references.get(kind)
+
+dialogue_state = DialogueState()
+
+def answer_confirmation(pending, text):
+    # (intent_name, action_status) when text answers the pending confirmation, None otherwise
+    if pending["kind"] == "empty_recycle_bin":
+        if "yes, empty it" in text or "confirm empty recycle bin" in text or text == "yes":
             result, message = empty_recycle_bin_action(confirmation_expected=True)
-            action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if result else f"{ACTION_STATUS_PREFIX} Recycle Bin Operation Failed: {message}"
-            return action_status_message
-        elif text == "no" or "cancel" in text:
-            return f"{ACTION_STATUS_PREFIX} Recycle bin operation cancelled by user."
-
-    # System Power Action Confirmation
-    power_action_match = re.search(r'wish to (shutdown|restart|logout) the computer', last_jarvis_response)
-    if power_action_match:
-        action_to_confirm = power_action_match.group(1)
-        if (f"yes, {action_to_confirm}" in text or f"confirm {action_to_confirm}" in text or \
-            (text == "yes" and action_to_confirm in last_jarvis_response.lower())):
-            result, message = system_power_action(action_to_confirm, confirmation_expected=True)
-            action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if result else f"{ACTION_STATUS_PREFIX} System {action_to_confirm.capitalize()} Failed: {message}"
-            return action_status_message
-        elif text == "no" or "cancel" in text:
-            return f"{ACTION_STATUS_PREFIX} System {action_to_confirm} cancelled by user."
-
-    # GUI Command
-    if re.search(r'\b(open gui|launch interface|show gui|graphical mode|start interface)\b', text):
-        # This command will be handled in the main loop to transition to GUI mode
-        return f"{ACTION_STATUS_PREFIX} GUI_LAUNCH_REQUESTED"
-
-
-    # Timer Commands (more flexible matching)
-    set_timer_match = re.search(r'\b(set|start|create|new)\s+(?:a\s+)?timer\s+(?:for\s+|of\s+)?([\w\s\d.,:"\'-]+?)(?:\s+(?:called|named|for|regarding)\s*["\']?(.+?)["\']?)?$', text, re.IGNORECASE)
-    if not set_timer_match: # Simpler "timer 5 minutes for pizza"
-        set_timer_match = re.search(r'^(timer)\s+([\w\s\d.,:"\'-]+?)(?:\s+(?:called|named|for|regarding)\s*["\']?(.+?)["\']?)?$', text, re.IGNORECASE)
-
-    if set_timer_match:
-        duration_part = set_timer_match.group(2).strip()
-        description_part = set_timer_match.group(3).strip().strip("'\"") if set_timer_match.group(3) else "your task"
-        
-        # Try to extract description if it's embedded in duration_part
-        # e.g., "timer 5 minutes for cookies"
-        potential_desc_match = re.match(r'(.+?)\s+(?:for|called|named|regarding)\s+["\']?(.+?)["\']?$', duration_part, re.IGNORECASE)
-        if potential_desc_match:
-            duration_actual = potential_desc_match.group(1).strip()
-            description_actual = potential_desc_match.group(2).strip().strip("'\"")
-            if description_part == "your task" or not description_part : description_part = description_actual # Prefer explicit one if available
-            duration_part = duration_actual
-        
-        success, message = set_jarvis_timer_action(duration_part, description_part)
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Timer Error: {message}"
-        return action_status_message
-
-    cancel_timer_match = re.search(r'\b(cancel|stop|delete|remove)\s+(?:the\s+)?timer(?:\s+(?:for|called|named|with id|id)\s*["\']?(.+?)["\']?)?$', text, re.IGNORECASE)
-    if cancel_timer_match:
-        desc_or_id = cancel_timer_match.group(2).strip().strip("'\"") if cancel_timer_match.group(2) else None
-        success, message = cancel_jarvis_timer_action(desc_or_id)
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Cancel Timer Error: {message}"
-        return action_status_message
-
-    if re.search(r'\b(cancel all timers|stop all timers|clear all timers)\b', text, re.IGNORECASE):
-        success, message = cancel_all_jarvis_timers_action()
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Cancel All Timers Error: {message}"
-        return action_status_message
-
-    # Calculator
-    calc_match = re.search(r'\b(what is|calculate|compute|evaluate|maths?|calc)\s+(.+)', text, re.IGNORECASE)
-    if calc_match:
-        expression = calc_match.group(2).strip()
-        # Avoid triggering calculator for phrases like "what is the time"
-        if not any(kw in expression.lower() for kw in ["time", "date", "weather", "system status", "cpu", "ram", "uptime", "my name", "your name", "note", "file", "folder"]):
-            success, message = calculate_action(expression) # Pass original expression for better message
-            action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Calculation Error: {message}"
-            return action_status_message
-
-    # Weather
-    weather_match = re.search(r'\b(?:what.s\s+the\s+weather|weather\s+(?:in|for|like\s+in)|how.s\s+the\s+weather\s+(?:in|for))\s+([\w\s,-]+)\b', text, re.IGNORECASE)
-    if weather_match:
-        location = weather_match.group(1).strip().replace("like in", "").replace("like for", "").strip()
-        if location:
-            success, message = get_weather_action(location)
-            action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Weather Access Error: {message}"
-            return action_status_message
-
-    # Fun Commands
-    if re.search(r'\b(roll a dice|roll dice|dice roll)\b', text):
-        success, message = roll_dice_action(); action_status_message = f"{ACTION_STATUS_PREFIX} {message}"; return action_status_message
-    if re.search(r'\b(flip a coin|coin flip|heads or tails)\b', text):
-        success, message = flip_coin_action(); action_status_message = f"{ACTION_STATUS_PREFIX} {message}"; return action_status_message
-    if re.search(r'\b(tell me a joke|joke|make me laugh|say something funny|another joke)\b', text):
-        success, message = get_joke_action(); action_status_message = f"{ACTION_STATUS_PREFIX} {message}"; return action_status_message
-    
-    rand_num_match = re.search(r'\b(?:random number|generate number|pick a number)\s+(?:between\s+)?(-?\d+)\s+(?:and|to)\s+(-?\d+)\b', text, re.IGNORECASE)
-    if rand_num_match:
-        min_val, max_val = rand_num_match.group(1), rand_num_match.group(2)
-        success, message = generate_random_number_action(min_val, max_val)
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Random Number Generation Error: {message}"
-        return action_status_message
-    
-    # System Info & Control (Advanced)
-    if re.search(r'\b(system uptime|how long (?:has )?(?:this pc|the system|it) (?:been )?running|pc uptime|server uptime|uptime)\b', text, re.IGNORECASE):
-        success, message = get_system_uptime_action()
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Uptime Inquiry Error: {message}"
-        return action_status_message
-
-    if re.search(r'\b(empty recycle bin|empty (?:the )?trash|clear (?:the )?trash)\b', text, re.IGNORECASE):
-        result, message = empty_recycle_bin_action(confirmation_expected=False) # Will return "CONFIRMATION_NEEDED" or (bool, msg)
-        if result == "CONFIRMATION_NEEDED":
-            action_status_message = f"{ACTION_STATUS_PREFIX} CONFIRMATION_REQUIRED_FOR_EMPTY_RECYCLE_BIN: {message}"
-        elif isinstance(result, bool) and result: # Success
-            action_status_message = f"{ACTION_STATUS_PREFIX} {message}"
-        else: # Failure
-            action_status_message = f"{ACTION_STATUS_PREFIX} Recycle Bin Operation Error: {message}"
-        return action_status_message
-
-    if re.search(r'\b(lock screen|lock (?:my|the) (?:computer|pc|system)|secure screen)\b', text, re.IGNORECASE):
-        success, message = lock_screen_action()
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Screen Lock Error: {message}"
-        return action_status_message
-
-    power_op_match = re.search(r'\b(shutdown|restart|reboot|log off|logout|sign out)\b(?:\s+(?:my|the)?\s*(?:computer|pc|system|session|now))?', text, re.IGNORECASE)
-    if power_op_match:
-        action_word = power_op_match.group(1).lower()
-        action_type = "logout" if action_word in ["log off", "logout", "sign out"] else \
-                      "restart" if action_word in ["restart", "reboot"] else \
-                      "shutdown" if action_word == "shutdown" else None
-        if action_type:
-            result, message = system_power_action(action_type, confirmation_expected=False)
-            if result == "CONFIRMATION_NEEDED":
-                action_status_message = f"{ACTION_STATUS_PREFIX} CONFIRMATION_REQUIRED_FOR_{action_type.upper()}: {message}"
-            elif isinstance(result, bool) and result: # Success
-                action_status_message = f"{ACTION_STATUS_PREFIX} {message}"
-            else: # Failure
-                action_status_message = f"{ACTION_STATUS_PREFIX} System {action_type.capitalize()} Error: {message}"
-            return action_status_message
-
-    # Date/Time
-    if re.search(r'\b(what time is it|current time|date and time|today.s date|tell me the date|tell me the time)\b', text):
-        success, message = get_current_datetime_action()
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Date/Time Inquiry Error: {message}"
-        return action_status_message
-
-    # System Stats
-    if re.search(r'\b(system status|pc status|system stats|cpu usage|ram usage|performance|system load)\b', text):
-        success, message = get_system_stats_action()
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} System Stats Inquiry Error: {message}"
-        return action_status_message
-
-    # Internet Check
-    if re.search(r'\b(check internet|internet connection|am i online|are we connected|internet status)\b', text):
-        success, message = check_internet_connection_action()
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Internet Connection Check Error: {message}"
-        return action_status_message
-
-    # File/Directory Operations
-    list_dir_match = re.search(r'\b(?:list files|show files|directory contents|ls|dir)\s*(?:in|of\s+)?(["\']?[\w\s\/\.:\-\\]+["\']?)?', text, re.IGNORECASE)
-    if list_dir_match:
-        path_to_list = list_dir_match.group(1).strip() if list_dir_match.group(1) else "."
-        success, message = list_directory_contents_action(path_to_list)
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} List Directory Error: {message}"
-        return action_status_message
-
-    create_dir_match = re.search(r'\b(?:create directory|make directory|mkdir|new folder)\s+(["\']?[\w\s\/\.:\-\\]+["\']?)', text, re.IGNORECASE)
-    if create_dir_match:
-        path_to_create = create_dir_match.group(1).strip()
-        success, message = create_directory_action(path_to_create)
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Create Directory Error: {message}"
-        return action_status_message
-
-    open_file_match = re.search(r'\b(?:open file|show file|edit file|view file|launch file)\s+(["\']?[\w\s\/\.:\-\\]+["\']?)', text, re.IGNORECASE)
-    if open_file_match:
-        filepath_to_open = open_file_match.group(1).strip().strip("'\"")
-        success, message = open_file_with_default_app_action(filepath_to_open)
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Open File Error: {message}"
-        return action_status_message
+            return "confirm_empty_recycle_bin", f"{ACTION_STATUS_PREFIX} {message}" if result else f"{ACTION_STATUS_PREFIX} Recycle Bin Operation Failed: {message}"
+        if text == "no" or "cancel" in text:
+            return "confirm_empty_recycle_bin", f"{ACTION_STATUS_PREFIX} Recycle bin operation cancelled by user."
+        return None
+    action_to_confirm = pending["action"]
+    if f"yes, {action_to_confirm}" in text or f"confirm {action_to_confirm}" in text or text == "yes":
+        result, message = system_power_action(action_to_confirm, confirmation_expected=True)
+        return "confirm_power", f"{ACTION_STATUS_PREFIX} {message}" if result else f"{ACTION_STATUS_PREFIX} System {action_to_confirm.capitalize()} Failed: {message}"
+    if text == "no" or "cancel" in text:
+        return "confirm_power", f"{ACTION_STATUS_PREFIX} System {action_to_confirm} cancelled by user."
+    return None
+
+def route_command(user_input_raw, dialogue=None):
+    # Returns (intent_name, action_status); intent_name is None when nothing matched.
+    # `dialogue` is read and updated by routing (a fresh DialogueState when not given).
+    text = user_input_raw.lower().strip()
+    if dialogue is None: dialogue = DialogueState()
 
-    # Notes
-    take_note_match = re.search(r'\b(?:take a note|make a note|note down|remember this|add note|note that|remember that)\s*[:\s]\s*(.+)', text, re.IGNORECASE)
-    if take_note_match:
-        note = take_note_match.group(1).strip()
-        if note: # Ensure there's content for the note
-            success, message = take_note_action(note)
-            action_status_message = f"{ACTION_STATUS_PREFIX} {message}"
-            return action_status_message
-
-    if re.search(r'\b(show notes|view notes|what are my notes|read my notes|list notes)\b', text, re.IGNORECASE):
-        success, message = view_notes_action()
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}"
-        return action_status_message
-
-    if re.search(r'\b(clear notes|delete all notes|forget notes|erase notes|remove all notes)\b', text, re.IGNORECASE):
-        success, message = clear_notes_action()
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}"
-        return action_status_message
-
-    # Clipboard
-    copy_match = re.search(r'\b(?:copy to clipboard|copy this|copy)\s*[:\s]\s*(.+)', text, re.IGNORECASE) or \
-                 re.search(r"\bcopy\s+(['\"])(.+?)\1", text, re.IGNORECASE) # copy "text" or copy 'text'
-    if copy_match:
-        text_to_copy = copy_match.group(1) if len(copy_match.groups()) == 1 else copy_match.group(2)
-        text_to_copy = text_to_copy.strip()
-        if text_to_copy:
-            success, message = copy_to_clipboard_action(text_to_copy)
-            action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Clipboard Copy Error: {message}"
-            return action_status_message
-
-    if re.search(r'\b(paste from clipboard|what.s on the clipboard|get clipboard|show clipboard|read clipboard)\b', text, re.IGNORECASE):
-        success, message = get_clipboard_content_action()
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Clipboard Read Error: {message}"
-        return action_status_message
-
-    # Type Text
-    type_text_match = re.search(r'\b(?:type this|type out|enter text|type)\s*[:\s]\s*(.+)', text, re.IGNORECASE) or \
-                      re.search(r"\btype\s+(['\"])(.+?)\1", text, re.IGNORECASE)
-    if type_text_match:
-        text_to_type = type_text_match.group(1) if len(type_text_match.groups()) == 1 else type_text_match.group(2)
-        # Don't strip here, preserve original spacing for typing
-        if text_to_type: # Check if there's actually something to type
-            success, message = type_text_action(text_to_type)
-            action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Typing Operation Error: {message}"
-            return action_status_message
-
-    # Web Search & URL Opening (Order matters: URL check before general search)
-    url_match = re.search(r'\b(open|launch|go to|visit|show me)\s+((?:https?:\/\/)?[\w\d\-_]+(?:\.[\w\d\-_]+)+(?:[\/\?#][^\s]*)?)', text, re.IGNORECASE)
-    if url_match:
-        url_to_open = url_match.group(2)
-        # Basic validation that it looks like a URL structure, not just "open settings"
-        if "." in url_to_open and not url_to_open.lower().endswith((".txt", ".doc", ".pdf")): # Avoid mistaking filenames for URLs
-            success, message = open_url_in_browser(url_to_open)
-            action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} URL Opening Error: {message}"
-            return action_status_message
-
-    search_match = re.search(r'\b(search|find|google|look up|what is|who is|tell me about|search for)\s+(?:for\s+)?(.+)', text, re.IGNORECASE)
-    if search_match:
-        query = search_match.group(2).strip()
-        # Avoid searching if it's clearly an internal command keyword
-        internal_command_keywords = [
-            "open", "launch", "close", "quit", "list", "create", "copy", "paste", "type", "timer",
-            "calculate", "weather", "roll", "flip", "joke", "uptime", "lock", "shutdown", "restart", "logout",
-            "note", "clipboard", "volume", "gui", "interface", "help", "time", "date", "stats", "internet"
-        ]
-        query_first_word = query.split(' ')[0].lower()
-        if query_first_word not in internal_command_keywords and len(query) > 2 : # Simple check
-            success, message = perform_web_search(query)
-            action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Web Search Error: {message}"
-            return action_status_message
-
-
-    # Application Control (Open/Close) - specific names
-    open_app_match = re.search(r'\b(open|launch|start)\s+(?:app(?:lication)?\s+)?([\w\s().-]+?)(?:\s+app(?:lication)?)?$', text, re.IGNORECASE)
-    if not open_app_match: # Broader match: "open chrome browser"
-        open_app_match = re.search(r'\b(open|launch|start)\s+([\w\s().-]+)', text, re.IGNORECASE)
-    if open_app_match:
-        app_name = open_app_match.group(2).strip().replace(" application", "").replace(" app", "").strip()
-        # Filter out common words that are not app names
-        filter_words = ["website", "url", "link", "tab", "window", "file", "document", "folder", "directory",
-                        "the", "a", "an", "my", "some", "for", "me", "current", "this", "that", "page",
-                        "timer", "note", "calculator", "settings", "preferences", "gui", "interface"]
-        if app_name.lower() not in filter_words and len(app_name) > 1: # Min length for app name
-            if open_application(app_name):
-                action_status_message = f"{ACTION_STATUS_PREFIX} Application '{app_name}' launch initiated."
-            else:
-                action_status_message = f"{ACTION_STATUS_PREFIX} Failed to launch application '{app_name}'. It might not be installed or the name is incorrect."
-            return action_status_message
-
-    close_app_match = re.search(r'\b(close|quit|exit|terminate|kill)\s+(?:app(?:lication)?\s+)?([\w\s().-]+?)(?:\s+app(?:lication)?)?$', text, re.IGNORECASE)
-    if not close_app_match:
-         close_app_match = re.search(r'\b(close|quit|exit|terminate|kill)\s+([\w\s().-]+)', text, re.IGNORECASE)
-    if close_app_match:
-        app_name = close_app_match.group(2).strip().replace(" application", "").replace(" app", "").strip()
-        filter_words = ["tab", "window", "current tab", "this tab", "the tab", "me", "this", "the session",
-                        "program", "the", "a", "my", "timer", "note"]
-        if app_name.lower() not in filter_words and len(app_name) > 1:
-            success, message = close_application(app_name)
-            action_status_message = f"{ACTION_STATUS_PREFIX} {message}" # message from close_application is already descriptive
-            return action_status_message
-
-    # Media Controls
-    if (any(kw in text for kw in ["play", "pause", "resume"]) and \
-       any(kw in text for kw in ["music", "song", "track", "sound", "audio", "video", "media", "playback"])) or \
-       (text in ["play", "pause", "resume"] and "music" in str(current_conversation_history_for_command[-MAX_HISTORY_TURNS*2:]).lower()): # context
-        success, message = control_media('playpause')
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Media Control Error: {message}"
-        return action_status_message
-
-    if (any(kw in text for kw in ["next", "skip"]) and any(kw in text for kw in ["song", "track", "media"])) or \
-       (text == "next" and ("music" in str(current_conversation_history_for_command[-MAX_HISTORY_TURNS*2:]).lower() or "song" in str(current_conversation_history_for_command[-MAX_HISTORY_TURNS*2:]).lower())):
-        success, message = control_media('next')
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Media Control Error: {message}"
-        return action_status_message
-
-    if (any(kw in text for kw in ["previous", "last", "back"]) and any(kw in text for kw in ["song", "track", "media"])):
-        success, message = control_media('previous')
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Media Control Error: {message}"
-        return action_status_message
-
-    if "stop" in text and any(kw in text for kw in ["music", "playback", "media", "song", "video", "sound", "audio"]):
-        success, message = control_media('stop')
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Media Control Error: {message}"
-        return action_status_message
-
-    # Volume Control
-    volume_level_match = re.search(r'(set\s+)?volume\s+(?:to\s+|level\s+)?(\d{1,3})(?:%|\spercent)?', text, re.IGNORECASE)
-    if volume_level_match:
-        level = int(volume_level_match.group(2))
-        success, message = change_volume(level)
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Volume Control Error: {message}"
-        return action_status_message
-
-    if any(kw in text for kw in ["volume up", "increase volume", "louder", "turn it up", "raise volume"]):
-        success, message = change_volume("up")
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Volume Control Error: {message}"
-        return action_status_message
-    if any(kw in text for kw in ["volume down", "decrease volume", "quieter", "softer", "turn it down", "lower volume"]):
-        success, message = change_volume("down")
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Volume Control Error: {message}"
-        return action_status_message
-    if re.search(r'\b(mute|unmute)\b', text, re.IGNORECASE) and ('volume' in text or 'sound' in text or 'audio' in text or len(text.split()) < 3):
-        success, message = change_volume("mute")
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Volume Control Error: {message}"
-        return action_status_message
-
-    # Window Focusing
-    focus_match = re.search(r'\b(focus on|switch to|bring to front|activate window|focus)\s+([\w\s\.:-]+)', text, re.IGNORECASE)
-    if focus_match:
-        target_keyword = focus_match.group(2).strip()
-        if target_keyword.lower() not in ["me", "this", "here"]: # Avoid self-referential focus
-            success, message = focus_window(target_keyword)
-            action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Window Focus Error: {message}"
-            return action_status_message
-
-    # Tab Closing
-    if any(kw in text for kw in ["close tab", "close current tab", "close this tab"]):
-        success, message = close_current_tab()
-        action_status_message = f"{ACTION_STATUS_PREFIX} {message}" if success else f"{ACTION_STATUS_PREFIX} Tab Closing Error: {message}"
-        return action_status_message
-    
-    # Help
-    if text in ["help", "list commands", "show commands", "what can you do", "commands"]:
-        print_help_to_console() # Display in console for now
-        action_status_message = f"{ACTION_STATUS_PREFIX} Help information has been displayed in the console."
-        return action_status_message
+    # A yes/no to a recycle bin or power confirmation asked for on the previous turn
+    pending = dialogue.take_pending()
+    if pending:
+        answered = answer_confirmation(pending, text)
+        if answered: return answered
 
-    return action_status_message # No specific command matched, LLM will handle as conversation
+    # Everything else goes through the precompiled intent router
+    for route, match in iter_intent_matches(text):
+        action_status_message = route["handler"](match, text, dialogue)
+        if action_status_message is not None:
+            dialogue.note_route(route["name"], action_status_message)
+            return route["name"], action_status_message
 
-def print_help_to_console():
-    help_text = """
+    return None, None # No specific command matched, LLM will handle as conversation
+
+JARVIS_HELP_TEXT = """
 --- Jarvis Command Reference ---
 I strive to understand natural language, but here's a more direct guide to my capabilities:
 
@@ -1600,9 +4501,12 @@ General & System:
   'help', 'what can you do'              - Displays this command reference.
   'exit', 'quit', 'goodbye'              - Ends our current session.
   'what time is it?', 'date and time'    - Provides the current date and time.
-  'system stats', 'cpu usage', 'system load' - Shows current CPU, RAM, and Disk usage.
+  'system stats', 'cpu usage', 'system load' - Shows current CPU, RAM, Disk and network usage.
+  'average cpu over the last 10 minutes' - Average and peak CPU, RAM, disk or network use over a recent span.
+  'top 5 processes by memory'            - Lists the processes using the most memory (or 'by cpu').
   'system uptime', 'how long running'    - Reports how long the system has been active.
   'check internet', 'am I online'        - Verifies internet connectivity.
+  'context stats', 'token usage'         - Reports prompt size, reply latency and history budget use.
   'lock screen', 'secure screen'         - Locks your computer screen.
   'shutdown' / 'restart' / 'logout'      - Initiates system power operations (confirmation required).
   'empty recycle bin' / 'empty trash'    - Clears the recycle bin (confirmation required).
@@ -1612,15 +4516,20 @@ Timers & Productivity:
   'timer 5 minutes for my break'         - Sets an in-chat timer (e.g., "timer 1h 30m Meeting Prep").
   'cancel timer for my break' / 'cancel timer id 3' - Stops a specific timer.
   'cancel all timers'                    - Clears all active timers.
-  'take a note: Remember to buy milk'    - Adds a note to my short-term memory (session-specific).
-  'show notes', 'view my notes'          - Displays all current notes.
+  'take a note: Remember to buy milk'    - Adds a note (saved across sessions; '#tags' in the text are indexed).
+  'show notes', 'show notes page 2'      - Lists your notes, a page at a time.
+  'find notes about taxes'               - Searches your notes (add '#work' to also filter by tag).
+  'notes tagged work'                    - Lists notes containing the hashtag #work.
+  'last 5 notes', 'recent notes'         - Shows your most recent notes.
   'clear notes', 'delete all notes'      - Erases all current notes.
   'copy: This is important text!'        - Copies the provided text to the clipboard.
   'paste from clipboard', 'get clipboard' - Shows the current content of the clipboard.
-  'type: Hello there, world!'            - Types the given text into the currently focused window (after a 2s delay).
+  'type: Hello there, world!'            - Types (or, for long text, pastes) the given text into the window you switch to next.
+  'stop typing'                          - Cancels a 'type' command that is still waiting or typing.
 
 Fun, Information & Calculation:
-  'calculate 15 * (23 + 10) / 2'       - Performs arithmetic calculations.
+  'calculate 15 * (23 + 10) / 2'       - Performs arithmetic calculations (also sqrt, log, sin/cos/tan, factorial, pi, e).
+  'convert 5 km to miles', '100 f to c'  - Converts length, mass, volume, time, speed, data, area and temperature units.
   'weather in London', 'how's the weather in Paris' - Searches for the weather forecast.
   'roll a dice', 'flip a coin'           - For a bit of chance.
   'tell me a joke', 'say something funny'  - I'll try my best to amuse.
@@ -1634,24 +4543,87 @@ Applications, Web, Files & Media:
   'open google.com', 'visit wikipedia.org' - Opens the specified URL in your web browser.
   'search for AI advancements'           - Performs a web search for the given query.
   'list files in Downloads', 'ls Documents' - Shows contents of a directory.
+  'ls Downloads *.pdf largest first'     - Lists a page of matching entries ('by name', 'newest first', 'recursively depth 2').
+  'next 20', 'next page'                 - Continues the last directory listing.
   'create directory MyNewProject'        - Makes a new folder.
-  'open file report.docx', 'view image.jpg' - Opens a file with its default application.
+  'open file report.docx', 'view image.jpg' - Opens a file with its default application (a name alone is looked up in the file index).
+  'find file quarterly report'           - Searches the file index of your Desktop, Documents, Downloads, etc. by name.
+  'open the latest pdf in Downloads'     - Opens the newest file of a kind ('pdf', 'photo', 'file', ...).
   'play music', 'pause media', 'next song', 'previous track', 'stop playback' - Media controls.
   'volume up', 'volume down', 'mute sound', 'set volume to 50%' - Adjusts system volume.
 
 Simply speak or type your request naturally! I'm always learning.
 ---------------------------------------
 """
+
+# --- TEMPLATED REPLIES (LLM fast path) ---
+# Persona-styled wrappers for action results that need no rephrasing; {message} is the action's own text.
+TEMPLATED_REPLIES = {
+    "datetime": ["{message}", "Certainly. {message}", "Right away. {message}"],
+    "calculate": ["{message}", "A trivial computation. {message}", "Done. {message}"],
+    "convert_units": ["{message}", "Converted. {message}"],
+    "flip_coin": ["{message}", "Fortune has spoken. {message}"],
+    "roll_dice": ["{message}", "The die has been cast. {message}"],
+    "random_number": ["{message}", "As requested. {message}"],
+    "set_timer": ["{message}", "{message} I will notify you."],
+    "cancel_timer": ["{message}", "Consider it done. {message}"],
+    "cancel_all_timers": ["{message}", "A clean slate. {message}"],
+    "context_stats": ["{message}", "My working memory, in figures: {message}"],
+    "empty_recycle_bin": ["{message}", "A point of order: {message}"],
+    "power": ["{message}", "A point of order: {message}"],
+    "confirm_empty_recycle_bin": ["{message}", "Very well. {message}"],
+    "confirm_power": ["{message}", "Very well. {message}"],
+}
+TEMPLATED_ERROR_STATUS = re.compile(r'^[\w /-]*(?:Error|Failed):') # e.g. "Calculation Error: <details>"
+DEFERRED_EMBELLISHMENT_REQUEST = "[Your quick reply above has already been delivered. Add at most one brief, relevant remark, without repeating it.]"
+
+def render_templated_reply(intent_name, action_status):
+    # Returns a ready-to-show reply for successful actions of intents in "template" mode, or None when
+    # the LLM should answer. Errors go to the LLM: a failed "what is ..." calculation is often a
+    # question the LLM can still answer.
+    if not action_status or ACTION_REPLY_MODES.get(intent_name, "llm") not in ("template", "template+llm"):
+        return None
+    message = action_status.replace(ACTION_STATUS_PREFIX, "", 1).strip()
+    if TEMPLATED_ERROR_STATUS.match(message): return None
+    message = DIALOGUE_CONFIRMATION_MARKER.sub("", message, count=1).strip() # The user sees only the question
+    return random.choice(TEMPLATED_REPLIES.get(intent_name, ["{message}"])).format(message=message)
+
+def start_deferred_embellishment(intent_name, context_label):
+    # For "template+llm" intents: once the templated reply is committed, ask the LLM for a short
+    # follow-up remark in the background and deliver it as a separate Jarvis message.
+    if ACTION_REPLY_MODES.get(intent_name) != "template+llm":
+        return
+
+    async def embellish():
+        llm_request = build_llm_request(DEFERRED_EMBELLISHMENT_REQUEST, None)
+        remark = await generate_jarvis_reply_async(llm_request, "", context_label=f"{context_label} embellishment")
+        if not remark: return
+        add_to_conversation_history("model", remark)
+        if gui_active_flag and gui_window and gui_window.winfo_exists():
+            gui_window.after(0, display_message_in_ui_or_console, f"Jarvis: {remark}", "model", True)
+        else:
+            display_message_in_ui_or_console(f"\nJarvis: {remark}", role="model")
+
+    async_core.submit(embellish())
+
+def print_help_to_console():
+    help_text = JARVIS_HELP_TEXT
     print(help_text)
     if gui_active_flag and chat_display_area_gui: # Also show in GUI if active
         display_message_in_ui_or_console(help_text, role="system_gui", is_gui_message=True)
 
 
 # --- MAIN CHAT LOOP (CLI) ---
-def add_to_conversation_history(role, text):
+def add_to_conversation_history(role, text, persist=True):
     global conversation_history
+    if persist: jarvis_store.append_history(role, text)
+    # Counted once, outside the lock (with USE_MODEL_TOKEN_COUNTER it is an API call), for both history buffers
+    tokens = count_text_tokens(clip_to_token_budget(text, MAX_MESSAGE_TOKENS))
     with chat_history_lock:
         conversation_history.append({"role": role, "text": text})
+        prompt_builder.append(role, text, tokens)
+        chat_turn_buffer.append(role, text, tokens)
+        dialogue_state.observe(role, text)
         # Trim history to manage size
         if len(conversation_history) > MAX_HISTORY_TURNS * 3 + 20: # User, Model, System per turn + buffer
             conversation_history = conversation_history[-(MAX_HISTORY_TURNS * 3 + 20):]
@@ -1669,10 +4641,12 @@ def start_cli_chat_loop():
         print("Jarvis: CRITICAL ERROR - Gemini API Key is not set. I am unable to function.")
         return
 
-    timer_thread = threading.Thread(target=timer_checker_thread_func,
-                                    args=(timer_thread_stop_event, handle_timer_notification_callback),
-                                    daemon=True)
-    timer_thread.start()
+    restore_persisted_state()
+    timer_task = async_core.submit(run_timer_checker(timer_thread_stop_event, handle_timer_notification_callback))
+    if backend_available("psutil"): threading.Thread(target=system_stats_sampler.start, daemon=True).start()
+    capability_registry.start()
+    if FILE_INDEX_ENABLED: file_index.start()
+    if APP_CATALOG_ENABLED and platform.system() in ("Linux", "Darwin"): app_catalog.start()
 
     initial_greeting = "Jarvis, version 3.0, online and at your service. How may I be of assistance today?"
     display_message_in_ui_or_console(f"Jarvis: {initial_greeting}", role="model")
@@ -1687,23 +4661,18 @@ def start_cli_chat_loop():
 
             if user_input_raw.lower() in ['exit', 'quit', 'goodbye', 'bye', 'later', 'see ya']:
                 display_message_in_ui_or_console("\nJarvis: It has been a privilege. Farewell for now.", role="model")
-                timer_thread_stop_event.set()
+                stop_timer_thread()
                 gui_thread_stop_event.set() # Signal GUI (if it were to be launched later) or main thread
-                if timer_thread.is_alive(): timer_thread.join(timeout=2)
+                async_core.wait(timer_task, 2)
                 break
             
-            current_user_input_item = {"role": "user", "text": user_input_raw}
-            with chat_history_lock: # Copy history for processing
-                temp_history_for_command_processing = list(conversation_history)
-            temp_history_for_command_processing.append(current_user_input_item) # Add current input for context
-
-            action_status = process_command(user_input_raw, temp_history_for_command_processing)
+            intent_name, action_status = route_command(user_input_raw, dialogue_state)
 
             if action_status == f"{ACTION_STATUS_PREFIX} GUI_LAUNCH_REQUESTED":
                 display_message_in_ui_or_console("Jarvis: Activating graphical interface...", role="model")
                 # The launch_gui_interface() will take over the main thread with tk.mainloop()
                 # So, this CLI loop will effectively pause here.
-                # Timer thread continues in background.
+                # The timer checker keeps running on the async core.
                 # We need to ensure that if GUI closes, this loop doesn't resume unexpectedly or handle it.
                 success_gui, msg_gui = launch_gui_interface() # This call blocks until GUI closes
                 # When launch_gui_interface returns, it means GUI was closed.
@@ -1712,8 +4681,8 @@ def start_cli_chat_loop():
                 if success_gui: # GUI was launched and then closed
                     # If os._exit(0) was called in on_gui_close, this won't run.
                     # If on_gui_close allows returning, we might need to stop timer and exit CLI cleanly.
-                    timer_thread_stop_event.set()
-                    if timer_thread.is_alive(): timer_thread.join(timeout=1)
+                    stop_timer_thread()
+                    async_core.wait(timer_task, 1)
                     print("INFO: Jarvis CLI loop ending after GUI session.")
                     break # Exit CLI loop as GUI handled the session end.
                 else: # GUI launch failed, continue CLI
@@ -1721,81 +4690,65 @@ def start_cli_chat_loop():
                     action_status = None # Reset action status
                     # Continue CLI loop
             
-            # --- LLM Interaction (if not GUI launch) ---
-            if action_status != f"{ACTION_STATUS_PREFIX} GUI_LAUNCH_REQUESTED":
-                with chat_history_lock:
-                    llm_prompt_history_list = list(conversation_history)
-                llm_prompt_history_list.append(current_user_input_item)
-                if action_status:
-                    llm_prompt_history_list.append({"role": "system", "text": action_status})
-
-                history_str_for_llm = ""
-                relevant_llm_history_items = llm_prompt_history_list[-(MAX_HISTORY_TURNS * 3 + 20):]
-                for item in relevant_llm_history_items:
-                    role_display = "Jarvis" if item['role'] == 'model' else "You" if item['role'] == 'user' else "System"
-                    if item['role'] == 'system': history_str_for_llm += f"{item['text']}\n"
-                    else: history_str_for_llm += f"{role_display}: {item['text']}\n"
-                
-                full_prompt_for_llm = JARVIS_PERSONA_BASE_PROMPT.format(history=history_str_for_llm.strip(), user_input=user_input_raw)
-                
-                jarvis_reply = "My apologies, a momentary lapse in my processing. Could you rephrase?"
-                try:
-                    # print(f"\n--- DEBUG: Sending to LLM (CLI) ---\n{full_prompt_for_llm}\n---------------------------\n")
-                    if GEMINI_API_KEY == "YOUR_GEMINI_API_KEY" or not GEMINI_API_KEY:
-                        jarvis_reply = "My connection to the Gemini network is not configured. Please set the API key."
-                    else:
-                        response = model.generate_content(full_prompt_for_llm)
-                        if response.candidates and response.candidates[0].content.parts:
-                            jarvis_reply = response.text.strip()
-                        elif response.prompt_feedback and response.prompt_feedback.block_reason:
-                             jarvis_reply = f"I'm unable to respond to that request due to content policy: {response.prompt_feedback.block_reason_message or response.prompt_feedback.block_reason}"
-                             print(f"WARN: LLM response blocked. Reason: {response.prompt_feedback.block_reason_message or response.prompt_feedback.block_reason}")
-                        else:
-                             print(f"WARN: LLM response empty/malformed: {response}")
-
-                except Exception as e_llm:
-                    error_message_detail = str(e_llm)
-                    if "API key not valid" in error_message_detail:
-                        jarvis_reply = "There appears to be an issue with the API key configuration. I am unable to connect."
-                    else:
-                        jarvis_reply = f"A slight cognitive dissonance occurred. If you could rephrase, perhaps? (Error: {str(e_llm)[:100]}...)"
-                    print(f"ERROR: LLM call failed (CLI): {e_llm}")
-
-                display_message_in_ui_or_console(f"Jarvis: {jarvis_reply}", role="model")
+            templated_reply = render_templated_reply(intent_name, action_status)
+            if templated_reply: # Deterministic result: answer locally, no LLM round-trip
+                display_message_in_ui_or_console(f"Jarvis: {templated_reply}", role="model")
+                add_to_conversation_history("user", user_input_raw)
+                add_to_conversation_history("system", action_status)
+                add_to_conversation_history("model", templated_reply)
+                start_deferred_embellishment(intent_name, "CLI")
+
+            # --- LLM Interaction (if not GUI launch or templated) ---
+            elif action_status != f"{ACTION_STATUS_PREFIX} GUI_LAUNCH_REQUESTED":
+                cli_stream_started = []
+                def print_reply_chunk(chunk):
+                    if not cli_stream_started:
+                        cli_stream_started.append(True)
+                        chunk = f"Jarvis: {chunk}"
+                    display_message_in_ui_or_console(chunk, role="model", end="")
+
+                jarvis_reply = generate_cached_jarvis_reply(user_input_raw, action_status,
+                                                            "My apologies, a momentary lapse in my processing. Could you rephrase?",
+                                                            on_chunk=print_reply_chunk, context_label="CLI")
+                display_message_in_ui_or_console("", role="model") # Finish the reply line
                 add_to_conversation_history("user", user_input_raw)
                 if action_status: add_to_conversation_history("system", action_status)
                 add_to_conversation_history("model", jarvis_reply)
 
         except KeyboardInterrupt:
             display_message_in_ui_or_console("\nJarvis: Understood. System disengaging. Farewell.", role="model")
-            timer_thread_stop_event.set()
+            stop_timer_thread()
             gui_thread_stop_event.set()
-            if timer_thread.is_alive(): timer_thread.join(timeout=2)
+            async_core.wait(timer_task, 2)
             break
         except EOFError: # Happens if stdin is closed, e.g. piping
             display_message_in_ui_or_console("\nJarvis: Input stream ended. Shutting down.", role="model")
-            timer_thread_stop_event.set()
+            stop_timer_thread()
             gui_thread_stop_event.set()
-            if timer_thread.is_alive(): timer_thread.join(timeout=2)
+            async_core.wait(timer_task, 2)
             break
         except Exception as e_main_loop:
             error_msg = f"A critical system fault occurred: {e_main_loop}. I may need to be restarted."
             display_message_in_ui_or_console(f"Jarvis: {error_msg}", role="model")
             print(f"FATAL ERROR in main loop: {e_main_loop}")
-            timer_thread_stop_event.set()
+            stop_timer_thread()
             gui_thread_stop_event.set()
-            if timer_thread.is_alive(): timer_thread.join(timeout=2)
+            async_core.wait(timer_task, 2)
             break
     
     # Cleanup if loop exited for reasons other than GUI taking over and exiting itself
-    if timer_thread.is_alive():
-        timer_thread_stop_event.set()
-        timer_thread.join(timeout=1)
+    if not timer_task.done():
+        stop_timer_thread()
+        async_core.wait(timer_task, 1)
     print("INFO: Jarvis CLI session has ended.")
 
 
 if __name__ == "__main__":
-    if GEMINI_API_KEY == "YOUR_GEMINI_API_KEY" or not GEMINI_API_KEY:
+    if BENCHMARK_MODE:
+        sys.modules["jarvis"] = sys.modules[__name__] # benchmarks.py drives this module rather than importing a second copy
+        import benchmarks
+        benchmarks.run_benchmarks(sys.argv[sys.argv.index("--benchmark") + 1:])
+    elif GEMINI_API_KEY == "YOUR_GEMINI_API_KEY" or not GEMINI_API_KEY:
         # This check is now primarily for the startup sequence before GUI/CLI logic
         # The individual loops also check.
         print("CRITICAL STARTUP ERROR: Gemini API Key not set in the script. Jarvis cannot operate.")
@@ -1804,6 +4757,11 @@ if __name__ == "__main__":
         # messagebox.showerror("API Key Error", "Gemini API Key is not set. Jarvis cannot operate.")
         # root_check.destroy()
     else:
+        if PRELOAD_BACKENDS_AT_STARTUP:
+            preload_optional_backends()
+            warm_up_model()
+        else:
+            start_model_warm_up() # Loads google.generativeai while the user reads the greeting
         # Initialize global conversation history (already done at top)
         # Start the CLI chat loop. It will handle transition to GUI if requested.
         start_cli_chat_loop()